@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+GenECG streaming coverage check
+===============================
+Streams a (small) split under several DataLoader worker counts and fails if any
+count loses or duplicates samples compared with a single process. Samples are
+compared by a digest of their encoded bytes, so nothing is decoded.
+
+Usage:
+    python benchmarks/check_stream_coverage.py --data-dir data/Raw/GenECG_parquet
+    python benchmarks/check_stream_coverage.py --split test --workers 0 2 4
+"""
+
+import argparse
+import hashlib
+import sys
+from collections import Counter
+from pathlib import Path
+
+from torch.utils.data import DataLoader, IterableDataset
+
+try:
+    from src.Data_pipeline.dataset import GenECGStreamingDataset
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[1]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.dataset import GenECGStreamingDataset
+
+
+class SampleKeys(IterableDataset):
+    """Yields a digest per encoded sample of a streaming dataset, before shuffling and decoding."""
+
+    def __init__(self, dataset: GenECGStreamingDataset):
+        self.dataset = dataset
+
+    def __iter__(self):
+        for image, label in self.dataset._samples():
+            data = image if isinstance(image, (bytes, bytearray)) else image.tobytes()
+            yield f"{hashlib.blake2b(data, digest_size=16).hexdigest()}:{label}"
+
+
+def check_worker_coverage(dataset: GenECGStreamingDataset, worker_counts=(0, 2, 4)) -> dict:
+    """
+    Verify that every DataLoader worker count streams exactly the same samples.
+
+    The single-process pass is the reference; each multi-worker pass must
+    yield every sample the same number of times, with nothing lost or
+    duplicated. Reads the whole split once per worker count.
+
+    Returns:
+        dict: {num_workers: samples seen}; raises RuntimeError on a mismatch.
+    """
+    reference = None
+    seen = {}
+    for num_workers in sorted(set((0,) + tuple(worker_counts))):
+        loader = DataLoader(SampleKeys(dataset), batch_size=None, num_workers=num_workers)
+        counts = Counter(loader)
+        seen[num_workers] = sum(counts.values())
+        if reference is None:
+            reference = counts
+        elif counts != reference:
+            missing = sum((reference - counts).values())
+            extra = sum((counts - reference).values())
+            raise RuntimeError(f"{num_workers} workers streamed {seen[num_workers]} samples "
+                               f"({missing} missing, {extra} duplicated) vs {seen[0]} in one process")
+    return seen
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check that GenECG streaming covers a split once per worker count.")
+    parser.add_argument("--data-dir", type=Path, default=None,
+                        help="Local Parquet shards to stream (default: the Hugging Face hub).")
+    parser.add_argument("--split", type=str, default="train", help="Dataset split (default: train).")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4],
+                        help="DataLoader worker counts to compare (default: 0 2 4).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    dataset = GenECGStreamingDataset(split=args.split, data_dir=args.data_dir, shuffle_buffer=0)
+    source = args.data_dir or "the Hugging Face hub"
+    print(f"🔍 Streaming the {args.split} split from {source} with {', '.join(map(str, args.workers))} workers...")
+    try:
+        seen = check_worker_coverage(dataset, args.workers)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+    for num_workers, count in seen.items():
+        print(f"   workers_{num_workers}: {count} samples")
+    print("✅ Every worker count streamed the same samples")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
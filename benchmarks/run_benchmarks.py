@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+GenECG performance benchmarks
+=============================
+Runs offline on synthetic ECG-sized PNGs and a small random-weight ViT, and
+reports label generation, dataloader and inference throughput plus the run's
+peak RSS.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+from torch.utils.data import DataLoader
+
+try:
+    from src.Data_pipeline.image_cache import MemmapImageDataset, build_image_cache, normalize_batch
+    from src.Data_pipeline.run_mass_label_generation import run_mass_labeling
+    from src.inference import ImagePathDataset, build_transform, predict, predict_batch
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[1]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.image_cache import MemmapImageDataset, build_image_cache, normalize_batch
+    from src.Data_pipeline.run_mass_label_generation import run_mass_labeling
+    from src.inference import ImagePathDataset, build_transform, predict, predict_batch
+
+BENCHMARKS = ["labels", "dataloader", "inference"]
+NUM_CLASSES = 65
+BUCKET_SIZE = 1000
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process and its finished children (ru_maxrss is KB on Linux, bytes on macOS).
+
+    ru_maxrss only ever grows, so this is recorded once for the whole run rather than per benchmark.
+    """
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) * scale, 1)
+
+
+def latency_stats(seconds) -> dict:
+    ms = np.asarray(seconds) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def make_synthetic_ecgs(out_dir: Path, count: int, width: int, height: int, seed: int = 0) -> list:
+    """
+    Write `count` ECG-like PNGs in the GenECG layout (00000/00001_hr_1R.png, ...).
+
+    Each sheet has the pink millimetre grid and four rows of traces, so PNG
+    size and decode cost are in the range of the real sheets.
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        ecg_id = i + 1
+        bucket = out_dir / f"{(ecg_id // BUCKET_SIZE) * BUCKET_SIZE:05d}"
+        bucket.mkdir(parents=True, exist_ok=True)
+
+        image = Image.new("RGB", (width, height), (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        for x in range(0, width, 10):
+            draw.line([(x, 0), (x, height)], fill=(240, 160, 160) if x % 50 == 0 else (250, 215, 215))
+        for y in range(0, height, 10):
+            draw.line([(0, y), (width, y)], fill=(240, 160, 160) if y % 50 == 0 else (250, 215, 215))
+
+        rows = 4
+        xs = np.arange(width)
+        heart_rate = rng.uniform(0.9, 1.6)
+        for row in range(rows):
+            baseline = (row + 0.5) * height / rows
+            phase = (xs * heart_rate / 160.0 + rng.uniform(0, 1)) % 1.0
+            qrs = np.exp(-((phase - 0.3) ** 2) / 0.0004) * height * 0.08
+            t_wave = np.exp(-((phase - 0.6) ** 2) / 0.004) * height * 0.02
+            ys = baseline - qrs - t_wave + rng.normal(0, 0.6, width)
+            draw.line(list(zip(xs.tolist(), ys.tolist())), fill=(0, 0, 0), width=2)
+
+        # Light scanner speckle: keeps PNG size (~200KB) and decode cost close to real sheets
+        pixels = np.array(image)
+        speckle = rng.random((height, width)) < 0.01
+        pixels[speckle] = rng.integers(180, 255, (int(speckle.sum()), 1), dtype=np.uint8)
+
+        path = bucket / f"{ecg_id:05d}_hr_1R.png"
+        Image.fromarray(pixels).save(path)
+        paths.append(path)
+    return paths
+
+
+def build_tiny_vit(num_classes: int = NUM_CLASSES, image_size: int = 224):
+    """Small random-weight ViT with the production input/output shapes (no hub download)."""
+    from transformers import ViTConfig, ViTForImageClassification
+
+    config = ViTConfig(
+        image_size=image_size,
+        patch_size=16,
+        hidden_size=192,
+        num_hidden_layers=4,
+        num_attention_heads=3,
+        intermediate_size=768,
+        num_labels=num_classes,
+    )
+    return ViTForImageClassification(config).eval()
+
+
+def bench_labels(image_paths, work_dir: Path, workers: int) -> dict:
+    raw_dir = image_paths[0].parents[1]
+    output_dir = work_dir / "labels"
+    results = {}
+    for n in sorted({1, workers}):
+        shutil.rmtree(output_dir, ignore_errors=True)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_mass_labeling(raw_dir, output_dir, workers=n)
+        elapsed = time.perf_counter() - start
+        results[f"workers_{n}"] = {"files_per_sec": round(len(image_paths) / elapsed, 1)}
+    return results
+
+
+def _loader_throughput(dataset, batch_size: int, num_workers: int, to_float=None) -> float:
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+    samples = 0
+    start = time.perf_counter()
+    for batch in loader:
+        images = batch[0]
+        if to_float is not None:
+            images = to_float(images)
+        samples += images.shape[0]
+    return round(samples / (time.perf_counter() - start), 1)
+
+
+def _write_parquet_shards(image_paths, shard_dir: Path, num_shards: int = 4):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    for shard in range(num_shards):
+        paths = image_paths[shard::num_shards]
+        table = pa.table({
+            "image": [{"bytes": p.read_bytes(), "path": p.name} for p in paths],
+            "label": [i % 5 for i in range(len(paths))],
+        })
+        pq.write_table(table, shard_dir / f"train-{shard:05d}-of-{num_shards:05d}.parquet", row_group_size=16)
+
+
+def bench_dataloader(image_paths, work_dir: Path, worker_counts, batch_size: int) -> dict:
+    """samples/sec for PNG decode (ImagePathDataset), the memmap image cache and local Parquet streaming."""
+    results = {"raw_png": {}, "image_cache": {}, "streaming_parquet": {}}
+
+    raw = ImagePathDataset(image_paths)
+    for n in worker_counts:
+        results["raw_png"][f"workers_{n}"] = {"samples_per_sec": _loader_throughput(raw, batch_size, n)}
+
+    cache_dir = work_dir / "image_cache"
+    start = time.perf_counter()
+    with contextlib.redirect_stderr(io.StringIO()):
+        build_image_cache(image_paths, cache_dir)
+    results["image_cache"]["build_files_per_sec"] = round(len(image_paths) / (time.perf_counter() - start), 1)
+    cached = MemmapImageDataset(cache_dir)
+    for n in worker_counts:
+        results["image_cache"][f"workers_{n}"] = {
+            "samples_per_sec": _loader_throughput(cached, batch_size, n, to_float=normalize_batch)
+        }
+
+    try:
+        from src.Data_pipeline.dataset import GenECGStreamingDataset
+    except ImportError as err:  # pragma: no cover - optional dependency
+        results["streaming_parquet"] = {"skipped": f"{err}"}
+    else:
+        shard_dir = work_dir / "shards"
+        _write_parquet_shards(image_paths, shard_dir)
+        streaming = GenECGStreamingDataset(data_dir=shard_dir, shuffle_buffer=64)
+        for n in worker_counts:
+            results["streaming_parquet"][f"workers_{n}"] = {
+                "samples_per_sec": _loader_throughput(streaming, batch_size, n)
+            }
+
+    return results
+
+
+def bench_inference(image_paths, batch_sizes, iterations: int, warmup: int = 3) -> dict:
+    """End-to-end predict() latency per image and predict_batch() latency per batch size."""
+    device = torch.device("cpu")
+    model = build_tiny_vit().to(device)
+    snomed_cols = [f"SNOMED_{i}" for i in range(NUM_CLASSES)]
+    results = {}
+
+    timings = []
+    for i in range(warmup + iterations):
+        start = time.perf_counter()
+        predict(model, image_paths[i % len(image_paths)], snomed_cols, device)
+        if i >= warmup:
+            timings.append(time.perf_counter() - start)
+    results["single_image"] = latency_stats(timings)
+
+    transform = build_transform()
+    with Image.open(image_paths[0]) as image:
+        sample = transform(image.convert("RGB"))
+    for batch_size in batch_sizes:
+        batch = sample.unsqueeze(0).repeat(batch_size, 1, 1, 1)
+        timings = []
+        for i in range(warmup + iterations):
+            start = time.perf_counter()
+            predict_batch(model, batch, device)
+            if i >= warmup:
+                timings.append(time.perf_counter() - start)
+        stats = latency_stats(timings)
+        stats["images_per_sec"] = round(batch_size / (np.mean(timings)), 1)
+        results[f"batch_{batch_size}"] = stats
+
+    return results
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def higher_is_better(metric: str):
+    """True/False for throughput/latency metrics, None for metrics that are not compared."""
+    if metric.endswith("_per_sec"):
+        return True
+    if metric.endswith("_ms") or metric.endswith("rss_mb"):
+        return False
+    return None
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Print a per-metric comparison table and return the metrics that regressed.
+
+    A metric regresses when it is worse than the baseline by more than `tolerance`
+    (relative), in its own direction (lower latency / higher throughput is better).
+    """
+    now, then = flatten(current["results"]), flatten(baseline["results"])
+    regressions = []
+    print(f"\n{'Metric':<52} {'Baseline':>12} {'Current':>12} {'Change':>9}")
+    print("-" * 88)
+    for metric in sorted(set(now) & set(then)):
+        direction = higher_is_better(metric)
+        if direction is None or not then[metric]:
+            continue
+        change = (now[metric] - then[metric]) / then[metric]
+        worse = -change if direction else change
+        flag = ""
+        if worse > tolerance:
+            flag = " 🔴"
+            regressions.append(metric)
+        elif worse < -tolerance:
+            flag = " 🟢"
+        print(f"{metric:<52} {then[metric]:>12.2f} {now[metric]:>12.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark GenECG label generation, data loading and inference.")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help="Benchmarks to run (default: all).")
+    parser.add_argument("--num-images", type=int, default=64, help="Synthetic images to generate (default: 64).")
+    parser.add_argument("--image-width", type=int, default=1600, help="Synthetic sheet width (default: 1600).")
+    parser.add_argument("--image-height", type=int, default=1200, help="Synthetic sheet height (default: 1200).")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4],
+                        help="DataLoader worker counts to measure (default: 0 2 4).")
+    parser.add_argument("--batch-size", type=int, default=16, help="DataLoader batch size (default: 16).")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32],
+                        help="Inference batch sizes (default: 1 8 32).")
+    parser.add_argument("--iterations", type=int, default=30, help="Timed inference iterations (default: 30).")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch's choice).")
+    parser.add_argument("--work-dir", type=Path, default=None,
+                        help="Where synthetic data is written (default: a temporary directory, removed afterwards).")
+    parser.add_argument("--output", type=Path, default=None, help="Write results JSON here.")
+    parser.add_argument("--compare", type=Path, default=None, help="Baseline results JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Relative slowdown tolerated before a metric counts as a regression (default: 0.10).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix="genecg_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "results": {},
+    }
+
+    try:
+        print(f"📦 Generating {args.num_images} synthetic {args.image_width}x{args.image_height} ECGs in {work_dir}...")
+        image_paths = make_synthetic_ecgs(work_dir / "raw", args.num_images, args.image_width, args.image_height)
+
+        if "labels" in args.only:
+            print("🚀 Label generation...")
+            report["results"]["labels"] = bench_labels(image_paths, work_dir, max(args.workers))
+        if "dataloader" in args.only:
+            print("🚀 Dataloaders...")
+            report["results"]["dataloader"] = bench_dataloader(image_paths, work_dir, args.workers, args.batch_size)
+        if "inference" in args.only:
+            print("🚀 Inference...")
+            report["results"]["inference"] = bench_inference(image_paths, args.batch_sizes, args.iterations)
+        report["results"]["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(report["results"], indent=2))
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            return 1
+        print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
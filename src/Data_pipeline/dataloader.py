@@ -1,14 +1,39 @@
+import os
+
 from torch.utils.data import DataLoader
-from src.Data_pipeline.dataset import GenECGHFDataset
+from src.Data_pipeline.dataset import GenECGHFDataset, GenECGStreamingDataset
+
+def get_dataloader(batch_size=8, image_size=224, shuffle=True, streaming=False, data_dir=None,
+                   num_workers=None, shuffle_buffer=1000):
+    """
+    Build a GenECG DataLoader.
+
+    With `streaming=True` (or a local `data_dir` of Parquet shards) samples are
+    streamed through GenECGStreamingDataset, so the first batch arrives without
+    downloading the whole split and decoding runs in `num_workers` processes.
+    """
+    if streaming or data_dir is not None:
+        dataset = GenECGStreamingDataset(
+            image_size=image_size,
+            data_dir=data_dir,
+            shuffle_buffer=shuffle_buffer if shuffle else 0,
+        )
+        if num_workers is None:
+            num_workers = min(4, os.cpu_count() or 1)
+        return DataLoader(
+            dataset,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            prefetch_factor=2 if num_workers > 0 else None,
+        )
 
-def get_dataloader(batch_size=8, image_size=224, shuffle=True):
     dataset = GenECGHFDataset(image_size=image_size)
 
     loader = DataLoader(
         dataset,
         batch_size=batch_size,
         shuffle=shuffle,
-        num_workers=0  # important for Mac M1
+        num_workers=0 if num_workers is None else num_workers  # 0 by default: important for Mac M1
     )
 
     return loader
@@ -1,10 +1,42 @@
 # src/Data_pipeline/dataset.py
 
+import io
+import json
 import os
+import random
+from pathlib import Path
+
+import torch.distributed as dist
 from datasets import load_dataset
-from torch.utils.data import Dataset
+from PIL import Image
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 from torchvision import transforms
 
+from src import profiling
+
+
+def _require_token():
+    token = os.environ.get("HF_TOKEN")
+    if not token:
+        raise RuntimeError(
+            "HF_TOKEN is not set.\n"
+            "In VS Code terminal run:\n"
+            'export HF_TOKEN="YOUR_TOKEN_HERE"\n'
+            "Then run your script again."
+        )
+    return token
+
+
+def build_transform(image_size: int = 224):
+    return transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(
+            mean=(0.5, 0.5, 0.5),
+            std=(0.5, 0.5, 0.5)
+        ),
+    ])
+
 
 class GenECGHFDataset(Dataset):
     """
@@ -13,14 +45,7 @@ class GenECGHFDataset(Dataset):
     """
 
     def __init__(self, image_size: int = 224, split: str = "train"):
-        token = os.environ.get("HF_TOKEN")
-        if not token:
-            raise RuntimeError(
-                "HF_TOKEN is not set.\n"
-                "In VS Code terminal run:\n"
-                'export HF_TOKEN="YOUR_TOKEN_HERE"\n'
-                "Then run your script again."
-            )
+        token = _require_token()
 
         # Load dataset (cached automatically after first download)
         self.dataset = load_dataset(
@@ -31,24 +56,168 @@ class GenECGHFDataset(Dataset):
 
         self.label_names = self.dataset.features["label"].names  # e.g., ['NORM','MI','STTC','CD','HYP']
 
-        self.transform = transforms.Compose([
-            transforms.Resize((image_size, image_size)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=(0.5, 0.5, 0.5),
-                std=(0.5, 0.5, 0.5)
-            ),
-        ])
+        self.transform = build_transform(image_size)
 
     def __len__(self) -> int:
         return len(self.dataset)
 
     def __getitem__(self, idx: int):
-        item = self.dataset[idx]
+        with profiling.stage("dataset.hf_fetch"):
+            item = self.dataset[idx]
 
-        # Hugging Face returns a PIL Image for the "image" column
-        image = item["image"].convert("RGB")
-        label = int(item["label"])
+            # Hugging Face returns a PIL Image for the "image" column
+            image = item["image"].convert("RGB")
+            label = int(item["label"])
 
-        image = self.transform(image)
+        with profiling.stage("dataset.transform"):
+            image = self.transform(image)
         return image, label
+
+
+def _dist_rank():
+    """(rank, world size) of this process, (0, 1) when not distributed."""
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+def _worker_slot():
+    """(index, count) of this DataLoader worker across all distributed ranks."""
+    info = get_worker_info()
+    worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+    rank, world_size = _dist_rank()
+    return rank * num_workers + worker_id, world_size * num_workers
+
+
+def local_shards(data_dir: Path, split: str = "train") -> list:
+    """Parquet shards for `split` under data_dir (Hub layout: data/train-00000-of-00010.parquet)."""
+    files = sorted(Path(data_dir).rglob("*.parquet"))
+    matched = [f for f in files if f.name.startswith(f"{split}-") or split in f.parent.parts]
+    return matched or files
+
+
+def _label_names_from_parquet(parquet_file):
+    """Class names stored by `datasets` in the Parquet schema metadata, if any."""
+    metadata = parquet_file.schema_arrow.metadata or {}
+    try:
+        features = json.loads(metadata[b"huggingface"])["info"]["features"]
+        return features["label"]["names"]
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+class GenECGStreamingDataset(IterableDataset):
+    """
+    Streams GenECG samples without materialising the split.
+
+    Samples come either from the Hub in streaming mode or, with `data_dir`,
+    from local Parquet shards (offline). Shards (or Parquet row groups, when
+    there are fewer files than workers) are divided between DataLoader
+    workers and distributed ranks, so every worker reads a disjoint slice.
+    Encoded image bytes pass through a fixed-size shuffle buffer and are only
+    decoded when they leave it, which keeps memory bounded by
+    `shuffle_buffer` compressed images per worker.
+
+    Args:
+        image_size (int): Output side length.
+        split (str): Dataset split.
+        data_dir (Path, optional): Directory of Parquet shards to read instead of the Hub.
+        shuffle_buffer (int): Samples held for shuffling (0 disables shuffling).
+        seed (int): Base seed; combined with the epoch (see `set_epoch`) and worker.
+    """
+
+    def __init__(self, image_size: int = 224, split: str = "train", data_dir=None,
+                 shuffle_buffer: int = 1000, seed: int = 42):
+        self.split = split
+        self.data_dir = Path(data_dir) if data_dir is not None else None
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+        self.transform = build_transform(image_size)
+
+        if self.data_dir is not None:
+            import pyarrow.parquet as pq
+
+            self.shards = local_shards(self.data_dir, split)
+            if not self.shards:
+                raise FileNotFoundError(f"No Parquet shards found under {self.data_dir}")
+            self.label_names = _label_names_from_parquet(pq.ParquetFile(self.shards[0]))
+        else:
+            self.token = _require_token()
+            self.dataset = load_dataset("edcci/GenECG", split=split, token=self.token, streaming=True)
+            label_feature = (self.dataset.features or {}).get("label")
+            self.label_names = getattr(label_feature, "names", None)
+
+    def set_epoch(self, epoch: int):
+        """Reshuffle differently on every epoch (call before iterating)."""
+        self.epoch = epoch
+
+    def _local_samples(self, slot: int, num_slots: int):
+        import pyarrow.parquet as pq
+
+        files = [pq.ParquetFile(path) for path in self.shards]
+        if len(files) >= num_slots:
+            units = [(f, None) for f in files]
+        else:
+            # Not enough files to go round: hand out individual row groups
+            units = [(f, [g]) for f in files for g in range(f.num_row_groups)]
+
+        for parquet_file, row_groups in units[slot::num_slots]:
+            for batch in parquet_file.iter_batches(batch_size=64, row_groups=row_groups, columns=["image", "label"]):
+                images = batch.column("image").to_pylist()
+                labels = batch.column("label").to_pylist()
+                for image, label in zip(images, labels):
+                    yield image["bytes"], label
+
+    def _hub_samples(self, rank: int, world_size: int):
+        from datasets import Image as HFImage
+        from datasets.distributed import split_dataset_by_node
+
+        # Keep the encoded bytes; decoding happens after the shuffle buffer.
+        # Split by distributed rank only: `datasets` already divides a streamed
+        # dataset between DataLoader workers, and splitting by worker here too
+        # would leave each worker with 1/num_workers of its share.
+        dataset = self.dataset.cast_column("image", HFImage(decode=False))
+        if world_size > 1:
+            dataset = split_dataset_by_node(dataset, rank=rank, world_size=world_size)
+        for item in dataset:
+            image = item["image"]
+            yield (image["bytes"] if isinstance(image, dict) else image), item["label"]
+
+    def _decode(self, image, label):
+        with profiling.stage("dataset.decode"):
+            if isinstance(image, (bytes, bytearray)):
+                image = Image.open(io.BytesIO(image))
+            image = image.convert("RGB")
+        with profiling.stage("dataset.transform"):
+            return self.transform(image), int(label)
+
+    def _samples(self):
+        """Encoded (image, label) pairs for this worker, before shuffling and decoding."""
+        if self.data_dir is not None:
+            return self._local_samples(*_worker_slot())
+        return self._hub_samples(*_dist_rank())
+
+    def __iter__(self):
+        slot, _ = _worker_slot()
+        samples = self._samples()
+
+        if self.shuffle_buffer <= 0:
+            for image, label in samples:
+                yield self._decode(image, label)
+            return
+
+        rng = random.Random(f"{self.seed}-{self.epoch}-{slot}")
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            idx = rng.randrange(len(buffer))
+            buffer[idx], sample = sample, buffer[idx]
+            yield self._decode(*sample)
+
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._decode(*sample)
+
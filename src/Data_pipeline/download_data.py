@@ -1,9 +1,18 @@
 
-from huggingface_hub import snapshot_download, HfApi, RepoFolder
-from huggingface_hub.errors import HfHubHTTPError
+from huggingface_hub import HfApi, RepoFolder
 from dotenv import load_dotenv
 import os
-import time
+import sys
+from pathlib import Path
+
+try:
+    from src.Data_pipeline.download_manager import DownloadManager, HfHubClient
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.download_manager import DownloadManager, HfHubClient
 
 def get_subfolders(api, repo_id, parent_folder):
     """
@@ -16,9 +25,13 @@ def get_subfolders(api, repo_id, parent_folder):
             subfolders.append(item.path)
     return subfolders
 
-def download_gen_ecg_dataset():
+def download_gen_ecg_dataset(workers=4):
     """
     Downloads the GenECG dataset from Hugging Face Hub, one subfolder at a time.
+
+    Each subfolder is fetched by a DownloadManager: files are downloaded in
+    parallel, verified against the repo listing, and partially downloaded
+    subfolders are resumed rather than skipped.
     """
     load_dotenv()
     repo_id = "edcci/GenECG"
@@ -31,6 +44,7 @@ def download_gen_ecg_dataset():
         return
 
     api = HfApi(token=token)
+    manager = DownloadManager(HfHubClient(repo_id, token), local_dir, workers=workers)
     parent_folders = ["Dataset_A_ECGs_without_imperfections", "Dataset_B_ECGs_with_imperfections"]
 
     for parent_folder in parent_folders:
@@ -38,28 +52,14 @@ def download_gen_ecg_dataset():
         subfolders = get_subfolders(api, repo_id, parent_folder)
         
         for subfolder in subfolders:
-            local_subfolder_path = os.path.join(local_dir, subfolder)
-            if os.path.exists(local_subfolder_path):
-                print(f"Subfolder {subfolder} already exists locally. Skipping.")
-                continue
-
             print(f"Downloading subfolder {subfolder}...")
             try:
-                snapshot_download(
-                    repo_id=repo_id,
-                    repo_type="dataset",
-                    local_dir=local_dir,
-                    allow_patterns=f"{subfolder}/*",
-                    local_dir_use_symlinks=False,
-                    token=token,
-                )
-                print(f"Finished downloading {subfolder}.")
-                print("Waiting 10 seconds before next download...")
-                time.sleep(10)
+                stats = manager.run([subfolder])
+                print(f"Finished {subfolder}: {stats['downloaded']} downloaded, "
+                      f"{stats['skipped']} already complete, {stats['failed']} failed.")
+                for path, err in stats["errors"][:5]:
+                    print(f"  {path}: {err}")
 
-            except HfHubHTTPError as e:
-                print(f"Failed to download {subfolder}: {e}")
-                print("Continuing to the next subfolder.")
             except Exception as e:
                 print(f"An unexpected error occurred during download of {subfolder}: {e}")
                 print("Continuing to the next subfolder.")
@@ -0,0 +1,454 @@
+"""Parallel, resumable GenECG downloader with verification and adaptive rate-limit backoff."""
+
+import argparse
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import NamedTuple
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from tqdm import tqdm
+
+try:
+    from src.Data_pipeline.image_cache import ImageCacheWriter, ecg_id_from_path
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.image_cache import ImageCacheWriter, ecg_id_from_path
+
+REPO_ID = "edcci/GenECG"
+DEFAULT_LOCAL_DIR = Path("data/Raw/GenECG")
+PARENT_FOLDERS = ["Dataset_A_ECGs_without_imperfections", "Dataset_B_ECGs_with_imperfections"]
+CHUNK_SIZE = 1 << 20
+PART_SUFFIX = ".part"
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RemoteFile(NamedTuple):
+    path: str  # relative to the repo root, POSIX style
+    size: int
+    sha256: str | None = None
+
+
+class RateLimited(Exception):
+    """The hub asked us to slow down (HTTP 429/503)."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after_seconds(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class HfHubClient:
+    """
+    Hugging Face hub access: tree listing with sizes/LFS hashes and ranged file streams.
+
+    Args:
+        repo_id (str): Dataset repository id.
+        token (str, optional): Access token (HUGGING_FACE_TOKEN).
+        revision (str): Branch, tag or commit to download.
+    """
+
+    def __init__(self, repo_id: str = REPO_ID, token: str | None = None, revision: str = "main"):
+        from huggingface_hub import HfApi
+
+        self.repo_id = repo_id
+        self.token = token
+        self.revision = revision
+        self.api = HfApi(token=token)
+
+    def list_files(self, folder: str) -> list:
+        from huggingface_hub import RepoFile
+        from huggingface_hub.errors import HfHubHTTPError
+
+        try:
+            tree = self.api.list_repo_tree(
+                self.repo_id, path_in_repo=folder, repo_type="dataset", revision=self.revision, recursive=True,
+            )
+            files = []
+            for item in tree:
+                if isinstance(item, RepoFile):
+                    lfs = item.lfs
+                    sha256 = lfs.get("sha256") if isinstance(lfs, dict) else getattr(lfs, "sha256", None)
+                    files.append(RemoteFile(item.path, item.size, sha256))
+            return files
+        except HfHubHTTPError as err:
+            status = getattr(err.response, "status_code", None)
+            if status in (429, 503):
+                raise RateLimited(str(err), _retry_after_seconds(err.response.headers.get("Retry-After"))) from err
+            raise
+
+    def open(self, path: str, offset: int = 0):
+        """
+        Stream one file, starting at `offset` when the server honours the range.
+
+        Returns:
+            tuple: (readable stream, offset actually served)
+        """
+        from huggingface_hub import hf_hub_url
+        from huggingface_hub.utils import build_hf_headers
+
+        url = hf_hub_url(self.repo_id, path, repo_type="dataset", revision=self.revision)
+        request = Request(url)
+        for key, value in build_hf_headers(token=self.token).items():
+            # Unredirected: the token must not follow the redirect to the CDN
+            request.add_unredirected_header(key, value)
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        try:
+            response = urlopen(request, timeout=60)
+        except HTTPError as err:
+            if err.code in (429, 503):
+                raise RateLimited(f"HTTP {err.code} for {path}", _retry_after_seconds(err.headers.get("Retry-After")))
+            if err.code == 416:  # range past the end: start again from scratch
+                return self.open(path, 0)
+            raise
+        return response, offset if response.status == 206 else 0
+
+
+class LocalHubClient:
+    """
+    Stand-in for the hub that serves a local directory with the same interface.
+
+    `rate_limit_every` makes every n-th request fail with RateLimited so the
+    backoff path can be exercised without network access.
+    """
+
+    def __init__(self, root: Path, rate_limit_every: int = 0, retry_after: float = 0.05):
+        self.root = Path(root)
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _maybe_throttle(self, what: str):
+        with self._lock:
+            self.requests += 1
+            throttled = self.rate_limit_every and self.requests % self.rate_limit_every == 0
+        if throttled:
+            raise RateLimited(f"simulated 429 for {what}", self.retry_after)
+
+    def list_files(self, folder: str) -> list:
+        self._maybe_throttle(folder)
+        files = []
+        for path in sorted((self.root / folder).rglob("*")):
+            if path.is_file():
+                files.append(RemoteFile(path.relative_to(self.root).as_posix(), path.stat().st_size, _sha256_file(path)))
+        return files
+
+    def open(self, path: str, offset: int = 0):
+        self._maybe_throttle(path)
+        stream = open(self.root / path, "rb")
+        stream.seek(offset)
+        return stream, offset
+
+
+class AdaptiveBackoff:
+    """
+    Shared pause used by every worker.
+
+    A rate-limit response pauses all workers for Retry-After (or the current
+    delay, doubling on consecutive hits); each success halves the delay again,
+    so throughput recovers as soon as the hub stops pushing back.
+    """
+
+    def __init__(self, initial: float = 1.0, maximum: float = 120.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = initial
+        self.resume_at = 0.0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self.resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def on_rate_limited(self, retry_after: float | None = None):
+        with self._lock:
+            self.rate_limited += 1
+            pause = retry_after if retry_after is not None else self.delay
+            self.resume_at = max(self.resume_at, time.monotonic() + pause)
+            self.delay = min(self.delay * 2, self.maximum)
+
+    def on_success(self):
+        with self._lock:
+            self.delay = max(self.delay / 2, self.initial)
+
+
+class DownloadManager:
+    """
+    Downloads repo folders with a bounded thread pool.
+
+    Files land as `<name>.part` and are renamed only after their size (and,
+    with verify="sha256", their LFS checksum) matches the tree listing, so an
+    interrupted run resumes from the partial bytes instead of skipping the
+    folder. Files already complete on disk are not fetched again.
+
+    Args:
+        client: HfHubClient, LocalHubClient or anything with list_files()/open().
+        local_dir (Path): Destination root (repo paths are kept below it).
+        workers (int): Concurrent downloads.
+        verify (str): "size" or "sha256".
+        max_retries (int): Attempts per file for non rate-limit errors.
+        keep_files (bool): Write files to local_dir. When False, files are only
+            handed to `on_file` in memory (e.g. to fill the image cache).
+        on_file (callable, optional): Called as on_file(remote, source) for each
+            complete file, where source is a local Path or an in-memory stream.
+    """
+
+    def __init__(self, client, local_dir: Path = DEFAULT_LOCAL_DIR, workers: int = 4, verify: str = "size",
+                 max_retries: int = 5, keep_files: bool = True, on_file=None, backoff: AdaptiveBackoff | None = None):
+        if verify not in ("size", "sha256"):
+            raise ValueError(f"verify must be 'size' or 'sha256', got {verify!r}")
+        self.client = client
+        self.local_dir = Path(local_dir)
+        self.workers = workers
+        self.verify = verify
+        self.max_retries = max_retries
+        self.keep_files = keep_files
+        self.on_file = on_file
+        self.backoff = backoff or AdaptiveBackoff()
+
+    def _call(self, func, *args):
+        """Run a client call, waiting out rate limits and retrying other errors with exponential delays."""
+        failures = 0
+        while True:
+            self.backoff.wait()
+            try:
+                result = func(*args)
+                self.backoff.on_success()
+                return result
+            except RateLimited as err:
+                self.backoff.on_rate_limited(err.retry_after)
+            except (OSError, URLError, ValueError):
+                failures += 1
+                if failures >= self.max_retries:
+                    raise
+                time.sleep(min(2 ** failures, 60))
+
+    def list_remote(self, folders) -> list:
+        remote = []
+        for folder in folders:
+            remote.extend(self._call(self.client.list_files, folder))
+        return remote
+
+    def local_path(self, remote: RemoteFile) -> Path:
+        return self.local_dir / remote.path
+
+    def is_complete(self, remote: RemoteFile) -> bool:
+        path = self.local_path(remote)
+        try:
+            if path.stat().st_size != remote.size:
+                return False
+        except FileNotFoundError:
+            return False
+        return self.verify != "sha256" or remote.sha256 is None or _sha256_file(path) == remote.sha256
+
+    def _check(self, remote: RemoteFile, size: int, digest):
+        if size != remote.size:
+            raise ValueError(f"{remote.path}: expected {remote.size} bytes, got {size}")
+        if self.verify == "sha256" and remote.sha256 and digest.hexdigest() != remote.sha256:
+            raise ValueError(f"{remote.path}: sha256 mismatch")
+
+    def _fetch_to_disk(self, remote: RemoteFile) -> Path:
+        path = self.local_path(remote)
+        part = path.with_name(path.name + PART_SUFFIX)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        offset = part.stat().st_size if part.exists() else 0
+        if offset > remote.size:
+            offset = 0
+        stream, offset = self.client.open(remote.path, offset)
+
+        digest = hashlib.sha256()
+        with stream, open(part, "r+b" if offset else "wb") as out:
+            if offset:
+                # Resuming: hash the bytes already on disk so the checksum covers the whole file
+                if self.verify == "sha256":
+                    while chunk := out.read(CHUNK_SIZE):
+                        digest.update(chunk)
+                out.seek(offset)
+                out.truncate()
+            written = offset
+            while chunk := stream.read(CHUNK_SIZE):
+                out.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+
+        if written < remote.size:
+            # Stream ended early: keep the partial bytes so the retry resumes from them
+            raise ValueError(f"{remote.path}: expected {remote.size} bytes, got {written}")
+        try:
+            self._check(remote, written, digest)
+        except ValueError:
+            part.unlink(missing_ok=True)  # corrupt, not merely short: start over next attempt
+            raise
+        os.replace(part, path)
+        return path
+
+    def _fetch_to_memory(self, remote: RemoteFile) -> io.BytesIO:
+        stream, _ = self.client.open(remote.path, 0)
+        with stream:
+            data = stream.read()
+        self._check(remote, len(data), hashlib.sha256(data))
+        return io.BytesIO(data)
+
+    def download(self, remote: RemoteFile):
+        """Fetch one file (with retries) and pass it to on_file; returns the local Path or stream."""
+        fetch = self._fetch_to_disk if self.keep_files else self._fetch_to_memory
+        source = self._call(fetch, remote)
+        if self.on_file is not None:
+            self.on_file(remote, source)
+        return source
+
+    def run(self, folders, remote_files=None) -> dict:
+        """
+        Download every file under `folders` that is not already complete locally.
+
+        Returns:
+            dict: Counts of downloaded, skipped and failed files, bytes fetched,
+            rate-limit responses and the failures themselves.
+        """
+        remote_files = remote_files if remote_files is not None else self.list_remote(folders)
+        complete = [self.keep_files and self.is_complete(remote) for remote in remote_files]
+
+        stats = {"downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0, "errors": []}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool, \
+                tqdm(total=len(remote_files), unit="file") as progress:
+            futures = {}
+            for remote, done in zip(remote_files, complete):
+                if not done:
+                    futures[pool.submit(self.download, remote)] = (remote, "downloaded")
+                elif self.on_file is not None:
+                    futures[pool.submit(self.on_file, remote, self.local_path(remote))] = (remote, "skipped")
+                else:
+                    stats["skipped"] += 1
+                    progress.update(1)
+
+            for future in as_completed(futures):
+                remote, outcome = futures[future]
+                try:
+                    future.result()
+                    stats[outcome] += 1
+                    if outcome == "downloaded":
+                        stats["bytes"] += remote.size
+                except Exception as err:
+                    stats["failed"] += 1
+                    stats["errors"].append((remote.path, str(err)))
+                progress.update(1)
+
+        stats["rate_limited"] = self.backoff.rate_limited
+        stats["seconds"] = time.perf_counter() - start
+        return stats
+
+
+class ImageCacheSink:
+    """
+    on_file callback that decodes each downloaded PNG straight into an image cache.
+
+    Slots are assigned from the remote listing up front, so the cache layout does
+    not depend on download order and files already on disk are cached too.
+    """
+
+    def __init__(self, cache_dir: Path, remote_files, image_size: int = 224):
+        image_paths = sorted(r.path for r in remote_files if r.path.lower().endswith(".png"))
+        self.slots = {path: idx for idx, path in enumerate(image_paths)}
+        self.writer = ImageCacheWriter(cache_dir, len(image_paths), image_size)
+
+    def __call__(self, remote: RemoteFile, source):
+        idx = self.slots.get(remote.path)
+        if idx is not None:
+            self.writer.write(idx, ecg_id_from_path(remote.path), source)
+
+    def close(self):
+        self.writer.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download GenECG in parallel with resume and verification.")
+    parser.add_argument("folders", nargs="*", default=PARENT_FOLDERS,
+                        help="Repo folders to download (default: both GenECG datasets).")
+    parser.add_argument("--local-dir", type=Path, default=DEFAULT_LOCAL_DIR, help=f"Destination (default: {DEFAULT_LOCAL_DIR}).")
+    parser.add_argument("--repo-id", default=REPO_ID, help=f"Dataset repository (default: {REPO_ID}).")
+    parser.add_argument("--source-dir", type=Path, default=None,
+                        help="Serve files from this local directory instead of the hub (offline testing).")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent downloads (default: 4).")
+    parser.add_argument("--verify", choices=["size", "sha256"], default="size",
+                        help="Check downloads by size or by LFS sha256 (default: size).")
+    parser.add_argument("--image-cache", type=Path, default=None,
+                        help="Also decode every PNG into this image cache as it arrives.")
+    parser.add_argument("--image-size", type=int, default=224, help="Image cache resolution (default: 224).")
+    parser.add_argument("--no-keep-files", action="store_true",
+                        help="With --image-cache, keep images in memory only instead of writing PNGs.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.no_keep_files and args.image_cache is None:
+        print("❌ --no-keep-files requires --image-cache")
+        sys.exit(1)
+
+    if args.source_dir is not None:
+        client = LocalHubClient(args.source_dir)
+    else:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        token = os.getenv("HUGGING_FACE_TOKEN")
+        if not token:
+            print("Hugging Face token not found in `.env` file.")
+            print("Please create a `.env` file and add your Hugging Face access token to it.")
+            sys.exit(1)
+        client = HfHubClient(args.repo_id, token)
+
+    manager = DownloadManager(client, args.local_dir, args.workers, args.verify, keep_files=not args.no_keep_files)
+    print(f"🔍 Listing {', '.join(args.folders)}...")
+    remote_files = manager.list_remote(args.folders)
+    total_bytes = sum(r.size for r in remote_files)
+    print(f"📦 {len(remote_files)} files, {total_bytes / 1e9:.2f} GB")
+
+    sink = None
+    if args.image_cache is not None:
+        sink = ImageCacheSink(args.image_cache, remote_files, args.image_size)
+        manager.on_file = sink
+
+    stats = manager.run(args.folders, remote_files)
+    if sink is not None:
+        sink.close()
+
+    for path, err in stats["errors"][:20]:
+        print(f"Error on {path}: {err}")
+    print(f"\n✅ Downloaded {stats['downloaded']} files ({stats['bytes'] / 1e6:.1f} MB) in {stats['seconds']:.1f}s | "
+          f"{stats['skipped']} already complete | {stats['failed']} failed | "
+          f"{stats['rate_limited']} rate-limit responses")
+    if stats["failed"]:
+        print("Re-run the same command to resume the failed files.")
+        sys.exit(1)
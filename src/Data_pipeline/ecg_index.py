@@ -0,0 +1,159 @@
+"""Persistent ecg_id <-> image index joined with the SNOMED labels."""
+
+import argparse
+import os
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RAW_DIR = Path("data/Raw/GenECG/Dataset_A_ECGs_without_imperfections")
+DEFAULT_LABELS = Path("data/Processed/ptbxl_with_snomed.parquet")
+DEFAULT_INDEX = Path("data/Processed/ecg_index.parquet")
+
+# Real GenECG PNGs are several hundred KB; anything smaller is a Git LFS pointer (see GEMINI.md)
+LFS_POINTER_MAX_BYTES = 50 * 1024
+INDEX_COLUMNS = ["ecg_id", "path", "size", "is_lfs_pointer"]
+# Numeric prefix of a GenECG file name (00001_hr_1R.png), matched on POSIX-style paths
+ECG_ID_PATTERN = re.compile(r"(?:^|/)(\d+)_[^/]*$")
+
+
+def scan_images(raw_dir: Path, suffixes=(".png",)) -> pd.DataFrame:
+    """
+    List every image under raw_dir with os.scandir (sizes come from the same pass).
+
+    The tree is walked directory by directory, so the 00000/, 01000/ bucket
+    folders are covered without a per-file stat through pathlib.
+
+    Returns:
+        pd.DataFrame: Columns `path` (relative to raw_dir, POSIX style) and `size` in bytes.
+    """
+    raw_dir = Path(raw_dir)
+    paths, sizes = [], []
+    pending = [(str(raw_dir), "")]
+    while pending:
+        directory, prefix = pending.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    pending.append((entry.path, f"{prefix}{entry.name}/"))
+                elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                    paths.append(prefix + entry.name)
+                    sizes.append(entry.stat().st_size)
+
+    return pd.DataFrame({"path": paths, "size": np.asarray(sizes, dtype=np.int64)})
+
+
+def parse_ecg_ids(paths: pd.Series) -> pd.Series:
+    """Vectorised `int(stem.split('_')[0])`: '00000/00001_hr_1R.png' -> 1 (<NA> when the name does not match)."""
+    return paths.str.extract(ECG_ID_PATTERN, expand=False).astype("Int64")
+
+
+def _bucket_mtimes(raw_dir: Path) -> dict:
+    """mtime of raw_dir and each direct subfolder; adding or removing an image changes one of them."""
+    raw_dir = Path(raw_dir)
+    mtimes = {".": os.stat(raw_dir).st_mtime_ns}
+    with os.scandir(raw_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                mtimes[entry.name] = entry.stat().st_mtime_ns
+    return mtimes
+
+
+def build_ecg_index(raw_dir: Path = DEFAULT_RAW_DIR, labels_path: Path = DEFAULT_LABELS,
+                    output_path: Path = DEFAULT_INDEX) -> pd.DataFrame:
+    """
+    Join the images under raw_dir with the SNOMED labels and save the result as Parquet.
+
+    Only images whose ecg_id has a label row are kept. Each row holds the ecg_id,
+    the image path relative to raw_dir, its size, whether it is an LFS pointer,
+    and the SNOMED label vector (one uint8 column per code).
+
+    Returns:
+        pd.DataFrame: The index that was written.
+    """
+    images = scan_images(raw_dir)
+    images["ecg_id"] = parse_ecg_ids(images["path"])
+    unparsed = int(images["ecg_id"].isna().sum())
+    images = images.dropna(subset=["ecg_id"])
+    images["ecg_id"] = images["ecg_id"].astype(np.int64)
+    images["is_lfs_pointer"] = images["size"] < LFS_POINTER_MAX_BYTES
+
+    labels = pd.read_parquet(labels_path)
+    snomed_cols = [c for c in labels.columns if c.startswith("SNOMED_")]
+    labels = labels[["ecg_id"] + snomed_cols].dropna(subset=["ecg_id"])
+    labels["ecg_id"] = labels["ecg_id"].astype(np.int64)
+    labels[snomed_cols] = labels[snomed_cols].fillna(0).astype(np.uint8)
+
+    index = images.merge(labels, on="ecg_id", how="inner", validate="many_to_one")
+    index = index[INDEX_COLUMNS + snomed_cols].sort_values("path", ignore_index=True)
+
+    index.attrs = {
+        "raw_dir": str(raw_dir),
+        "labels_path": str(labels_path),
+        "bucket_mtimes": _bucket_mtimes(raw_dir),
+        "unlabeled_images": len(images) - len(index),
+        "unparsed_names": unparsed,
+    }
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    index.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+    return index
+
+
+def load_ecg_index(index_path: Path = DEFAULT_INDEX, include_lfs_pointers: bool = False) -> pd.DataFrame:
+    """Read the index written by build_ecg_index, dropping LFS pointer rows unless asked not to."""
+    index = pd.read_parquet(index_path)
+    if not include_lfs_pointers:
+        attrs = index.attrs
+        index = index[~index["is_lfs_pointer"]].reset_index(drop=True)
+        index.attrs = attrs
+    return index
+
+
+def index_is_current(index: pd.DataFrame, raw_dir: Path) -> bool:
+    """True if no bucket folder under raw_dir changed since the index was built (a few stat calls)."""
+    try:
+        return index.attrs.get("bucket_mtimes") == _bucket_mtimes(raw_dir)
+    except FileNotFoundError:
+        return False
+
+
+def index_arrays(index: pd.DataFrame, raw_dir: Path):
+    """
+    Unpack an index into training inputs.
+
+    Returns:
+        tuple: (absolute image paths, ecg_ids int64 [N], labels float32 [N, C], snomed_cols)
+    """
+    snomed_cols = [c for c in index.columns if c.startswith("SNOMED_")]
+    root = Path(raw_dir)
+    paths = [root / p for p in index["path"]]
+    return paths, index["ecg_id"].to_numpy(np.int64), index[snomed_cols].to_numpy(np.float32), snomed_cols
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the ecg_id <-> image Parquet index with SNOMED labels.")
+    parser.add_argument("--raw-dir", type=Path, default=DEFAULT_RAW_DIR, help="Root directory containing ECG PNGs.")
+    parser.add_argument("--labels", type=Path, default=DEFAULT_LABELS, help="SNOMED label parquet.")
+    parser.add_argument("--output", type=Path, default=DEFAULT_INDEX, help=f"Index file (default: {DEFAULT_INDEX}).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.raw_dir.exists():
+        print(f"❌ ERROR: Path does not exist: {args.raw_dir}")
+        sys.exit(1)
+
+    print(f"🔍 Indexing {args.raw_dir}...")
+    index = build_ecg_index(args.raw_dir, args.labels, args.output)
+    print(f"📊 {len(index)} labelled images | "
+          f"{int(index['is_lfs_pointer'].sum())} LFS pointers | "
+          f"{index.attrs['unlabeled_images']} without labels")
+    print(f"✅ Index saved to {args.output}")
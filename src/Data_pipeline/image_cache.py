@@ -0,0 +1,234 @@
+"""Pre-decoded, memory-mapped image cache for training and evaluation."""
+
+import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+try:
+    from src import profiling
+    from src.Data_pipeline.ecg_index import ECG_ID_PATTERN, index_arrays, load_ecg_index
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src import profiling
+    from src.Data_pipeline.ecg_index import ECG_ID_PATTERN, index_arrays, load_ecg_index
+
+DEFAULT_CACHE_DIR = Path("data/Processed/image_cache_224")
+IMAGES_FILE = "images.npy"
+IDS_FILE = "ecg_ids.npy"
+META_FILE = "meta.json"
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def ecg_id_from_path(image_path) -> int:
+    """
+    GenECG file names look like 00001_hr_1R.png -> ecg_id 1 (-1 when the name does not match).
+
+    Same rule as `ecg_index.parse_ecg_ids`, applied to a single path.
+    """
+    match = ECG_ID_PATTERN.search(Path(image_path).as_posix())
+    return int(match.group(1)) if match else -1
+
+
+def decode_resized(image_path, image_size: int) -> np.ndarray:
+    """Decode one image to an [image_size, image_size, 3] uint8 array."""
+    with Image.open(image_path) as img:
+        img = img.convert("RGB").resize((image_size, image_size), Image.BILINEAR)
+        # np.array copies into a writable array; torch.from_numpy warns on PIL's read-only buffer
+        return np.array(img, dtype=np.uint8)
+
+
+class ImageCacheWriter:
+    """
+    Creates the on-disk cache and fills slots one image at a time.
+
+    Layout of `cache_dir`:
+        images.npy   uint8 [N, H, W, 3], memory-mappable
+        ecg_ids.npy  int64 [N], -1 for slots not written yet
+        meta.json    image size and count
+    """
+
+    def __init__(self, cache_dir: Path, num_images: int, image_size: int = 224):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.image_size = image_size
+        self.images = np.lib.format.open_memmap(
+            self.cache_dir / IMAGES_FILE, mode="w+", dtype=np.uint8,
+            shape=(num_images, image_size, image_size, 3),
+        )
+        self.ecg_ids = np.full(num_images, -1, dtype=np.int64)
+        with open(self.cache_dir / META_FILE, "w") as f:
+            json.dump({"image_size": image_size, "num_images": num_images}, f)
+
+    def write(self, idx: int, ecg_id: int, image_path):
+        self.images[idx] = decode_resized(image_path, self.image_size)
+        self.ecg_ids[idx] = ecg_id
+
+    def close(self):
+        self.images.flush()
+        np.save(self.cache_dir / IDS_FILE, self.ecg_ids)
+
+
+def _fill_chunk(cache_dir: str, start: int, image_paths, image_size: int):
+    """Worker: decode a contiguous run of images straight into the shared memmap."""
+    images = np.load(Path(cache_dir) / IMAGES_FILE, mmap_mode="r+")
+    errors = []
+    for offset, image_path in enumerate(image_paths):
+        try:
+            images[start + offset] = decode_resized(image_path, image_size)
+        except Exception as e:
+            errors.append((start + offset, str(e)))
+    images.flush()
+    return errors
+
+
+def build_image_cache(image_paths, cache_dir: Path = DEFAULT_CACHE_DIR, image_size: int = 224,
+                      workers: int = 1, chunk_size: int = 256):
+    """
+    Decode every image once at `image_size` into a uint8 memmap with an ecg_id index.
+
+    Images that fail to decode, or whose name has no ecg_id, keep ecg_id -1 so
+    they can be filtered out.
+
+    Returns:
+        int: Number of images cached successfully.
+    """
+    image_paths = [str(p) for p in image_paths]
+    writer = ImageCacheWriter(cache_dir, len(image_paths), image_size)
+    writer.ecg_ids[:] = [ecg_id_from_path(p) for p in image_paths]
+    writer.images.flush()
+    unparsed = int((writer.ecg_ids[:] < 0).sum())
+    if unparsed:
+        print(f"⚠️  {unparsed} images have no numeric ecg_id prefix; they are cached with ecg_id -1 and ignored in training")
+
+    chunks = [(start, image_paths[start:start + chunk_size]) for start in range(0, len(image_paths), chunk_size)]
+    failed = []
+    with tqdm(total=len(image_paths), unit="img") as progress:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_fill_chunk, str(cache_dir), start, paths, image_size): len(paths)
+                           for start, paths in chunks}
+                for future in as_completed(futures):
+                    failed.extend(future.result())
+                    progress.update(futures[future])
+        else:
+            for start, paths in chunks:
+                failed.extend(_fill_chunk(str(cache_dir), start, paths, image_size))
+                progress.update(len(paths))
+
+    for idx, err in failed[:20]:
+        print(f"Error on {Path(image_paths[idx]).name}: {err}")
+    writer.ecg_ids[[idx for idx, _ in failed]] = -1
+    writer.close()
+    return len(image_paths) - len(failed)
+
+
+def normalize_batch(images: torch.Tensor, device=None, mean=IMAGENET_MEAN, std=IMAGENET_STD) -> torch.Tensor:
+    """
+    Turn a uint8 [B, H, W, 3] batch into a normalised float [B, 3, H, W] batch.
+
+    The uint8 batch is moved to `device` first (4x less data than float32),
+    then converted and normalised there in one pass.
+    """
+    if device is not None:
+        images = images.to(device, non_blocking=True)
+    images = images.permute(0, 3, 1, 2).float().div_(255.0)
+    mean = torch.tensor(mean, device=images.device).view(1, 3, 1, 1)
+    std = torch.tensor(std, device=images.device).view(1, 3, 1, 1)
+    return images.sub_(mean).div_(std)
+
+
+class MemmapImageDataset(Dataset):
+    """
+    Serves pre-decoded images from the memory-mapped cache.
+
+    `__getitem__` returns a uint8 [H, W, 3] tensor backed by the mapping (no
+    decode, no resize); batches are normalised afterwards with `normalize_batch`.
+    The file is opened lazily in each DataLoader worker, so workers share the
+    page cache instead of each holding a copy.
+
+    Args:
+        cache_dir (Path): Directory written by `build_image_cache`.
+        labels (np.ndarray, optional): [N, C] targets aligned with the cache rows.
+        indices (array-like, optional): Subset of cache rows (e.g. a train split).
+            Defaults to every row with a valid ecg_id.
+    """
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, labels=None, indices=None):
+        self.cache_dir = Path(cache_dir)
+        self.ecg_ids = np.load(self.cache_dir / IDS_FILE)
+        if indices is None:
+            indices = np.flatnonzero(self.ecg_ids >= 0)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.labels = labels
+        self._images = None
+
+    @property
+    def images(self) -> np.ndarray:
+        if self._images is None:
+            # Copy-on-write mapping: reads are zero-copy and torch accepts the array as writable
+            self._images = np.load(self.cache_dir / IMAGES_FILE, mmap_mode="c")
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, idx: int):
+        row = self.indices[idx]
+        with profiling.stage("dataset.cache_read"):
+            image = torch.from_numpy(self.images[row])
+        if self.labels is None:
+            return image, int(self.ecg_ids[row])
+        return image, torch.from_numpy(np.asarray(self.labels[row], dtype=np.float32))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Decode GenECG images once into a memory-mapped cache.")
+    parser.add_argument(
+        "--raw-dir",
+        type=Path,
+        default=Path("data/Raw/GenECG/Dataset_A_ECGs_without_imperfections"),
+        help="Root directory containing ECG PNGs (bucket subfolders are searched recursively).",
+    )
+    parser.add_argument("--index", type=Path, default=None,
+                        help="ecg index (src/Data_pipeline/ecg_index.py) listing the images; skips the directory walk.")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR, help="Output cache directory.")
+    parser.add_argument("--image-size", type=int, default=224, help="Side length images are resized to (default: 224).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of decoding processes (default: 1).")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of images to cache.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.raw_dir.exists():
+        print(f"❌ ERROR: Path does not exist: {args.raw_dir}")
+        sys.exit(1)
+
+    if args.index is not None:
+        image_paths = index_arrays(load_ecg_index(args.index), args.raw_dir)[0]
+    else:
+        image_paths = sorted(args.raw_dir.rglob("*.[pP][nN][gG]"))
+    if args.limit is not None and args.limit > 0:
+        image_paths = image_paths[:args.limit]
+
+    print(f"Caching {len(image_paths)} images at {args.image_size}px into {args.cache_dir}...")
+    cached = build_image_cache(image_paths, args.cache_dir, args.image_size, args.workers)
+    print(f"\n✅ Success! Cached {cached} images in {args.cache_dir}")
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from src.prediction_cache import file_digest
+
+DEFAULT_MANIFEST = Path("data/Processed/YOLO_Labels/label_manifest.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    source_path  TEXT PRIMARY KEY,
+    size         INTEGER NOT NULL,
+    mtime_ns     INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    label_path   TEXT NOT NULL,
+    updated_at   REAL NOT NULL
+)
+"""
+
+
+class LabelManifest:
+    """
+    SQLite record of which source images have up-to-date YOLO labels.
+
+    Each row stores the image's size, mtime and content hash together with the
+    label it produced, so reruns only touch new, changed or deleted images.
+    Rows are committed per finished chunk, which makes an interrupted run
+    resumable: completed work is simply skipped next time.
+    """
+
+    def __init__(self, manifest_path: Path = DEFAULT_MANIFEST):
+        self.path = Path(manifest_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def rows_under(self, root: Path) -> dict:
+        """Return {source_path: (size, mtime_ns, content_hash, label_path)} for images below `root`."""
+        prefix = str(root).rstrip(os.sep) + os.sep
+        cursor = self.conn.execute(
+            "SELECT source_path, size, mtime_ns, content_hash, label_path FROM labels "
+            "WHERE substr(source_path, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+        return {row[0]: row[1:] for row in cursor}
+
+    def record(self, records):
+        """Upsert (source_path, size, mtime_ns, content_hash, label_path) records and commit."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO labels (source_path, size, mtime_ns, content_hash, label_path, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(*rec, now) for rec in records],
+        )
+        self.conn.commit()
+
+    def remove(self, source_paths):
+        self.conn.executemany("DELETE FROM labels WHERE source_path = ?", [(p,) for p in source_paths])
+        self.conn.commit()
+
+    def plan(self, image_paths, raw_root: Path, output_dir: Path):
+        """
+        Decide what an incremental run has to do.
+
+        Unchanged images (same size and mtime, label still on disk) are skipped
+        without reading them. If only the mtime moved, the content hash decides.
+        Manifest rows whose source image disappeared are reported as orphans.
+
+        Returns:
+            tuple: (paths to (re)label, [(source_path, size, mtime_ns, hash, label_path)] to
+                    refresh without relabelling, {source_path: label_path} orphans)
+        """
+        known = self.rows_under(raw_root)
+        existing_labels = {entry.name for entry in os.scandir(output_dir)} if output_dir.exists() else set()
+
+        todo, touched = [], []
+        current = set()
+        for img_path in image_paths:
+            source = str(img_path)
+            current.add(source)
+            row = known.get(source)
+            if row is None:
+                todo.append(source)
+                continue
+
+            size, mtime_ns, content_hash, label_path = row
+            if Path(label_path).name not in existing_labels:
+                todo.append(source)
+                continue
+
+            stat = os.stat(source)
+            if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+                continue
+            if stat.st_size == size and file_digest(source) == content_hash:
+                touched.append((source, stat.st_size, stat.st_mtime_ns, content_hash, label_path))
+                continue
+            todo.append(source)
+
+        orphans = {source: row[3] for source, row in known.items() if source not in current}
+        return todo, touched, orphans
+
+    def prune(self, orphans: dict) -> int:
+        """Delete orphaned label files and their manifest rows."""
+        for label_path in orphans.values():
+            try:
+                os.remove(label_path)
+            except FileNotFoundError:
+                pass
+        self.remove(orphans.keys())
+        return len(orphans)
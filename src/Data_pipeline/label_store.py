@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+from src.Data_pipeline.yolo_labels import LEAD_ORDER
+
+DEFAULT_STORE_DIR = Path("data/Processed/YOLO_Labels/Dataset_A_store")
+LABELS_FILE = "labels.npy"
+STEMS_FILE = "stems.txt"
+NUM_LEADS = len(LEAD_ORDER)
+
+
+def save_label_store(store_dir: Path, stems, labels: np.ndarray):
+    """
+    Write all YOLO labels into one consolidated store.
+
+    Args:
+        store_dir (Path): Output directory.
+        stems (list[str]): Image stems, one per row of `labels`.
+        labels (np.ndarray): Array of shape [N, 12, 5] with (class_id, x_center,
+            y_center, width, height) per lead, normalised like the .txt files.
+    """
+    labels = np.asarray(labels, dtype=np.float32)
+    if labels.shape != (len(stems), NUM_LEADS, 5):
+        raise ValueError(f"Expected labels of shape ({len(stems)}, {NUM_LEADS}, 5), got {labels.shape}")
+
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    # Write to temporary names first so readers never see a half-written store
+    tmp_labels = store_dir / f".{LABELS_FILE}.tmp"
+    tmp_stems = store_dir / f".{STEMS_FILE}.tmp"
+    with open(tmp_labels, "wb") as f:
+        np.save(f, labels)
+    with open(tmp_stems, "w") as f:
+        f.write("\n".join(stems))
+    os.replace(tmp_labels, store_dir / LABELS_FILE)
+    os.replace(tmp_stems, store_dir / STEMS_FILE)
+    return store_dir
+
+
+class LabelStore:
+    """
+    In-memory view of a consolidated label store.
+
+    The [N, 12, 5] array is memory-mapped and the stems are loaded into a
+    stem -> row dict in one bulk read, so lookups never touch the filesystem.
+    """
+
+    def __init__(self, store_dir: Path = DEFAULT_STORE_DIR, mmap: bool = True):
+        self.store_dir = Path(store_dir)
+        self.labels = np.load(self.store_dir / LABELS_FILE, mmap_mode="r" if mmap else None)
+        with open(self.store_dir / STEMS_FILE) as f:
+            self.stems = f.read().split("\n") if len(self.labels) else []
+        if len(self.stems) != len(self.labels):
+            raise ValueError(f"Corrupt label store {self.store_dir}: {len(self.stems)} stems for {len(self.labels)} rows")
+        self.index = {stem: row for row, stem in enumerate(self.stems)}
+        # Changes whenever the store is rewritten; lets consumers invalidate their caches
+        self.version = os.stat(self.store_dir / LABELS_FILE).st_mtime_ns
+
+    def __len__(self) -> int:
+        return len(self.stems)
+
+    def __contains__(self, stem: str) -> bool:
+        return stem in self.index
+
+    def get(self, stem: str) -> np.ndarray:
+        """Return the [12, 5] label array for an image stem (KeyError if missing)."""
+        return np.array(self.labels[self.index[stem]])
+
+    def to_yolo_lines(self, stem: str) -> list:
+        """Format one entry like the per-image .txt files."""
+        return [
+            f"{int(row[0])} {row[1]:.6f} {row[2]:.6f} {row[3]:.6f} {row[4]:.6f}"
+            for row in self.get(stem)
+        ]
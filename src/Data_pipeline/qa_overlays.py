@@ -0,0 +1,349 @@
+"""
+Batch QA overlays for YOLO lead labels and detector output.
+
+Renders downscaled box overlays for thousands of sheets across a process pool,
+tiles them into contact sheets for quick visual review, and flags sheets whose
+boxes deviate from the 3x4 grid heuristic by more than a tolerance.
+
+Box sources:
+    --label-store   consolidated store from run_mass_label_generation.py
+    --label-dir     per-image YOLO .txt files
+    --detections    JSONL written by src/pipeline.py (lead_boxes in pixels)
+
+Boxes are parsed into [N, 12, 4] normalised arrays up front, so the grid check
+runs over every sheet in one NumPy pass; only flagged or sampled sheets need
+to be rendered.
+
+Usage:
+    python src/Data_pipeline/qa_overlays.py --label-store data/Processed/YOLO_Labels/Dataset_A_store \
+        --images data/Raw/GenECG/Dataset_A_ECGs_without_imperfections --output-dir runs/qa --workers 8
+"""
+
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+from tqdm import tqdm
+
+try:
+    from src.Data_pipeline.ecg_index import index_arrays, load_ecg_index
+    from src.Data_pipeline.label_store import LabelStore
+    from src.Data_pipeline.yolo_labels import (GRID_COLS, GRID_ROWS, LEAD_ORDER, grid_lead_boxes, parse_yolo_boxes,
+                                               read_image_size, yolo_to_xyxy)
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.ecg_index import index_arrays, load_ecg_index
+    from src.Data_pipeline.label_store import LabelStore
+    from src.Data_pipeline.yolo_labels import (GRID_COLS, GRID_ROWS, LEAD_ORDER, grid_lead_boxes, parse_yolo_boxes,
+                                               read_image_size, yolo_to_xyxy)
+
+NUM_LEADS = len(LEAD_ORDER)
+DEFAULT_OUTPUT_DIR = Path("runs/qa")
+DEFAULT_RAW_DIR = Path("data/Raw/GenECG/Dataset_A_ECGs_without_imperfections")
+DEFAULT_TOLERANCE = 0.25
+REPORT_FILE = "qa_report.csv"
+
+# Normalised grid-heuristic boxes and the cell size each coordinate is measured against
+GRID_BOXES = grid_lead_boxes(1.0, 1.0).astype(np.float32)
+CELL_SCALE = np.array([1 / GRID_COLS, 1 / GRID_ROWS, 1 / GRID_COLS, 1 / GRID_ROWS], dtype=np.float32)
+
+BOX_COLOR = (0, 170, 0)
+DEVIATION_COLOR = (220, 0, 0)
+GRID_COLOR = (150, 150, 150)
+
+
+def to_lead_slots(labels: np.ndarray) -> np.ndarray:
+    """
+    Place YOLO rows [K, 5] into a [12, 4] normalised box array indexed by class id.
+
+    Leads without a box stay NaN; for repeated class ids the last row wins.
+    """
+    slots = np.full((NUM_LEADS, 4), np.nan, dtype=np.float32)
+    class_ids = labels[:, 0].astype(np.int64)
+    valid = (class_ids >= 0) & (class_ids < NUM_LEADS)
+    slots[class_ids[valid]] = yolo_to_xyxy(labels[valid])
+    return slots
+
+
+def load_label_store_boxes(store_dir):
+    """(stems, boxes [N, 12, 4]) from a consolidated label store, without any per-row parsing."""
+    store = LabelStore(store_dir)
+    labels = np.asarray(store.labels, dtype=np.float32)
+    boxes = np.full((len(labels), NUM_LEADS, 4), np.nan, dtype=np.float32)
+    if len(labels):
+        class_ids = labels[..., 0].astype(np.int64)
+        rows = np.broadcast_to(np.arange(len(labels))[:, None], class_ids.shape)
+        valid = (class_ids >= 0) & (class_ids < NUM_LEADS)
+        boxes[rows[valid], class_ids[valid]] = yolo_to_xyxy(labels)[valid]
+    return list(store.stems), boxes
+
+
+def load_label_dir_boxes(label_dir, stems):
+    """(stems, boxes [N, 12, 4]) from per-image .txt files; stems without a file get all-NaN boxes."""
+    boxes = np.full((len(stems), NUM_LEADS, 4), np.nan, dtype=np.float32)
+    for i, stem in enumerate(stems):
+        label_path = Path(label_dir) / f"{stem}.txt"
+        if label_path.exists():
+            boxes[i] = to_lead_slots(parse_yolo_boxes(label_path.read_text()))
+    return list(stems), boxes
+
+
+def load_detection_boxes(jsonl_path):
+    """
+    (image paths, boxes [N, 12, 4]) from src/pipeline.py output.
+
+    Detector boxes are in pixels; they are normalised with each sheet's size,
+    read from the PNG header only. Sheets the pipeline failed to decode are skipped.
+    """
+    paths, pixel_boxes = [], []
+    with open(jsonl_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("error"):
+                continue  # sheet could not be decoded, so there is nothing to overlay
+            lead_boxes = record.get("lead_boxes") or {}
+            paths.append(record["image"])
+            pixel_boxes.append([lead_boxes.get(lead, [np.nan] * 4) for lead in LEAD_ORDER])
+    boxes = np.asarray(pixel_boxes, dtype=np.float32).reshape(-1, NUM_LEADS, 4)
+    sizes = np.array([read_image_size(p) for p in paths], dtype=np.float32).reshape(-1, 2)
+    boxes /= np.tile(sizes, 2)[:, None, :]
+    return paths, boxes
+
+
+def grid_deviation(boxes: np.ndarray):
+    """
+    Compare normalised boxes [N, 12, 4] against the 3x4 grid heuristic.
+
+    Returns:
+        tuple: (deviation [N, 12], iou [N, 12]). Deviation is the largest corner
+            offset as a fraction of the grid cell size (inf for missing leads).
+    """
+    deviation = np.max(np.abs(boxes - GRID_BOXES) / CELL_SCALE, axis=-1)
+    deviation = np.where(np.isnan(deviation), np.inf, deviation)
+
+    inter_w = np.clip(np.minimum(boxes[..., 2], GRID_BOXES[:, 2]) - np.maximum(boxes[..., 0], GRID_BOXES[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(boxes[..., 3], GRID_BOXES[:, 3]) - np.maximum(boxes[..., 1], GRID_BOXES[:, 1]), 0, None)
+    inter = inter_w * inter_h
+    area = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+    grid_area = (GRID_BOXES[:, 2] - GRID_BOXES[:, 0]) * (GRID_BOXES[:, 3] - GRID_BOXES[:, 1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        iou = np.nan_to_num(inter / (area + grid_area - inter), nan=0.0)
+    return deviation, iou
+
+
+def render_overlay(image_path, boxes: np.ndarray, lead_deviation: np.ndarray, width: int,
+                   tolerance: float, flagged: bool, show_grid: bool = True) -> Image.Image:
+    """Downscale one sheet and draw its lead boxes (red where they leave the tolerance)."""
+    with Image.open(image_path) as img:
+        img = img.convert("RGB")
+        # Integer box reduction is much cheaper than a full-resolution resample
+        factor = max(1, img.width // width)
+        img = img.reduce(factor) if factor > 1 else img.copy()
+    if img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), Image.BILINEAR)
+
+    draw = ImageDraw.Draw(img)
+    scale = np.array([img.width, img.height, img.width, img.height], dtype=np.float32)
+    if show_grid:
+        for box in (GRID_BOXES * scale).tolist():
+            draw.rectangle(box, outline=GRID_COLOR, width=1)
+    for lead, box, dev in zip(LEAD_ORDER, (boxes * scale).tolist(), lead_deviation.tolist()):
+        if np.isnan(box[0]):
+            continue
+        color = DEVIATION_COLOR if dev > tolerance else BOX_COLOR
+        draw.rectangle(box, outline=color, width=2)
+        draw.text((box[0] + 3, box[1] + 2), lead, fill=color)
+    if flagged:
+        draw.rectangle([0, 0, img.width - 1, img.height - 1], outline=DEVIATION_COLOR, width=4)
+    return img
+
+
+def _render_page(page: int, items: list, output_dir: str, width: int, tolerance: float, columns: int,
+                 save_overlays: bool, show_grid: bool):
+    """
+    Worker: render one contact sheet's worth of overlays.
+
+    Each item is (name, image_path, boxes [12, 4], lead deviation [12], flagged).
+    Returns the list of (image_path, error) for sheets that could not be rendered.
+    """
+    output_dir = Path(output_dir)
+    tiles, errors = [], []
+    for name, image_path, boxes, lead_deviation, flagged in items:
+        try:
+            overlay = render_overlay(image_path, boxes, lead_deviation, width, tolerance, flagged, show_grid)
+        except Exception as e:
+            errors.append((image_path, str(e)))
+            continue
+        if save_overlays:
+            overlay.save(output_dir / "overlays" / f"{name}.jpg", quality=85)
+        worst = np.max(lead_deviation)
+        caption = f"{name}  dev {'missing' if np.isinf(worst) else f'{worst:.2f}'}"
+        tiles.append((overlay, caption, flagged))
+
+    if tiles:
+        tile_w = width
+        tile_h = max(tile.height for tile, _, _ in tiles) + 14
+        rows = -(-len(tiles) // columns)
+        sheet = Image.new("RGB", (columns * tile_w, rows * tile_h), "white")
+        draw = ImageDraw.Draw(sheet)
+        for i, (tile, caption, flagged) in enumerate(tiles):
+            x, y = (i % columns) * tile_w, (i // columns) * tile_h
+            sheet.paste(tile, (x, y + 14))
+            draw.text((x + 2, y + 1), caption, fill=DEVIATION_COLOR if flagged else (0, 0, 0))
+        sheet.save(output_dir / "contact_sheets" / f"contact_{page:04d}.jpg", quality=85)
+    return errors
+
+
+def write_report(report_path: Path, names, image_paths, deviation, iou, flagged):
+    """One CSV row per sheet: worst lead, its deviation, min IoU with the grid and the flag."""
+    worst_lead = np.argmax(deviation, axis=1) if len(deviation) else np.empty(0, np.int64)
+    with open(report_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "image", "max_deviation", "worst_lead", "min_iou", "missing_leads", "flagged"])
+        for i, name in enumerate(names):
+            max_dev = deviation[i].max()
+            writer.writerow([
+                name, image_paths[i] or "",
+                "inf" if np.isinf(max_dev) else f"{max_dev:.4f}",
+                LEAD_ORDER[worst_lead[i]],
+                f"{iou[i].min():.4f}",
+                int(np.isinf(deviation[i]).sum()),
+                int(flagged[i]),
+            ])
+
+
+def run_qa(names, image_paths, boxes: np.ndarray, output_dir: Path = DEFAULT_OUTPUT_DIR,
+           tolerance: float = DEFAULT_TOLERANCE, width: int = 400, columns: int = 6, rows: int = 6,
+           workers: int = 1, flagged_only: bool = False, limit: int | None = None,
+           save_overlays: bool = True, show_grid: bool = True) -> dict:
+    """
+    Score every sheet against the grid, then render overlays and contact sheets.
+
+    Sheets are rendered worst-first, so the first contact sheets show the
+    largest deviations. Rendering can be limited to flagged sheets and/or the
+    first `limit` sheets; the CSV report always covers every sheet.
+
+    Returns:
+        dict: Summary (sheets, flagged, rendered, errors, report path).
+    """
+    output_dir = Path(output_dir)
+    (output_dir / "contact_sheets").mkdir(parents=True, exist_ok=True)
+    if save_overlays:
+        (output_dir / "overlays").mkdir(parents=True, exist_ok=True)
+
+    deviation, iou = grid_deviation(boxes)
+    flagged = deviation.max(axis=1, initial=0.0) > tolerance
+    report_path = output_dir / REPORT_FILE
+    write_report(report_path, names, image_paths, deviation, iou, flagged)
+
+    order = np.argsort(-deviation.max(axis=1, initial=0.0), kind="stable")
+    order = [i for i in order if image_paths[i] is not None and (flagged[i] or not flagged_only)]
+    if limit is not None:
+        order = order[:limit]
+
+    per_page = columns * rows
+    pages = [
+        [(names[i], str(image_paths[i]), boxes[i], deviation[i], bool(flagged[i])) for i in order[start:start + per_page]]
+        for start in range(0, len(order), per_page)
+    ]
+    page_args = (str(output_dir), width, tolerance, columns, save_overlays, show_grid)
+
+    errors = []
+    with tqdm(total=len(order), unit="sheet") as progress:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_render_page, page, items, *page_args): len(items)
+                           for page, items in enumerate(pages)}
+                for future in as_completed(futures):
+                    errors.extend(future.result())
+                    progress.update(futures[future])
+        else:
+            for page, items in enumerate(pages):
+                errors.extend(_render_page(page, items, *page_args))
+                progress.update(len(items))
+
+    for image_path, err in errors[:20]:
+        print(f"Error on {Path(image_path).name}: {err}")
+    return {
+        "sheets": len(names),
+        "flagged": int(flagged.sum()),
+        "rendered": len(order) - len(errors),
+        "contact_sheets": len(pages),
+        "errors": len(errors),
+        "report": report_path,
+    }
+
+
+def image_paths_by_stem(images) -> dict:
+    """Map image stem -> path for a raw image directory or an ecg index .parquet."""
+    images = Path(images)
+    if images.suffix == ".parquet":
+        index = load_ecg_index(images)
+        paths = index_arrays(index, index.attrs.get("raw_dir", images.parent))[0]
+    else:
+        paths = images.rglob("*.[pP][nN][gG]")
+    return {Path(p).stem: Path(p) for p in paths}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render QA overlays and contact sheets for lead boxes.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--label-store", type=Path, help="Consolidated label store (labels.npy + stems.txt).")
+    source.add_argument("--label-dir", type=Path, help="Directory of per-image YOLO .txt labels.")
+    source.add_argument("--detections", type=Path, help="JSONL predictions from src/pipeline.py (--output).")
+    parser.add_argument("--images", type=Path, default=DEFAULT_RAW_DIR,
+                        help="Raw image directory or ecg index .parquet the labels refer to.")
+    parser.add_argument("--output-dir", type=Path, default=DEFAULT_OUTPUT_DIR, help="Where overlays and reports go.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Flag sheets with a box corner further than this fraction of a grid cell "
+                             f"from the 3x4 heuristic (default: {DEFAULT_TOLERANCE}).")
+    parser.add_argument("--width", type=int, default=400, help="Overlay width in pixels (default: 400).")
+    parser.add_argument("--columns", type=int, default=6, help="Contact sheet columns (default: 6).")
+    parser.add_argument("--rows", type=int, default=6, help="Contact sheet rows (default: 6).")
+    parser.add_argument("--workers", type=int, default=1, help="Rendering processes (default: 1).")
+    parser.add_argument("--flagged-only", action="store_true", help="Only render sheets that fail the grid check.")
+    parser.add_argument("--limit", type=int, default=None, help="Render at most this many sheets (worst first).")
+    parser.add_argument("--no-overlays", action="store_true", help="Only write contact sheets, not one file per sheet.")
+    parser.add_argument("--no-grid", action="store_true", help="Do not draw the grid-heuristic reference boxes.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.detections is not None:
+        image_paths, boxes = load_detection_boxes(args.detections)
+        names = [Path(p).stem for p in image_paths]
+    else:
+        if not args.images.exists():
+            print(f"❌ ERROR: Path does not exist: {args.images}")
+            sys.exit(1)
+        by_stem = image_paths_by_stem(args.images)
+        if args.label_store is not None:
+            names, boxes = load_label_store_boxes(args.label_store)
+        else:
+            names, boxes = load_label_dir_boxes(args.label_dir, sorted(p.stem for p in args.label_dir.glob("*.txt")))
+        image_paths = [by_stem.get(name) for name in names]
+        missing = sum(p is None for p in image_paths)
+        if missing:
+            print(f"⚠️  {missing} labelled sheets have no image under {args.images}; they are reported but not rendered")
+
+    print(f"Checking {len(names)} sheets against the 3x4 grid (tolerance {args.tolerance:.0%} of a cell)...")
+    summary = run_qa(
+        names, image_paths, boxes, args.output_dir, args.tolerance, args.width, args.columns, args.rows,
+        args.workers, args.flagged_only, args.limit, not args.no_overlays, not args.no_grid,
+    )
+    print(f"\n📊 {summary['flagged']} of {summary['sheets']} sheets deviate from the grid; "
+          f"rendered {summary['rendered']} overlays on {summary['contact_sheets']} contact sheets "
+          f"({summary['errors']} errors)")
+    print(f"💾 Report written to {summary['report']}")
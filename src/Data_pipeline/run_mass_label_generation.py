@@ -1,10 +1,18 @@
 import argparse
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+
+import numpy as np
 from tqdm import tqdm
 
 try:
-    from src.Data_pipeline.yolo_labels import generate_yolo_labels
+    from src import profiling
+    from src.Data_pipeline.label_manifest import LabelManifest
+    from src.Data_pipeline.label_store import save_label_store
+    from src.Data_pipeline.yolo_labels import grid_label_array, read_image_size, write_yolo_label
+    from src.prediction_cache import file_digest
 except ModuleNotFoundError:
     # Allow running this script directly by making src.Data_pipeline importable
     current_dir = Path(__file__).resolve().parent
@@ -13,38 +21,168 @@ except ModuleNotFoundError:
         str_path = str(path)
         if str_path not in sys.path:
             sys.path.append(str_path)
-    from src.Data_pipeline.yolo_labels import generate_yolo_labels
+    from src import profiling
+    from src.Data_pipeline.label_manifest import LabelManifest
+    from src.Data_pipeline.label_store import save_label_store
+    from src.Data_pipeline.yolo_labels import grid_label_array, read_image_size, write_yolo_label
+    from src.prediction_cache import file_digest
 
 DEFAULT_RAW_DIR = Path("/Volumes/Noori SSD/Applications/GenECG-Diagnostic/data/Raw/GenECG/Dataset_B_ECGs_with_imperfections")
 DEFAULT_OUTPUT_DIR = Path("data/Processed/YOLO_Labels")
 
 
-def run_mass_labeling(raw_data_dir: Path, output_dir: Path, limit: int | None = None):
-    output_dir.mkdir(parents=True, exist_ok=True)
+def _label_chunk(image_paths, output_dir, with_records=False):
+    """
+    Worker: label a chunk of images.
+
+    Returns:
+        tuple: (success_count, [(name, error), ...], manifest records). Records
+        are only built when `with_records` is set, since they require hashing.
+    """
+    success_count = 0
+    errors = []
+    records = []
+    for img_path in image_paths:
+        try:
+            if with_records:
+                with profiling.stage("labels.hash"):
+                    stat = os.stat(img_path)
+                    content_hash = file_digest(img_path)
+            with profiling.stage("labels.write"):
+                label_path = write_yolo_label(img_path, output_dir)
+            success_count += 1
+            if with_records:
+                records.append((img_path, stat.st_size, stat.st_mtime_ns, content_hash, label_path))
+        except Exception as e:
+            errors.append((Path(img_path).name, str(e)))
+    return success_count, errors, records
+
+
+def _size_chunk(image_paths):
+    """Worker: read (path, width, height) for a chunk of images from their headers."""
+    sizes = []
+    errors = []
+    for img_path in image_paths:
+        try:
+            with profiling.stage("labels.read_size"):
+                sizes.append((img_path, *read_image_size(img_path)))
+        except Exception as e:
+            errors.append((Path(img_path).name, str(e)))
+    return sizes, errors
+
+
+def _run_chunks(worker, chunks, worker_args, workers, on_result, total):
+    """Run `worker(chunk, *worker_args)` over all chunks, serially or in a process pool."""
+    with tqdm(total=total, unit="img") as progress:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(worker, chunk, *worker_args): len(chunk) for chunk in chunks}
+                for future in as_completed(futures):
+                    progress.set_postfix(errors=on_result(future.result()))
+                    progress.update(futures[future])
+        else:
+            for chunk in chunks:
+                progress.set_postfix(errors=on_result(worker(chunk, *worker_args)))
+                progress.update(len(chunk))
+
+
+def _print_errors(errors, limit=20):
+    for name, err in errors[:limit]:
+        print(f"Error on {name}: {err}")
+    if len(errors) > limit:
+        print(f"... and {len(errors) - limit} more errors")
+
+
+def run_mass_labeling(raw_data_dir: Path, output_dir: Path, limit: int | None = None,
+                      workers: int = 1, chunk_size: int = 512, manifest_path: Path | None = None,
+                      store_dir: Path | None = None):
+    """
+    Generate grid-heuristic YOLO labels for every PNG under raw_data_dir.
+
+    With `manifest_path`, the run is incremental: unchanged images are skipped,
+    changed ones relabelled, labels of deleted images removed, and progress is
+    committed per chunk so an interrupted run resumes where it stopped.
+
+    With `store_dir`, all labels are written to one consolidated [N, 12, 5]
+    store (see label_store.py) instead of one .txt file per image.
+    """
+    if manifest_path is not None and store_dir is not None:
+        raise ValueError("--manifest tracks per-image .txt labels and cannot be combined with --store")
 
     print(f"Targeting directory: {raw_data_dir}")
     if not raw_data_dir.exists():
         print("❌ ERROR: Path does not exist. Check your folder names!")
         return
 
-    all_images = sorted(raw_data_dir.rglob("*.[pP][nN][gG]"))
+    with profiling.stage("labels.scan"):
+        all_images = sorted(raw_data_dir.rglob("*.[pP][nN][gG]"))
+    manifest = LabelManifest(manifest_path) if manifest_path is not None else None
+
+    if manifest is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        with profiling.stage("labels.manifest_plan"):
+            todo, touched, orphans = manifest.plan(all_images, raw_data_dir, output_dir)
+        if touched:
+            manifest.record(touched)
+        removed = manifest.prune(orphans)
+        print(f"Manifest: {len(all_images) - len(todo)} up to date, {len(todo)} new or changed, "
+              f"{removed} orphaned labels removed")
+        candidates = [Path(p) for p in todo]
+    else:
+        candidates = all_images
 
     if limit is not None and limit > 0:
-        process_list = all_images[:limit]
+        process_list = candidates[:limit]
     else:
-        process_list = all_images
+        process_list = candidates
+
+    print(f"Found {len(all_images)} images. Processing {len(process_list)} with {workers} worker(s)...")
+
+    chunks = [[str(p) for p in process_list[i:i + chunk_size]] for i in range(0, len(process_list), chunk_size)]
+    errors = []
+
+    if store_dir is not None:
+        sizes = []
+
+        def _collect_sizes(result):
+            chunk_sizes, chunk_errors = result
+            sizes.extend(chunk_sizes)
+            errors.extend(chunk_errors)
+            return len(errors)
+
+        _run_chunks(_size_chunk, chunks, (), workers, _collect_sizes, len(process_list))
+        sizes.sort()
+        stems = [Path(img_path).stem for img_path, _, _ in sizes]
+        labels = np.stack([grid_label_array(w, h) for _, w, h in sizes]) if sizes else np.empty((0, 12, 5))
+        with profiling.stage("labels.store_save"):
+            save_label_store(store_dir, stems, labels)
 
-    print(f"Found {len(all_images)} images. Processing {len(process_list)}...")
+        _print_errors(errors)
+        print(f"\n✅ Success! Stored {len(stems)} labels in {store_dir} ({len(errors)} errors)")
+        return len(stems)
 
+    output_dir.mkdir(parents=True, exist_ok=True)
     success_count = 0
-    for img_path in tqdm(process_list):
-        try:
-            generate_yolo_labels(str(img_path), str(output_dir))
-            success_count += 1
-        except Exception as e:
-            print(f"Error on {img_path.name}: {e}")
 
-    print(f"\n✅ Success! Generated {success_count} labels in {output_dir}")
+    def _collect_labels(result):
+        nonlocal success_count
+        done, chunk_errors, records = result
+        success_count += done
+        errors.extend(chunk_errors)
+        if records:
+            manifest.record(records)
+        return len(errors)
+
+    try:
+        _run_chunks(_label_chunk, chunks, (str(output_dir), manifest is not None), workers,
+                    _collect_labels, len(process_list))
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    _print_errors(errors)
+    print(f"\n✅ Success! Generated {success_count} labels in {output_dir} ({len(errors)} errors)")
+    return success_count
 
 
 def parse_args():
@@ -67,9 +205,47 @@ def parse_args():
         default=None,
         help="Maximum number of images to process (processes all when omitted or <=0).",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes (default: 1, i.e. serial).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=512,
+        help="Images handed to a worker at a time (default: 512).",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=None,
+        help="SQLite manifest enabling incremental, resumable runs (e.g. data/Processed/YOLO_Labels/label_manifest.sqlite).",
+    )
+    parser.add_argument(
+        "--store",
+        type=Path,
+        default=None,
+        help="Write all labels to one consolidated store directory (labels.npy + stems.txt) instead of .txt files.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time each stage (scan, hash, header read, write) across all workers; also enabled by GENECG_PROFILE=1.",
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=Path,
+        default=None,
+        help="Write the stage histograms to this .json or .prom (Prometheus text) file.",
+    )
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_args()
-    run_mass_labeling(args.raw_dir, args.output_dir, args.limit)
+    if args.profile or args.profile_output:
+        profiling.enable()
+    run_mass_labeling(args.raw_dir, args.output_dir, args.limit, args.workers, args.chunk_size, args.manifest, args.store)
+    profiling.finish(args.profile_output)
@@ -1,5 +1,20 @@
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
+try:
+    from src.Data_pipeline.label_matrix import LabelMatrix
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.label_matrix import LabelMatrix
+
+
 def verify_ptbxl_snomed_parquet(file_path="data/Processed/ptbxl_with_snomed.parquet"):
     """
     Verifies the ptbxl_with_snomed.parquet file.
@@ -29,5 +44,53 @@ def verify_ptbxl_snomed_parquet(file_path="data/Processed/ptbxl_with_snomed.parq
     except Exception as e:
         print(f"An error occurred: {e}")
 
+
+def report_label_matrix(matrix: LabelMatrix, top: int = 10):
+    """
+    Print a summary of a LabelMatrix: size, label density and class balance.
+
+    Args:
+        matrix (LabelMatrix): Matrix built from the parquet or loaded from .npz.
+        top (int): Number of most and least frequent classes to list.
+    """
+    labels_per_row = matrix.matrix.sum(axis=1)
+    print(f"Rows: {len(matrix)} | Classes: {matrix.num_classes}")
+    print(f"Packed size: {matrix.packed.nbytes / 1024:.1f} KB "
+          f"(dense uint8: {len(matrix) * matrix.num_classes / 1024:.1f} KB)")
+    print(f"Labels per ECG: mean {labels_per_row.mean():.2f}, max {labels_per_row.max(initial=0)}, "
+          f"{int((labels_per_row == 0).sum())} ECGs without any label")
+
+    order = np.argsort(-matrix.class_counts, kind="stable")
+    empty = int((matrix.class_counts == 0).sum())
+    print("\nMost frequent classes:")
+    for i in order[:top]:
+        print(f"- {matrix.columns[i]}: {matrix.class_counts[i]} ({matrix.class_frequency[i]:.2%}), "
+              f"pos_weight {matrix.pos_weight[i]:.1f}")
+    print("\nLeast frequent classes:")
+    for i in order[::-1][:top]:
+        print(f"- {matrix.columns[i]}: {matrix.class_counts[i]} ({matrix.class_frequency[i]:.2%}), "
+              f"pos_weight {matrix.pos_weight[i]:.1f}")
+    if empty:
+        print(f"\n⚠️  {empty} classes have no positive examples")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Verify the SNOMED label parquet.")
+    parser.add_argument("file", nargs="?", default="data/Processed/ptbxl_with_snomed.parquet",
+                        help="Parquet file to check (default: data/Processed/ptbxl_with_snomed.parquet).")
+    parser.add_argument("--labels-report", action="store_true",
+                        help="Also pack the labels into a LabelMatrix and report class balance.")
+    parser.add_argument("--matrix", type=Path, default=None,
+                        help="Report on a saved label matrix (.npz from label_matrix.py) instead of the parquet.")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    verify_ptbxl_snomed_parquet()
+    args = parse_args()
+    if args.matrix is not None:
+        report_label_matrix(LabelMatrix.load(args.matrix))
+    else:
+        verify_ptbxl_snomed_parquet(args.file)
+        if args.labels_report:
+            print()
+            report_label_matrix(LabelMatrix.from_parquet(args.file))
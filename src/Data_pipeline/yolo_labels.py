@@ -1,9 +1,126 @@
 import os
+import struct
+from functools import lru_cache
+
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
 # Standard 12-lead ECG order
 LEAD_ORDER = ["I", "II", "III", "aVR", "aVL", "aVF", "V1", "V2", "V3", "V4", "V5", "V6"]
 
+# 3x4 sheet layout and the per-cell buffer used by the grid heuristic
+GRID_ROWS, GRID_COLS = 3, 4
+BOX_BUFFER = 0.05
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def _grid_cells(img_width, img_height, buffer=BOX_BUFFER):
+    """Returns (class_ids, x_min, y_min, box_width, box_height) arrays for the 3x4 grid."""
+    cell_width = img_width / GRID_COLS
+    cell_height = img_height / GRID_ROWS
+    buffer_x = cell_width * buffer
+    buffer_y = cell_height * buffer
+
+    # Column-major order so class ids follow LEAD_ORDER
+    cols = np.repeat(np.arange(GRID_COLS), GRID_ROWS)
+    rows = np.tile(np.arange(GRID_ROWS), GRID_COLS)
+    class_ids = cols * GRID_ROWS + rows
+
+    x_min = cols * cell_width + buffer_x
+    y_min = rows * cell_height + buffer_y
+    box_width = np.full(len(class_ids), cell_width - 2 * buffer_x)
+    box_height = np.full(len(class_ids), cell_height - 2 * buffer_y)
+    return class_ids, x_min, y_min, box_width, box_height
+
+def grid_lead_boxes(img_width, img_height, buffer=BOX_BUFFER):
+    """
+    Computes the 12 lead boxes of the 3x4 grid heuristic in pixel coordinates.
+
+    Args:
+        img_width (float): Sheet width in pixels.
+        img_height (float): Sheet height in pixels.
+        buffer (float): Fraction of each cell trimmed from every side.
+
+    Returns:
+        np.ndarray: Array of shape [12, 4] holding (x_min, y_min, x_max, y_max),
+                    one row per class id in LEAD_ORDER (column-major).
+    """
+    _, x_min, y_min, box_width, box_height = _grid_cells(img_width, img_height, buffer)
+    return np.stack([x_min, y_min, x_min + box_width, y_min + box_height], axis=1)
+
+@lru_cache(maxsize=None)
+def grid_label_array(img_width, img_height):
+    """
+    Returns the grid-heuristic labels for a sheet size as a [12, 5] float32 array
+    of (class_id, x_center, y_center, width, height), normalised like the .txt files.
+    """
+    class_ids, x_min, y_min, box_width, box_height = _grid_cells(img_width, img_height)
+    labels = np.stack([
+        class_ids,
+        (x_min + box_width / 2) / img_width,
+        (y_min + box_height / 2) / img_height,
+        box_width / img_width,
+        box_height / img_height,
+    ], axis=1).astype(np.float32)
+    labels.flags.writeable = False
+    return labels
+
+@lru_cache(maxsize=None)
+def grid_label_string(img_width, img_height):
+    """
+    Builds the YOLO label file contents for a sheet of the given size.
+
+    GenECG sheets come in a handful of sizes, so the result is cached per
+    (width, height) and reused for every image of that size.
+
+    Returns:
+        str: 12 lines of "class_id x_center y_center width height" (normalised).
+    """
+    class_ids, x_min, y_min, box_width, box_height = _grid_cells(img_width, img_height)
+
+    # Convert to YOLO format (normalized center x, center y, width, height)
+    x_center = (x_min + box_width / 2) / img_width
+    y_center = (y_min + box_height / 2) / img_height
+    norm_width = box_width / img_width
+    norm_height = box_height / img_height
+
+    return "\n".join(
+        f"{class_id} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}"
+        for class_id, xc, yc, w, h in zip(class_ids, x_center, y_center, norm_width, norm_height)
+    )
+
+def read_image_size(image_path):
+    """
+    Returns (width, height) of an image.
+
+    For PNGs only the 24-byte header is read (signature + IHDR chunk); other
+    formats fall back to PIL, which also avoids decoding pixel data.
+    """
+    with open(image_path, "rb") as f:
+        header = f.read(24)
+    if header[:8] == PNG_SIGNATURE and header[12:16] == b"IHDR":
+        return struct.unpack(">II", header[16:24])
+
+    with Image.open(image_path) as img:
+        return img.size
+
+def write_yolo_label(image_path, output_dir):
+    """
+    Writes the grid-heuristic label file for one image without any logging.
+
+    Assumes `output_dir` already exists. Raises on unreadable images.
+
+    Returns:
+        str: Path of the written .txt file.
+    """
+    img_width, img_height = read_image_size(image_path)
+    file_name_no_ext = os.path.splitext(os.path.basename(image_path))[0]
+    output_path = os.path.join(output_dir, f"{file_name_no_ext}.txt")
+
+    with open(output_path, 'w') as f:
+        f.write(grid_label_string(img_width, img_height))
+    return output_path
+
 def generate_yolo_labels(image_path, output_dir):
     """
     Generates a YOLO format label file for a given GenECG image.
@@ -17,56 +134,10 @@ def generate_yolo_labels(image_path, output_dir):
         output_dir (str): The directory to save the .txt label file.
     """
     try:
-        # Load the image to get its dimensions
-        img = Image.open(image_path)
-        img_width, img_height = img.size
-
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
+        output_path = write_yolo_label(image_path, output_dir)
 
-        # Get the base name of the image file to create the corresponding .txt file
-        base_name = os.path.basename(image_path)
-        file_name_no_ext = os.path.splitext(base_name)[0]
-        output_path = os.path.join(output_dir, f"{file_name_no_ext}.txt")
-
-        # Grid dimensions
-        rows, cols = 3, 4
-        cell_width = img_width / cols
-        cell_height = img_height / rows
-
-        # Buffer calculation (e.g., 5% of cell dimensions)
-        buffer_x = cell_width * 0.05
-        buffer_y = cell_height * 0.05
-
-        yolo_labels = []
-
-        # Iterate through columns then rows to match the specified lead order
-        for col in range(cols):
-            for row in range(rows):
-                # Calculate class_id based on column-major order
-                class_id = col * rows + row
-
-                # Calculate bounding box with buffer
-                x_min = col * cell_width + buffer_x
-                y_min = row * cell_height + buffer_y
-                box_width = cell_width - (2 * buffer_x)
-                box_height = cell_height - (2 * buffer_y)
-
-                # Convert to YOLO format (normalized center x, center y, width, height)
-                x_center = (x_min + box_width / 2) / img_width
-                y_center = (y_min + box_height / 2) / img_height
-                norm_width = box_width / img_width
-                norm_height = box_height / img_height
-                
-                # Append to list, ensuring values are within [0, 1]
-                yolo_labels.append(
-                    f"{class_id} {x_center:.6f} {y_center:.6f} {norm_width:.6f} {norm_height:.6f}"
-                )
-
-        # Save the .txt file
-        with open(output_path, 'w') as f:
-            f.write("\n".join(yolo_labels))
-        
     except FileNotFoundError:
         print(f"Error: The file {image_path} was not found.")
     except Exception as e:
@@ -75,14 +146,43 @@ def generate_yolo_labels(image_path, output_dir):
         # Only print success if no exception was raised
         print(f"Successfully generated YOLO label file: {output_path}")
 
+def parse_yolo_boxes(lines):
+    """
+    Parses YOLO label lines into a [N, 5] float32 array in one pass.
+
+    Args:
+        lines (str | list): A label file's text, or a list of
+                            "class_id x_center y_center width height" strings.
+
+    Returns:
+        np.ndarray: Array of shape [N, 5] (class_id, x_center, y_center, width, height).
+    """
+    text = lines if isinstance(lines, str) else " ".join(lines)
+    return np.array(text.split(), dtype=np.float32).reshape(-1, 5)
+
+def yolo_to_xyxy(labels, img_width=1.0, img_height=1.0):
+    """
+    Converts YOLO rows [..., 5] to (x_min, y_min, x_max, y_max) boxes [..., 4]
+    scaled to the given size (normalised coordinates by default).
+    """
+    labels = np.asarray(labels, dtype=np.float32)
+    x_center, y_center = labels[..., 1], labels[..., 2]
+    half_width, half_height = labels[..., 3] / 2, labels[..., 4] / 2
+    return np.stack([
+        (x_center - half_width) * img_width,
+        (y_center - half_height) * img_height,
+        (x_center + half_width) * img_width,
+        (y_center + half_height) * img_height,
+    ], axis=-1)
+
 def visualize_detections(image, boxes):
     """
     Draws bounding boxes and labels on an image.
 
     Args:
         image (PIL.Image.Image): The image to draw on.
-        boxes (list): A list of strings, where each string is a YOLO-formatted
-                      bounding box: "class_id x_center y_center width height".
+        boxes (list | np.ndarray): YOLO-formatted boxes, either strings of
+                      "class_id x_center y_center width height" or a [N, 5] array.
     
     Returns:
         PIL.Image.Image: The image with detections drawn on it.
@@ -91,29 +191,13 @@ def visualize_detections(image, boxes):
     draw = ImageDraw.Draw(img)
     img_width, img_height = img.size
 
-    for box_str in boxes:
-        parts = box_str.strip().split()
-        class_id = int(parts[0])
-        x_center = float(parts[1])
-        y_center = float(parts[2])
-        norm_width = float(parts[3])
-        norm_height = float(parts[4])
-
-        # Denormalize coordinates
-        box_width = norm_width * img_width
-        box_height = norm_height * img_height
-        x_min = (x_center * img_width) - (box_width / 2)
-        y_min = (y_center * img_height) - (box_height / 2)
-        x_max = x_min + box_width
-        y_max = y_min + box_height
-
+    labels = boxes if isinstance(boxes, np.ndarray) else parse_yolo_boxes(boxes)
+    for class_id, (x_min, y_min, x_max, y_max) in zip(labels[:, 0].astype(int),
+                                                      yolo_to_xyxy(labels, img_width, img_height).tolist()):
         # Draw bounding box
         draw.rectangle([(x_min, y_min), (x_max, y_max)], outline="red", width=2)
-        
-        # Get label and draw it
-        label = LEAD_ORDER[class_id]
         # Offset the text slightly to be more readable
-        draw.text((x_min + 5, y_min + 5), label, fill="red")
+        draw.text((x_min + 5, y_min + 5), LEAD_ORDER[class_id], fill="red")
 
     return img
 
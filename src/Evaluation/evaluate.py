@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Evaluate a ViT checkpoint and fit per-class decision thresholds.
+
+Scores the validation split (same seed and fraction as training) or every
+labelled image, streaming batches into MultiLabelEvaluator, so memory stays
+constant across the full dataset. Prints per-class AUROC / AP / F1, writes a
+JSON report and stores fitted thresholds next to the checkpoint as
+`<checkpoint>.thresholds.json`, which src/inference.py picks up automatically.
+
+Usage:
+    python src/Evaluation/evaluate.py --model runs/vit/vit_multilabel_checkpoint.pt \
+        --image-cache data/Processed/image_cache --report runs/vit/eval_report.json
+"""
+
+import argparse
+import copy
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+try:
+    from src.Data_pipeline.image_cache import normalize_batch
+    from src.Evaluation.metrics import (DEFAULT_MIN_POSITIVES, DEFAULT_NUM_BINS, DEFAULT_THRESHOLD, MultiLabelEvaluator,
+                                        save_thresholds, thresholds_path_for)
+    from src.inference import load_vit_model, predict_batch
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+    from src.Training.train import DEFAULT_LABELS, DEFAULT_RAW_DIR, build_datasets, load_labels, make_loader
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.image_cache import normalize_batch
+    from src.Evaluation.metrics import (DEFAULT_MIN_POSITIVES, DEFAULT_NUM_BINS, DEFAULT_THRESHOLD, MultiLabelEvaluator,
+                                        save_thresholds, thresholds_path_for)
+    from src.inference import load_vit_model, predict_batch
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+    from src.Training.train import DEFAULT_LABELS, DEFAULT_RAW_DIR, build_datasets, load_labels, make_loader
+
+
+def column_order(label_cols: list, snomed_cols: list) -> np.ndarray:
+    """Indices that reorder label columns into the model's `snomed_cols` order."""
+    positions = {col: i for i, col in enumerate(label_cols)}
+    missing = [col for col in snomed_cols if col not in positions]
+    if missing:
+        raise ValueError(f"Labels are missing {len(missing)} model classes, e.g. {missing[:3]}")
+    return np.array([positions[col] for col in snomed_cols], dtype=np.int64)
+
+
+def evaluate(model, loader, device: torch.device, num_classes: int, label_order=None,
+             num_bins: int = DEFAULT_NUM_BINS) -> MultiLabelEvaluator:
+    """Stream every batch through the model into a MultiLabelEvaluator."""
+    evaluator = MultiLabelEvaluator(num_classes, num_bins)
+    for images, labels in loader:
+        probs = predict_batch(model, normalize_batch(images, device), device)
+        labels = labels.numpy()
+        if label_order is not None:
+            labels = labels[:, label_order]
+        evaluator.update(probs, labels)
+    return evaluator
+
+
+def print_report(report: dict, top: int = 20):
+    print("\n" + "=" * 72)
+    print("📋 PER-CLASS METRICS (by support)")
+    print("=" * 72)
+    print(f"{'SNOMED Code':<15} {'Support':>8} {'AUROC':>8} {'AP':>8} {'F1':>8} {'Thresh':>8}")
+    print("-" * 72)
+    fmt = lambda v: f"{v:>8.3f}" if v is not None else f"{'n/a':>8}"
+    classes = sorted(report["classes"].items(), key=lambda item: -item[1]["support"])
+    for col, m in classes[:top]:
+        print(f"{col.replace('SNOMED_', ''):<15} {m['support']:>8} {fmt(m['auroc'])} "
+              f"{fmt(m['average_precision'])} {fmt(m['f1'])} {m['threshold']:>8.3f}")
+    if len(classes) > top:
+        print(f"... {len(classes) - top} more classes in the JSON report")
+    print("-" * 72)
+    macro, micro = report["macro"], report["micro"]
+    print(f"Macro AUROC {fmt(macro['auroc'])} | Macro AP {fmt(macro['average_precision'])} | "
+          f"Macro F1 {fmt(macro['f1'])} | Micro F1 {fmt(micro['f1'])}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a GenECG ViT checkpoint and fit per-class thresholds.")
+    parser.add_argument("--model", type=Path, default=Path("runs/vit/vit_multilabel_checkpoint.pt"),
+                        help="Checkpoint (.pt / .safetensors, or an exported .ts/.onnx with --backend).")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32", help="Inference backend (default: fp32).")
+    parser.add_argument("--labels", type=Path, default=DEFAULT_LABELS,
+                        help="SNOMED label parquet, or a packed .npz from src/Data_pipeline/label_matrix.py.")
+    parser.add_argument("--raw-dir", type=Path, default=DEFAULT_RAW_DIR, help="Root directory containing ECG PNGs.")
+    parser.add_argument("--image-cache", type=Path, default=None,
+                        help="Pre-decoded cache from src/Data_pipeline/image_cache.py (used instead of --raw-dir).")
+    parser.add_argument("--index", type=Path, default=None,
+                        help="ecg index from src/Data_pipeline/ecg_index.py; replaces the walk over --raw-dir.")
+    parser.add_argument("--split", choices=["val", "all"], default="val",
+                        help="Validation split as seen in training (default) or every labelled image.")
+    parser.add_argument("--val-fraction", type=float, default=0.2, help="Validation split used in training (default: 0.2).")
+    parser.add_argument("--seed", type=int, default=42, help="Split seed used in training (default: 42).")
+    parser.add_argument("--max-samples", type=int, default=None, help="Limit matched samples, as in training.")
+    parser.add_argument("--image-size", type=int, default=224, help="Input size when decoding raw PNGs (default: 224).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per forward pass (default: 64).")
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader workers (default: 4).")
+    parser.add_argument("--num-bins", type=int, default=DEFAULT_NUM_BINS,
+                        help=f"Score histogram bins per class (default: {DEFAULT_NUM_BINS}).")
+    parser.add_argument("--threshold-metric", choices=["f1", "fbeta", "youden"], default="f1",
+                        help="Objective maximised per class when fitting thresholds (default: f1).")
+    parser.add_argument("--beta", type=float, default=1.0, help="Beta for --threshold-metric fbeta (default: 1.0).")
+    parser.add_argument("--min-positives", type=int, default=DEFAULT_MIN_POSITIVES,
+                        help=f"Classes with fewer positives keep {DEFAULT_THRESHOLD} (default: {DEFAULT_MIN_POSITIVES}).")
+    parser.add_argument("--thresholds-output", type=Path, default=None,
+                        help="Where to write fitted thresholds (default: <model>.thresholds.json).")
+    parser.add_argument("--no-fit", action="store_true", help=f"Only report metrics at the global {DEFAULT_THRESHOLD}.")
+    parser.add_argument("--report", type=Path, default=None, help="Write the full JSON report here.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.model.exists():
+        print(f"❌ Model not found: {args.model}")
+        sys.exit(1)
+
+    device = backend_device(args.backend)
+    print(f"🖥️  Using device: {device} ({args.backend} backend)")
+    model, snomed_cols = load_backend(args.backend, str(args.model), device, load_fp32=load_vit_model)
+
+    label_matrix = load_labels(args.labels)
+    label_order = column_order(label_matrix.columns, snomed_cols)
+    split_args = copy.copy(args)
+    if args.split == "all":
+        split_args.val_fraction = 1.0
+    _, dataset = build_datasets(split_args, label_matrix)
+    loader = make_loader(dataset, args.batch_size, False, args.workers, device)
+    print(f"🔍 Evaluating {len(dataset)} images ({args.split} split) over {len(snomed_cols)} SNOMED classes")
+
+    start = time.perf_counter()
+    evaluator = evaluate(model, loader, device, len(snomed_cols), label_order, args.num_bins)
+    elapsed = time.perf_counter() - start
+    print(f"📊 Scored {evaluator.num_samples} images in {elapsed:.1f}s "
+          f"({evaluator.num_samples / max(elapsed, 1e-9):.1f} images/sec)")
+
+    thresholds = DEFAULT_THRESHOLD
+    if not args.no_fit:
+        thresholds = evaluator.fit_thresholds(args.threshold_metric, args.beta, args.min_positives)
+    report = evaluator.report(snomed_cols, thresholds)
+    print_report(report)
+
+    if not args.no_fit:
+        global_f1 = np.nanmean(evaluator.f1(DEFAULT_THRESHOLD))
+        print(f"(macro F1 at the global {DEFAULT_THRESHOLD} threshold: {global_f1:.3f})")
+        thresholds_path = args.thresholds_output or thresholds_path_for(args.model)
+        save_thresholds(thresholds_path, snomed_cols, thresholds, args.threshold_metric, extra={
+            "checkpoint": str(args.model),
+            "split": args.split,
+            "num_samples": evaluator.num_samples,
+            "macro_f1": report["macro"]["f1"],
+        })
+        print(f"💾 Per-class thresholds written to {thresholds_path}")
+
+    if args.report:
+        args.report.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.report}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Streaming multi-label metrics for the SNOMED classifier.
+
+Predictions are never stored. Each batch of sigmoid probabilities is binned into
+per-class histograms of positive and negative scores ([C, num_bins] counts), so
+memory stays constant however many images are evaluated. Per-class ROC and
+precision-recall curves, AUROC, average precision, F1 and confusion counts are
+then read off the cumulative histograms, and decision thresholds are fitted
+for every class at once.
+
+Scores are resolved to 1 / num_bins; with the default 1000 bins the metrics
+agree with the exact (sorted) computations to about 1e-3.
+
+Usage:
+    from src.Evaluation.metrics import MultiLabelEvaluator
+
+    evaluator = MultiLabelEvaluator(num_classes=len(snomed_cols))
+    for probs, labels in batches:
+        evaluator.update(probs, labels)
+    report = evaluator.report(snomed_cols, thresholds=evaluator.fit_thresholds())
+"""
+
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_NUM_BINS = 1000
+DEFAULT_THRESHOLD = 0.3
+DEFAULT_MIN_POSITIVES = 5
+THRESHOLDS_SUFFIX = ".thresholds.json"
+
+
+def _to_numpy(values) -> np.ndarray:
+    if hasattr(values, "detach"):
+        values = values.detach().float().cpu().numpy()
+    return np.asarray(values)
+
+
+class MultiLabelEvaluator:
+    """
+    Bounded-memory accumulator of per-class score histograms.
+
+    Bin k holds scores in [k / num_bins, (k + 1) / num_bins); thresholds are
+    evaluated at the bin edges, so "score >= k / num_bins" counts bins k and up.
+    """
+
+    def __init__(self, num_classes: int, num_bins: int = DEFAULT_NUM_BINS):
+        self.num_classes = num_classes
+        self.num_bins = num_bins
+        self.pos = np.zeros((num_classes, num_bins), dtype=np.int64)
+        self.neg = np.zeros((num_classes, num_bins), dtype=np.int64)
+        self._offsets = np.arange(num_classes, dtype=np.int64) * num_bins
+
+    @property
+    def num_samples(self) -> int:
+        return int(self.pos[0].sum() + self.neg[0].sum()) if self.num_classes else 0
+
+    def update(self, probs, labels):
+        """
+        Add a batch of sigmoid probabilities and 0/1 targets, both [B, C].
+
+        Accepts numpy arrays or torch tensors (on any device).
+        """
+        probs = _to_numpy(probs).reshape(-1, self.num_classes)
+        labels = _to_numpy(labels).reshape(-1, self.num_classes) > 0.5
+        bins = np.clip((probs * self.num_bins).astype(np.int64), 0, self.num_bins - 1)
+        flat = (bins + self._offsets).ravel()
+        is_pos = labels.ravel()
+        size = self.num_classes * self.num_bins
+        self.pos += np.bincount(flat[is_pos], minlength=size).reshape(self.pos.shape)
+        self.neg += np.bincount(flat[~is_pos], minlength=size).reshape(self.neg.shape)
+
+    def merge(self, other: "MultiLabelEvaluator"):
+        """Add another evaluator's counts (e.g. from a different worker or shard)."""
+        if (other.num_classes, other.num_bins) != (self.num_classes, self.num_bins):
+            raise ValueError("Cannot merge evaluators with different shapes")
+        self.pos += other.pos
+        self.neg += other.neg
+
+    def all_reduce(self, device=None):
+        """Sum the histograms over all torch.distributed processes (no-op when not distributed)."""
+        import torch
+        import torch.distributed as dist
+
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+        counts = torch.from_numpy(np.stack([self.pos, self.neg])).to(device or "cpu")
+        dist.all_reduce(counts)
+        counts = counts.cpu().numpy()
+        self.pos, self.neg = counts[0].copy(), counts[1].copy()
+
+    def reset(self):
+        self.pos[:] = 0
+        self.neg[:] = 0
+
+    def _cumulative(self):
+        """tp[c, k], fp[c, k]: samples scoring >= k / num_bins, for k = 0 .. num_bins (last column is 0)."""
+        zeros = np.zeros((self.num_classes, 1), dtype=np.int64)
+        tp = np.concatenate([np.cumsum(self.pos[:, ::-1], axis=1)[:, ::-1], zeros], axis=1)
+        fp = np.concatenate([np.cumsum(self.neg[:, ::-1], axis=1)[:, ::-1], zeros], axis=1)
+        return tp, fp
+
+    def support(self):
+        """(positives, negatives) per class."""
+        return self.pos.sum(axis=1), self.neg.sum(axis=1)
+
+    def auroc(self) -> np.ndarray:
+        """Per-class area under the ROC curve (NaN for classes missing positives or negatives)."""
+        tp, fp = self._cumulative()
+        n_pos, n_neg = tp[:, :1].astype(np.float64), fp[:, :1].astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tpr = tp[:, ::-1] / n_pos
+            fpr = fp[:, ::-1] / n_neg
+            # Trapezoids give tied scores (same bin) half credit, as the exact AUROC does
+            auc = np.sum(np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2, axis=1)
+        auc[(n_pos[:, 0] == 0) | (n_neg[:, 0] == 0)] = np.nan
+        return auc
+
+    def average_precision(self) -> np.ndarray:
+        """Per-class average precision: sum over thresholds of precision x recall increment."""
+        tp, fp = self._cumulative()
+        n_pos = tp[:, :1].astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            precision = np.where(tp + fp > 0, tp / np.maximum(tp + fp, 1), 1.0)
+            recall = tp / n_pos
+            # Walk thresholds from high to low; recall only grows
+            ap = np.sum(np.diff(recall[:, ::-1], axis=1) * precision[:, ::-1][:, 1:], axis=1)
+        ap[n_pos[:, 0] == 0] = np.nan
+        return ap
+
+    def _threshold_bins(self, thresholds) -> np.ndarray:
+        thresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.float64), (self.num_classes,))
+        return np.clip(np.ceil(thresholds * self.num_bins - 1e-9).astype(np.int64), 0, self.num_bins)
+
+    def confusion(self, thresholds=DEFAULT_THRESHOLD) -> dict:
+        """Per-class tp/fp/fn/tn arrays for a scalar or per-class threshold (positive if score >= t)."""
+        tp_curve, fp_curve = self._cumulative()
+        k = self._threshold_bins(thresholds)[:, None]
+        n_pos, n_neg = self.support()
+        tp = np.take_along_axis(tp_curve, k, axis=1)[:, 0]
+        fp = np.take_along_axis(fp_curve, k, axis=1)[:, 0]
+        return {"tp": tp, "fp": fp, "fn": n_pos - tp, "tn": n_neg - fp}
+
+    def f1(self, thresholds=DEFAULT_THRESHOLD) -> np.ndarray:
+        c = self.confusion(thresholds)
+        denom = 2 * c["tp"] + c["fp"] + c["fn"]
+        return np.where(denom > 0, 2 * c["tp"] / np.maximum(denom, 1), np.nan)
+
+    def fit_thresholds(self, metric: str = "f1", beta: float = 1.0, min_positives: int = DEFAULT_MIN_POSITIVES,
+                       default: float = DEFAULT_THRESHOLD) -> np.ndarray:
+        """
+        Per-class decision thresholds maximising F-beta ("f1"/"fbeta") or Youden's J ("youden").
+
+        All classes and candidate thresholds are scored in one [C, num_bins] array
+        operation. Classes with fewer than `min_positives` positives keep `default`.
+        """
+        tp, fp = self._cumulative()
+        tp, fp = tp[:, :-1].astype(np.float64), fp[:, :-1].astype(np.float64)
+        n_pos, n_neg = self.support()
+        fn = n_pos[:, None] - tp
+        if metric in ("f1", "fbeta"):
+            b2 = beta ** 2
+            denom = (1 + b2) * tp + b2 * fn + fp
+            score = np.where(denom > 0, (1 + b2) * tp / np.maximum(denom, 1e-12), 0.0)
+        elif metric == "youden":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                score = np.nan_to_num(tp / n_pos[:, None] - fp / n_neg[:, None])
+        else:
+            raise ValueError(f"Unknown threshold metric: {metric}")
+
+        # Highest-scoring bin edge; ties resolve to the higher threshold (fewer false positives)
+        best = self.num_bins - 1 - np.argmax(score[:, ::-1], axis=1)
+        thresholds = best / self.num_bins
+        thresholds[n_pos < min_positives] = default
+        return thresholds
+
+    def report(self, snomed_cols: list, thresholds=DEFAULT_THRESHOLD) -> dict:
+        """Per-class and macro/micro summary as a JSON-serialisable dict."""
+        thresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.float64), (self.num_classes,))
+        auroc, ap, f1 = self.auroc(), self.average_precision(), self.f1(thresholds)
+        conf = self.confusion(thresholds)
+        n_pos, _ = self.support()
+
+        classes = {}
+        for i, col in enumerate(snomed_cols):
+            classes[col] = {
+                "support": int(n_pos[i]),
+                "threshold": float(thresholds[i]),
+                "auroc": _nan_to_none(auroc[i]),
+                "average_precision": _nan_to_none(ap[i]),
+                "f1": _nan_to_none(f1[i]),
+                **{name: int(conf[name][i]) for name in ("tp", "fp", "fn", "tn")},
+            }
+
+        tp, fp, fn = conf["tp"].sum(), conf["fp"].sum(), conf["fn"].sum()
+        return {
+            "num_samples": self.num_samples,
+            "num_bins": self.num_bins,
+            "macro": {
+                "auroc": _nanmean(auroc),
+                "average_precision": _nanmean(ap),
+                "f1": _nanmean(f1),
+            },
+            "micro": {
+                "precision": float(tp / (tp + fp)) if tp + fp else None,
+                "recall": float(tp / (tp + fn)) if tp + fn else None,
+                "f1": float(2 * tp / (2 * tp + fp + fn)) if tp + fp + fn else None,
+            },
+            "classes": classes,
+        }
+
+
+def _nan_to_none(value):
+    return None if np.isnan(value) else float(value)
+
+
+def _nanmean(values: np.ndarray):
+    values = values[~np.isnan(values)]
+    return float(values.mean()) if values.size else None
+
+
+def thresholds_path_for(checkpoint_path) -> Path:
+    """Where fitted thresholds live for a checkpoint: `<checkpoint>.thresholds.json`."""
+    checkpoint_path = Path(checkpoint_path)
+    return checkpoint_path.with_name(checkpoint_path.name + THRESHOLDS_SUFFIX)
+
+
+def save_thresholds(path, snomed_cols: list, thresholds, metric: str = "f1", extra: dict | None = None):
+    """Write per-class thresholds keyed by SNOMED column name."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "metric": metric,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **(extra or {}),
+        "thresholds": {col: float(t) for col, t in zip(snomed_cols, thresholds)},
+    }
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(payload, indent=2))
+    tmp_path.replace(path)
+    return path
+
+
+def load_thresholds(path, snomed_cols: list, default: float = DEFAULT_THRESHOLD) -> np.ndarray:
+    """Per-class thresholds aligned to `snomed_cols`; classes missing from the file get `default`."""
+    with open(path) as f:
+        stored = json.load(f)["thresholds"]
+    return np.array([stored.get(col, default) for col in snomed_cols], dtype=np.float32)
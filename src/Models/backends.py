@@ -0,0 +1,177 @@
+"""CPU-oriented inference backends for the ViT classifier.
+
+Every backend is returned as a callable that takes a normalised
+[B, 3, 224, 224] batch and returns an object with a `.logits` attribute,
+so `predict()` and `predict_batch()` work unchanged across backends.
+"""
+
+import json
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import torch
+
+BACKENDS = ("fp32", "int8", "torchscript", "onnx")
+CPU_ONLY_BACKENDS = {"int8", "onnx"}
+SNOMED_COLS_FILE = "snomed_cols.json"
+
+
+class LogitsOutput(NamedTuple):
+    logits: torch.Tensor
+
+
+class LogitsModule(torch.nn.Module):
+    """Wraps a Hugging Face ViT so tracing/export sees a plain tensor -> tensor graph."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+
+class _ScriptedBackend:
+    def __init__(self, module):
+        self.module = module
+
+    def __call__(self, pixel_values):
+        return LogitsOutput(self.module(pixel_values))
+
+
+class _OnnxBackend:
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def __call__(self, pixel_values):
+        logits = self.session.run(None, {self.input_name: pixel_values.cpu().numpy().astype(np.float32)})[0]
+        return LogitsOutput(torch.from_numpy(logits))
+
+
+def backend_device(backend: str) -> torch.device:
+    """Device a backend runs on (int8 and ONNX Runtime are CPU-only here)."""
+    if backend in CPU_ONLY_BACKENDS or not torch.cuda.is_available():
+        return torch.device("cpu")
+    return torch.device("cuda")
+
+
+def quantize_int8(model):
+    """Dynamically quantize every nn.Linear (attention + MLP + classifier) to int8."""
+    return torch.ao.quantization.quantize_dynamic(model.cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _is_scripted(model_path) -> bool:
+    return Path(model_path).suffix in {".ts", ".torchscript"}
+
+
+def load_torchscript(model_path, device: torch.device):
+    extra_files = {SNOMED_COLS_FILE: ""}
+    module = torch.jit.load(str(model_path), map_location=device, _extra_files=extra_files)
+    module.eval()
+    return _ScriptedBackend(module), json.loads(extra_files[SNOMED_COLS_FILE])
+
+
+def load_onnx(model_path):
+    try:
+        import onnxruntime as ort
+    except ModuleNotFoundError as exc:  # pragma: no cover - checked at runtime
+        raise RuntimeError(
+            "ONNX Runtime is required for --backend onnx. Install it with `pip install onnxruntime`."
+        ) from exc
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+    snomed_cols = json.loads(session.get_modelmeta().custom_metadata_map["snomed_cols"])
+    return _OnnxBackend(session), snomed_cols
+
+
+def load_backend(backend: str, model_path, device: torch.device, load_fp32=None):
+    """
+    Load `model_path` for the requested backend.
+
+    Args:
+        backend (str): One of BACKENDS.
+        model_path (str): fp32 checkpoint (.pt/.safetensors) for fp32/int8, an
+            exported .ts file for torchscript (or a pre-quantized int8 .ts), or
+            an .onnx file for onnx.
+        device (torch.device): Target device (see `backend_device`).
+        load_fp32 (callable): Loader for fp32 checkpoints, normally
+            `inference.load_vit_model`.
+
+    Returns:
+        tuple: (model callable, snomed_cols)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Choose from {', '.join(BACKENDS)}")
+
+    if backend == "onnx":
+        return load_onnx(model_path)
+    if backend == "torchscript" or (backend == "int8" and _is_scripted(model_path)):
+        return load_torchscript(model_path, device)
+
+    model, snomed_cols = load_fp32(model_path, device)
+    if backend == "int8":
+        model = quantize_int8(model)
+    return model, snomed_cols
+
+
+def export_torchscript(model, snomed_cols: list, output_path, image_size: int = 224):
+    """Trace `model` (fp32 or dynamically quantized) to TorchScript with snomed_cols embedded."""
+    example = torch.randn(1, 3, image_size, image_size)
+    with torch.no_grad():
+        traced = torch.jit.trace(LogitsModule(model).eval(), example, strict=False)
+    torch.jit.save(traced, str(output_path), _extra_files={SNOMED_COLS_FILE: json.dumps(snomed_cols)})
+    return output_path
+
+
+def export_onnx(model, snomed_cols: list, output_path, image_size: int = 224, opset: int = 17):
+    """Export `model` to ONNX with a dynamic batch axis and snomed_cols in the model metadata."""
+    import onnx
+
+    example = torch.randn(1, 3, image_size, image_size)
+    torch.onnx.export(
+        LogitsModule(model).eval(),
+        (example,),
+        str(output_path),
+        input_names=["pixel_values"],
+        output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+
+    onnx_model = onnx.load(str(output_path))
+    entry = onnx_model.metadata_props.add()
+    entry.key, entry.value = "snomed_cols", json.dumps(snomed_cols)
+    onnx.save(onnx_model, str(output_path))
+    return output_path
+
+
+def parity_report(reference, candidate, batches, snomed_cols: list, threshold: float = 0.3):
+    """
+    Compare a candidate backend against the fp32 reference on the same batches.
+
+    Returns:
+        dict: Per-class max absolute probability deviation, the overall maximum,
+        and how many image/class decisions flip at `threshold`.
+    """
+    max_dev = np.zeros(len(snomed_cols), dtype=np.float64)
+    flips = 0
+    images = 0
+    with torch.no_grad():
+        for batch in batches:
+            ref = torch.sigmoid(reference(batch).logits.float()).cpu().numpy()
+            cand = torch.sigmoid(candidate(batch).logits.float()).cpu().numpy()
+            max_dev = np.maximum(max_dev, np.abs(ref - cand).max(axis=0))
+            flips += int(((ref >= threshold) != (cand >= threshold)).sum())
+            images += len(ref)
+
+    return {
+        "images": images,
+        "max_abs_deviation": float(max_dev.max()) if max_dev.size else 0.0,
+        "decision_flips": flips,
+        "per_class": {col: float(dev) for col, dev in zip(snomed_cols, max_dev)},
+    }
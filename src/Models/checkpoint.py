@@ -0,0 +1,115 @@
+"""Self-contained ViT checkpoint export and loading (safetensors)."""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import torch
+
+BASE_MODEL = "google/vit-base-patch16-224"
+ARTIFACT_FORMAT = "genecg-vit"
+
+
+def export_safetensors(checkpoint_path, output_path, config_path=None, base_model: str = BASE_MODEL):
+    """
+    Convert a training checkpoint into a single self-contained .safetensors artifact.
+
+    The artifact stores the weights plus the ViT config and `snomed_cols` in the
+    safetensors metadata, so it can be loaded without the Hugging Face hub.
+
+    Args:
+        checkpoint_path (str): Checkpoint saved as {'model_state_dict', 'num_classes', 'snomed_cols'}.
+        output_path (str): Destination .safetensors file.
+        config_path (str, optional): Local ViT config.json. Defaults to the checkpoint's
+            'vit_config' when present, otherwise it is fetched from `base_model`.
+        base_model (str): Hub model id the checkpoint was fine-tuned from.
+    """
+    from safetensors.torch import save_file
+    from transformers import ViTConfig
+
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    snomed_cols = list(checkpoint["snomed_cols"])
+
+    if config_path is not None:
+        config = ViTConfig.from_json_file(str(config_path))
+    elif "vit_config" in checkpoint:
+        config = ViTConfig.from_dict(checkpoint["vit_config"])
+    else:
+        config = ViTConfig.from_pretrained(base_model)
+    config.num_labels = checkpoint["num_classes"]
+    config.id2label = {i: col for i, col in enumerate(snomed_cols)}
+    config.label2id = {col: i for i, col in enumerate(snomed_cols)}
+
+    state_dict = {k: v.contiguous() for k, v in checkpoint["model_state_dict"].items()}
+    metadata = {
+        "format": ARTIFACT_FORMAT,
+        "config": config.to_json_string(),
+        "snomed_cols": json.dumps(snomed_cols),
+    }
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    save_file(state_dict, str(output_path), metadata=metadata)
+    return output_path
+
+
+def read_artifact_metadata(artifact_path):
+    """Return (ViTConfig, snomed_cols) stored in a .safetensors artifact without reading the weights."""
+    from safetensors import safe_open
+    from transformers import ViTConfig
+
+    with safe_open(str(artifact_path), framework="pt") as f:
+        metadata = f.metadata() or {}
+
+    if metadata.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"{artifact_path} is not a GenECG ViT artifact (run src/Models/checkpoint.py first)")
+
+    config = ViTConfig.from_dict(json.loads(metadata["config"]))
+    return config, json.loads(metadata["snomed_cols"])
+
+
+def load_safetensors_model(artifact_path, device: torch.device):
+    """
+    Build the ViT straight from a .safetensors artifact.
+
+    The module skeleton is created on the meta device and the memory-mapped
+    tensors are assigned in place, so the weights are materialised only once
+    and no network access is needed.
+    """
+    from safetensors.torch import load_file
+    from transformers import ViTForImageClassification
+
+    config, snomed_cols = read_artifact_metadata(artifact_path)
+
+    with torch.device("meta"):
+        model = ViTForImageClassification(config)
+    state_dict = load_file(str(artifact_path), device=str(device))
+    model.load_state_dict(state_dict, assign=True)
+    model.eval()
+
+    return model, snomed_cols
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export a ViT training checkpoint to a self-contained safetensors artifact.")
+    parser.add_argument("checkpoint", type=Path, help="Training checkpoint (.pt)")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Destination .safetensors file (defaults to the checkpoint path with a .safetensors suffix).",
+    )
+    parser.add_argument("--config", type=Path, default=None, help="Local ViT config.json (skips the hub lookup).")
+    parser.add_argument("--base-model", default=BASE_MODEL, help=f"Hub model id for the config (default: {BASE_MODEL}).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.checkpoint.exists():
+        print(f"❌ Checkpoint not found: {args.checkpoint}")
+        sys.exit(1)
+
+    output = args.output or args.checkpoint.with_suffix(".safetensors")
+    export_safetensors(args.checkpoint, output, args.config, args.base_model)
+    print(f"✅ Exported self-contained artifact to {output}")
@@ -0,0 +1,108 @@
+"""Export the ViT checkpoint to CPU inference formats and check parity against fp32."""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import torch
+from torch.utils.data import DataLoader
+
+try:
+    from src.inference import ImagePathDataset, collect_image_paths, load_vit_model
+    from src.Models.backends import export_onnx, export_torchscript, load_backend, parity_report, quantize_int8
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.inference import ImagePathDataset, collect_image_paths, load_vit_model
+    from src.Models.backends import export_onnx, export_torchscript, load_backend, parity_report, quantize_int8
+
+EXPORT_FORMATS = ("torchscript", "int8", "onnx")
+EXPORT_FILES = {
+    "torchscript": ("torchscript", "model_fp32.ts"),
+    "int8": ("int8", "model_int8.ts"),
+    "onnx": ("onnx", "model.onnx"),
+}
+
+
+def parity_batches(image_inputs, limit: int = 64, batch_size: int = 16, num_random: int = 32):
+    """Real ECG batches when images are given, otherwise random normalised inputs."""
+    image_paths = collect_image_paths(image_inputs)[:limit] if image_inputs else []
+    if image_paths:
+        loader = DataLoader(ImagePathDataset(image_paths), batch_size=batch_size, shuffle=False)
+        return [images for images, _, _ in loader]
+
+    generator = torch.Generator().manual_seed(0)
+    return list(torch.randn(num_random, 3, 224, 224, generator=generator).split(batch_size))
+
+
+def export_all(checkpoint_path, output_dir: Path, formats=EXPORT_FORMATS):
+    """Write each requested format to `output_dir` and return {format: path}."""
+    device = torch.device("cpu")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    model, snomed_cols = load_vit_model(str(checkpoint_path), device)
+
+    exported = {}
+    for fmt in formats:
+        _, file_name = EXPORT_FILES[fmt]
+        output_path = output_dir / file_name
+        print(f"📦 Exporting {fmt} -> {output_path}")
+        if fmt == "torchscript":
+            export_torchscript(model, snomed_cols, output_path)
+        elif fmt == "int8":
+            export_torchscript(quantize_int8(model), snomed_cols, output_path)
+        elif fmt == "onnx":
+            export_onnx(model, snomed_cols, output_path)
+        exported[fmt] = output_path
+
+    return model, snomed_cols, exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the GenECG ViT to TorchScript / int8 / ONNX and check parity.")
+    parser.add_argument("checkpoint", type=Path, help="fp32 checkpoint (.pt or .safetensors)")
+    parser.add_argument("--output-dir", type=Path, default=Path("runs/vit/export"), help="Directory for exported models.")
+    parser.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS),
+                        help="Formats to export (default: all).")
+    parser.add_argument("--parity-images", nargs="*", default=None,
+                        help="Images, directories or globs used for the parity check (random inputs when omitted).")
+    parser.add_argument("--parity-limit", type=int, default=64, help="Maximum images used for the parity check.")
+    parser.add_argument("--threshold", type=float, default=0.3, help="Decision threshold used to count flips.")
+    parser.add_argument("--skip-parity", action="store_true", help="Only export, do not compare against fp32.")
+    args = parser.parse_args()
+
+    if not args.checkpoint.exists():
+        print(f"❌ Checkpoint not found: {args.checkpoint}")
+        sys.exit(1)
+
+    model, snomed_cols, exported = export_all(args.checkpoint, args.output_dir, args.formats)
+    if args.skip_parity:
+        return
+
+    batches = parity_batches(args.parity_images, args.parity_limit)
+    report = {}
+    print("\n" + "=" * 60)
+    print("📋 PARITY AGAINST FP32 (max |Δ probability|)")
+    print("=" * 60)
+    for fmt, path in exported.items():
+        backend, _ = EXPORT_FILES[fmt]
+        candidate, _ = load_backend(backend, path, torch.device("cpu"))
+        result = parity_report(model, candidate, batches, snomed_cols, args.threshold)
+        report[fmt] = result
+
+        worst = sorted(result["per_class"].items(), key=lambda item: item[1], reverse=True)[:5]
+        print(f"{fmt:<12} max {result['max_abs_deviation']:.5f} | "
+              f"{result['decision_flips']} flips at {args.threshold:.0%} over {result['images']} images")
+        for col, dev in worst:
+            print(f"    {col:<20} {dev:.5f}")
+
+    report_path = args.output_dir / "parity.json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Per-class parity report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
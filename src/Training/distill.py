@@ -0,0 +1,404 @@
+"""
+Knowledge distillation of the ViT-Base teacher into a compact ViT student for CPU serving.
+
+The teacher is run once over the dataset and its logits are cached in a float16
+memmap (`--teacher-cache`); later runs, including different students, reuse
+them. The student is trained on a mix of the hard SNOMED labels and the
+teacher's temperature-softened sigmoid outputs, and is saved in the same
+checkpoint format as train.py, so `load_vit_model()`, the backends and
+serve.py load it unchanged.
+
+After training, teacher and student are compared per SNOMED class (AUROC, F1 at
+fitted thresholds, mean |Δp|) together with single-image CPU latency and
+parameter counts.
+
+Usage:
+    python src/Training/distill.py --teacher runs/vit/vit_multilabel_checkpoint.pt \
+        --image-cache data/Processed/image_cache_224 --output runs/vit/student_tiny.pt
+"""
+
+import argparse
+import copy
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+
+try:
+    from src.Data_pipeline.image_cache import normalize_batch
+    from src.Evaluation.evaluate import column_order
+    from src.Evaluation.metrics import MultiLabelEvaluator, save_thresholds, thresholds_path_for
+    from src.inference import load_vit_model
+    from src.prediction_cache import model_fingerprint
+    from src.Training.train import (DEFAULT_LABELS, DEFAULT_RAW_DIR, build_datasets, build_model, load_labels,
+                                    make_loader, save_checkpoint, train_one_epoch, validate)
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.image_cache import normalize_batch
+    from src.Evaluation.evaluate import column_order
+    from src.Evaluation.metrics import MultiLabelEvaluator, save_thresholds, thresholds_path_for
+    from src.inference import load_vit_model
+    from src.prediction_cache import model_fingerprint
+    from src.Training.train import (DEFAULT_LABELS, DEFAULT_RAW_DIR, build_datasets, build_model, load_labels,
+                                    make_loader, save_checkpoint, train_one_epoch, validate)
+
+DEFAULT_TEACHER = Path("runs/vit/vit_multilabel_checkpoint.pt")
+DEFAULT_OUTPUT = Path("runs/vit/student_checkpoint.pt")
+DEFAULT_TEACHER_CACHE = Path("runs/vit/teacher_logits.npy")
+# Non-distilled DeiT checkpoints use the plain ViT architecture
+DEFAULT_STUDENT_BASE = "facebook/deit-tiny-patch16-224"
+STUDENT_SIZES = {
+    "tiny": {"hidden_size": 192, "num_hidden_layers": 12, "num_attention_heads": 3, "intermediate_size": 768},
+    "small": {"hidden_size": 384, "num_hidden_layers": 12, "num_attention_heads": 6, "intermediate_size": 1536},
+}
+
+
+class DistillationLoss(nn.Module):
+    """
+    alpha * BCE(student, labels) + (1 - alpha) * T^2 * BCE(student / T, sigmoid(teacher / T)).
+
+    Targets arrive as one [B, 2C] tensor (labels, then teacher logits) so the
+    generic train.py loop can pass them through unchanged.
+    """
+
+    def __init__(self, num_classes: int, alpha: float = 0.5, temperature: float = 2.0):
+        super().__init__()
+        self.num_classes = num_classes
+        self.alpha = alpha
+        self.temperature = temperature
+
+    def forward(self, logits: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        labels, teacher_logits = target[:, :self.num_classes], target[:, self.num_classes:]
+        t = self.temperature
+        soft = F.binary_cross_entropy_with_logits(logits / t, torch.sigmoid(teacher_logits / t)) * (t * t)
+        if self.alpha <= 0:
+            return soft
+        hard = F.binary_cross_entropy_with_logits(logits, labels)
+        return self.alpha * hard + (1 - self.alpha) * soft
+
+
+class TeacherTargetDataset(Dataset):
+    """
+    Wraps a train.py dataset so each sample's target is [labels, teacher logits].
+
+    Labels are reordered into the teacher's `snomed_cols` order. The cached
+    logits are opened lazily in each DataLoader worker.
+    """
+
+    def __init__(self, base, teacher_cache: Path, label_order: np.ndarray):
+        self.base = base
+        self.indices = base.indices
+        self.teacher_cache = Path(teacher_cache)
+        self.label_order = torch.from_numpy(label_order)
+        self._logits = None
+
+    @property
+    def logits(self) -> np.ndarray:
+        if self._logits is None:
+            self._logits = np.load(self.teacher_cache, mmap_mode="r")
+        return self._logits
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_logits"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def __getitem__(self, idx: int):
+        image, labels = self.base[idx]
+        teacher = torch.from_numpy(self.logits[self.indices[idx]].astype(np.float32))
+        return image, torch.cat([labels[self.label_order], teacher])
+
+
+def _cache_meta_path(cache_path: Path) -> Path:
+    return cache_path.with_suffix(".json")
+
+
+def cache_teacher_logits(teacher, datasets, num_rows: int, cache_path: Path, fingerprint: str, source: str,
+                         device: torch.device, batch_size: int = 64, num_workers: int = 4) -> int:
+    """
+    Run the teacher over every row used by `datasets` that is not cached yet.
+
+    Logits are stored in a float16 [num_rows, C] memmap indexed like the
+    dataset rows (NaN = not computed). The cache is reset if the teacher
+    checkpoint or the image source changes.
+
+    Returns:
+        int: Number of rows computed in this call.
+    """
+    cache_path = Path(cache_path)
+    meta_path = _cache_meta_path(cache_path)
+    num_classes = teacher.config.num_labels
+    meta = {"teacher_fingerprint": fingerprint, "source": source, "num_rows": num_rows, "num_classes": num_classes}
+
+    stored = json.loads(meta_path.read_text()) if meta_path.exists() and cache_path.exists() else None
+    if stored != meta:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        logits = np.lib.format.open_memmap(cache_path, mode="w+", dtype=np.float16, shape=(num_rows, num_classes))
+        logits[:] = np.nan
+        meta_path.write_text(json.dumps(meta, indent=2))
+    else:
+        logits = np.load(cache_path, mmap_mode="r+")
+
+    rows = np.unique(np.concatenate([ds.indices for ds in datasets]))
+    missing = rows[np.isnan(logits[rows, 0])]
+    if not len(missing):
+        return 0
+
+    pending = copy.copy(datasets[0])
+    pending.indices = missing
+    loader = make_loader(pending, batch_size, False, num_workers, device)
+    teacher.eval()
+    offset = 0
+    with torch.no_grad():
+        for images, _ in loader:
+            batch_logits = teacher(pixel_values=normalize_batch(images, device)).logits.float().cpu().numpy()
+            logits[missing[offset:offset + len(batch_logits)]] = batch_logits
+            offset += len(batch_logits)
+    logits.flush()
+    return len(missing)
+
+
+def build_student(num_classes: int, student_base: str | None, size: str = "tiny"):
+    """Pretrained student (fine-tuned like train.py) or a randomly initialised ViT of `size`."""
+    if student_base:
+        return build_model(num_classes, student_base)
+
+    from transformers import ViTConfig, ViTForImageClassification
+
+    config = ViTConfig(**STUDENT_SIZES[size], image_size=224, patch_size=16, num_labels=num_classes,
+                       problem_type="multi_label_classification")
+    return ViTForImageClassification(config)
+
+
+def count_parameters(model) -> int:
+    return sum(p.numel() for p in model.parameters())
+
+
+@torch.no_grad()
+def measure_latency(model, device: torch.device, image_size: int = 224, runs: int = 30, warmup: int = 5) -> dict:
+    """Single-image forward latency (ms) on `device`."""
+    model.eval()
+    x = torch.randn(1, 3, image_size, image_size, device=device)
+    timings = []
+    for i in range(warmup + runs):
+        start = time.perf_counter()
+        model(pixel_values=x)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        if i >= warmup:
+            timings.append((time.perf_counter() - start) * 1000)
+    p50, p95 = np.percentile(timings, [50, 95])
+    return {"p50_ms": float(p50), "p95_ms": float(p95)}
+
+
+@torch.no_grad()
+def compare_on(student, loader, device: torch.device, num_classes: int):
+    """
+    Stream the validation loader once: student scores are computed, teacher
+    scores come from the cached logits in the targets.
+
+    Returns:
+        tuple: (teacher evaluator, student evaluator, mean |p_student - p_teacher| per class)
+    """
+    student.eval()
+    teacher_eval, student_eval = MultiLabelEvaluator(num_classes), MultiLabelEvaluator(num_classes)
+    abs_diff = np.zeros(num_classes, dtype=np.float64)
+    samples = 0
+    for images, target in loader:
+        labels, teacher_probs = target[:, :num_classes], torch.sigmoid(target[:, num_classes:])
+        student_probs = torch.sigmoid(student(pixel_values=normalize_batch(images, device)).logits.float()).cpu()
+        teacher_eval.update(teacher_probs, labels)
+        student_eval.update(student_probs, labels)
+        abs_diff += (student_probs - teacher_probs).abs().sum(dim=0).double().numpy()
+        samples += len(labels)
+    return teacher_eval, student_eval, abs_diff / max(samples, 1)
+
+
+def tradeoff_report(snomed_cols, teacher_eval, student_eval, prob_diff, teacher, student, device) -> dict:
+    """Per-class accuracy deltas plus model size and latency for teacher vs student."""
+    teacher_thr, student_thr = teacher_eval.fit_thresholds(), student_eval.fit_thresholds()
+    t_auc, s_auc = teacher_eval.auroc(), student_eval.auroc()
+    t_f1, s_f1 = teacher_eval.f1(teacher_thr), student_eval.f1(student_thr)
+    support, _ = teacher_eval.support()
+    to_float = lambda v: None if np.isnan(v) else float(v)
+
+    classes = {
+        col: {
+            "support": int(support[i]),
+            "teacher_auroc": to_float(t_auc[i]),
+            "student_auroc": to_float(s_auc[i]),
+            "auroc_delta": to_float(s_auc[i] - t_auc[i]),
+            "teacher_f1": to_float(t_f1[i]),
+            "student_f1": to_float(s_f1[i]),
+            "f1_delta": to_float(s_f1[i] - t_f1[i]),
+            "mean_abs_prob_diff": float(prob_diff[i]),
+        }
+        for i, col in enumerate(snomed_cols)
+    }
+    nanmean = lambda v: to_float(np.nanmean(v)) if np.any(~np.isnan(v)) else None
+    teacher_latency, student_latency = measure_latency(teacher, device), measure_latency(student, device)
+    return {
+        "num_samples": student_eval.num_samples,
+        "teacher": {"params": count_parameters(teacher), "latency": teacher_latency,
+                    "macro_auroc": nanmean(t_auc), "macro_f1": nanmean(t_f1)},
+        "student": {"params": count_parameters(student), "latency": student_latency,
+                    "macro_auroc": nanmean(s_auc), "macro_f1": nanmean(s_f1)},
+        "speedup": teacher_latency["p50_ms"] / max(student_latency["p50_ms"], 1e-9),
+        "classes": classes,
+    }, student_thr
+
+
+def print_tradeoff(report: dict, top: int = 10):
+    t, s = report["teacher"], report["student"]
+    fmt = lambda v: f"{v:.3f}" if v is not None else "n/a"
+    print("\n" + "=" * 72)
+    print("📋 TEACHER vs STUDENT")
+    print("=" * 72)
+    print(f"{'':<10} {'Params':>12} {'p50 ms':>9} {'p95 ms':>9} {'Macro AUROC':>12} {'Macro F1':>9}")
+    for name, m in (("teacher", t), ("student", s)):
+        print(f"{name:<10} {m['params']:>12,} {m['latency']['p50_ms']:>9.1f} {m['latency']['p95_ms']:>9.1f} "
+              f"{fmt(m['macro_auroc']):>12} {fmt(m['macro_f1']):>9}")
+    print(f"Speedup: {report['speedup']:.1f}x on single-image CPU/GPU forward")
+
+    ranked = sorted(((col, m) for col, m in report["classes"].items() if m["auroc_delta"] is not None),
+                    key=lambda item: item[1]["auroc_delta"])
+    if ranked:
+        print("\nLargest per-class AUROC drops (support, teacher -> student, mean |Δp|):")
+        for col, m in ranked[:top]:
+            print(f"  {col.replace('SNOMED_', ''):<12} {m['support']:>6}  "
+                  f"{m['teacher_auroc']:.3f} -> {m['student_auroc']:.3f}  ({m['mean_abs_prob_diff']:.3f})")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Distil the GenECG ViT teacher into a compact student.")
+    parser.add_argument("--teacher", type=Path, default=DEFAULT_TEACHER, help="Teacher checkpoint (.pt or .safetensors).")
+    parser.add_argument("--teacher-cache", type=Path, default=DEFAULT_TEACHER_CACHE,
+                        help="float16 memmap of teacher logits, reused across runs (default: %(default)s).")
+    parser.add_argument("--student-base", default=DEFAULT_STUDENT_BASE,
+                        help="Pretrained ViT-compatible student to fine-tune (default: %(default)s).")
+    parser.add_argument("--from-scratch", action="store_true",
+                        help="Randomly initialise a --student-size ViT instead of loading --student-base.")
+    parser.add_argument("--student-size", choices=sorted(STUDENT_SIZES), default="tiny",
+                        help="Architecture used with --from-scratch (default: tiny).")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="Student checkpoint path.")
+    parser.add_argument("--labels", type=Path, default=DEFAULT_LABELS,
+                        help="SNOMED label parquet, or a packed .npz from src/Data_pipeline/label_matrix.py.")
+    parser.add_argument("--raw-dir", type=Path, default=DEFAULT_RAW_DIR, help="Root directory containing ECG PNGs.")
+    parser.add_argument("--image-cache", type=Path, default=None,
+                        help="Pre-decoded cache from src/Data_pipeline/image_cache.py (used instead of --raw-dir).")
+    parser.add_argument("--index", type=Path, default=None,
+                        help="ecg index from src/Data_pipeline/ecg_index.py; replaces the walk over --raw-dir.")
+    parser.add_argument("--alpha", type=float, default=0.3,
+                        help="Weight of the hard-label loss; the rest goes to the teacher targets (default: 0.3).")
+    parser.add_argument("--temperature", type=float, default=2.0, help="Distillation temperature (default: 2.0).")
+    parser.add_argument("--epochs", type=int, default=10, help="Number of training epochs (default: 10).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Per-step batch size (default: 64).")
+    parser.add_argument("--accum-steps", type=int, default=1, help="Gradient accumulation steps (default: 1).")
+    parser.add_argument("--lr", type=float, default=3e-4, help="Learning rate (default: 3e-4).")
+    parser.add_argument("--weight-decay", type=float, default=0.05, help="AdamW weight decay (default: 0.05).")
+    parser.add_argument("--max-grad-norm", type=float, default=1.0, help="Gradient clipping norm (0 disables).")
+    parser.add_argument("--precision", choices=["bf16", "fp32"], default="bf16", help="Autocast precision (default: bf16).")
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader workers (default: 4).")
+    parser.add_argument("--image-size", type=int, default=224, help="Input size when decoding raw PNGs (default: 224).")
+    parser.add_argument("--hflip-prob", type=float, default=0.0,
+                        help="Random horizontal flip probability; off by default since teacher targets "
+                             "are for the unflipped image.")
+    parser.add_argument("--val-fraction", type=float, default=0.2, help="Validation split (default: 0.2).")
+    parser.add_argument("--max-samples", type=int, default=None, help="Limit matched samples (default: all).")
+    parser.add_argument("--log-every", type=int, default=50, help="Optimizer steps between loss logs (0 disables).")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.teacher.exists():
+        print(f"❌ Teacher not found: {args.teacher}")
+        sys.exit(1)
+    if args.image_cache is None and not args.raw_dir.exists():
+        raise FileNotFoundError(f"Raw image directory not found: {args.raw_dir}")
+
+    torch.manual_seed(args.seed)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"🖥️  Using device: {device} ({args.precision})")
+
+    teacher, snomed_cols = load_vit_model(str(args.teacher), device)
+    label_matrix = load_labels(args.labels)
+    label_order = column_order(label_matrix.columns, snomed_cols)
+    train_base, val_base = build_datasets(args, label_matrix)
+    print(f"📊 {len(snomed_cols)} SNOMED classes | train {len(train_base)} | val {len(val_base)}")
+
+    # Row space of the underlying images (cache rows or the raw image listing)
+    num_rows = len(train_base.labels)
+    source = str(args.image_cache or args.index or args.raw_dir)
+    start = time.perf_counter()
+    computed = cache_teacher_logits(teacher, [train_base, val_base], num_rows, args.teacher_cache,
+                                    model_fingerprint(args.teacher, snomed_cols), source, device,
+                                    args.batch_size, args.workers)
+    print(f"🧠 Teacher logits: {computed} computed in {time.perf_counter() - start:.1f}s, "
+          f"{len(train_base) + len(val_base) - computed} reused from {args.teacher_cache}")
+
+    train_ds = TeacherTargetDataset(train_base, args.teacher_cache, label_order)
+    val_ds = TeacherTargetDataset(val_base, args.teacher_cache, label_order)
+    train_loader = make_loader(train_ds, args.batch_size, True, args.workers, device)
+    val_loader = make_loader(val_ds, args.batch_size, False, args.workers, device)
+
+    student = build_student(len(snomed_cols), None if args.from_scratch else args.student_base,
+                            args.student_size).to(device)
+    print(f"🎓 Student: {count_parameters(student):,} params vs teacher {count_parameters(teacher):,}")
+
+    criterion = DistillationLoss(len(snomed_cols), args.alpha, args.temperature)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    config = {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()}
+    history = {"train_loss": [], "val_loss": [], "samples_per_sec": []}
+    best_val_loss = float("inf")
+
+    print(f"\n🚀 Distilling for {args.epochs} epochs (alpha {args.alpha}, T {args.temperature})...\n")
+    for epoch in range(1, args.epochs + 1):
+        epoch_start = time.time()
+        train_loss, samples_per_sec = train_one_epoch(student, train_loader, criterion, optimizer, device, args, epoch)
+        val_loss = validate(student, val_loader, criterion, device, args.precision) if len(val_ds) else float("nan")
+        history["train_loss"].append(train_loss)
+        history["val_loss"].append(val_loss)
+        history["samples_per_sec"].append(samples_per_sec)
+
+        improved = val_loss < best_val_loss or not len(val_ds)
+        print(f"Epoch {epoch:2d}/{args.epochs} | Train Loss: {train_loss:.4f} | Val Loss: {val_loss:.4f} | "
+              f"{samples_per_sec:.1f} samples/s | Time: {time.time() - epoch_start:.1f}s {'⭐' if improved else '  '}")
+        if improved:
+            best_val_loss = val_loss
+            save_checkpoint(student, snomed_cols, args.output, config, history)
+
+    print(f"\n✅ Distillation complete! Best val loss: {best_val_loss:.4f}")
+    print(f"💾 Student saved to {args.output}")
+    if not len(val_ds):
+        return
+
+    # Compare the saved (best) student against the teacher on the validation split
+    student, _ = load_vit_model(str(args.output), device)
+    teacher_eval, student_eval, prob_diff = compare_on(student, val_loader, device, len(snomed_cols))
+    report, student_thresholds = tradeoff_report(snomed_cols, teacher_eval, student_eval, prob_diff,
+                                                 teacher, student, device)
+    print_tradeoff(report)
+
+    save_thresholds(thresholds_path_for(args.output), snomed_cols, student_thresholds,
+                    extra={"checkpoint": str(args.output), "split": "val", "num_samples": student_eval.num_samples})
+    report_path = args.output.with_name(args.output.name + ".distill_report.json")
+    report_path.write_text(json.dumps(report, indent=2))
+    print(f"\n💾 Per-class trade-off report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+"""ViT multi-label training entrypoint (SNOMED-CT targets from ptbxl_with_snomed.parquet)."""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Dataset, DistributedSampler
+
+try:
+    from src import profiling
+    from src.Data_pipeline.ecg_index import index_arrays, index_is_current, load_ecg_index
+    from src.Data_pipeline.image_cache import MemmapImageDataset, decode_resized, ecg_id_from_path, normalize_batch
+    from src.Data_pipeline.label_matrix import LabelMatrix
+    from src.Evaluation.metrics import MultiLabelEvaluator, save_thresholds, thresholds_path_for
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src import profiling
+    from src.Data_pipeline.ecg_index import index_arrays, index_is_current, load_ecg_index
+    from src.Data_pipeline.image_cache import MemmapImageDataset, decode_resized, ecg_id_from_path, normalize_batch
+    from src.Data_pipeline.label_matrix import LabelMatrix
+    from src.Evaluation.metrics import MultiLabelEvaluator, save_thresholds, thresholds_path_for
+
+BASE_MODEL = "google/vit-base-patch16-224"
+DEFAULT_LABELS = Path("data/Processed/ptbxl_with_snomed.parquet")
+DEFAULT_RAW_DIR = Path("data/Raw/GenECG/Dataset_A_ECGs_without_imperfections")
+DEFAULT_OUTPUT = Path("runs/vit/vit_multilabel_checkpoint.pt")
+DEFAULT_MASTER_PORT = 29500
+
+
+def load_labels(labels_path: Path = DEFAULT_LABELS) -> LabelMatrix:
+    """Load the SNOMED targets from the parquet, or from a packed .npz written by label_matrix.py."""
+    if Path(labels_path).suffix == ".npz":
+        return LabelMatrix.load(labels_path)
+    return LabelMatrix.from_parquet(labels_path)
+
+
+def align_labels(image_ecg_ids: np.ndarray, label_matrix: LabelMatrix):
+    """
+    Look up label rows for each image.
+
+    Returns:
+        tuple: (labels aligned to the images [N_img, C], indices of images that have labels)
+    """
+    rows = label_matrix.rows(image_ecg_ids)
+    matched = np.flatnonzero(rows >= 0)
+    aligned = np.zeros((len(image_ecg_ids), label_matrix.num_classes), dtype=np.float32)
+    aligned[matched] = label_matrix.matrix[rows[matched]]
+    return aligned, matched
+
+
+class RawImageDataset(Dataset):
+    """Decodes PNGs on the fly; yields the same uint8 [H, W, 3] tensors as MemmapImageDataset."""
+
+    def __init__(self, image_paths, labels, indices, image_size: int = 224):
+        self.image_paths = [str(p) for p in image_paths]
+        self.labels = labels
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.image_size = image_size
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, idx: int):
+        row = self.indices[idx]
+        with profiling.stage("dataset.decode"):
+            image = torch.from_numpy(decode_resized(self.image_paths[row], self.image_size))
+        return image, torch.from_numpy(self.labels[row])
+
+
+def split_indices(indices: np.ndarray, val_fraction: float, seed: int, max_samples: int | None = None):
+    rng = np.random.default_rng(seed)
+    indices = rng.permutation(indices)
+    if max_samples:
+        indices = indices[:max_samples]
+    n_val = int(round(len(indices) * val_fraction))
+    return np.sort(indices[n_val:]), np.sort(indices[:n_val])
+
+
+def build_datasets(args, label_matrix: LabelMatrix):
+    """
+    Create train/val datasets from the image cache when given, otherwise from the raw PNG tree.
+
+    Raw images are listed from the ecg index (src/Data_pipeline/ecg_index.py) when
+    `args.index` is set, so no directory walk is needed.
+    """
+    if args.image_cache is not None:
+        image_ecg_ids = np.load(Path(args.image_cache) / "ecg_ids.npy")
+        aligned, valid = align_labels(image_ecg_ids, label_matrix)
+        valid = valid[image_ecg_ids[valid] >= 0]
+        train_idx, val_idx = split_indices(valid, args.val_fraction, args.seed, args.max_samples)
+        return (MemmapImageDataset(args.image_cache, aligned, train_idx),
+                MemmapImageDataset(args.image_cache, aligned, val_idx))
+
+    if args.index is not None:
+        index = load_ecg_index(args.index)
+        if not index_is_current(index, args.raw_dir):
+            print(f"⚠️  {args.raw_dir} changed since {args.index} was built; rebuild it to pick up new images")
+        image_paths, _, index_labels, index_cols = index_arrays(index, args.raw_dir)
+        # The index carries its own label columns; put them in the order of --labels, which the checkpoint records
+        position = {col: i for i, col in enumerate(index_cols)}
+        missing = [col for col in label_matrix.columns if col not in position]
+        if missing:
+            raise ValueError(f"{args.index} lacks {len(missing)} SNOMED columns of the label matrix "
+                             f"(e.g. {missing[:3]}); rebuild the index from the same labels")
+        aligned = index_labels[:, [position[col] for col in label_matrix.columns]]
+        valid = np.arange(len(image_paths))
+    else:
+        image_paths = sorted(Path(args.raw_dir).rglob("*.[pP][nN][gG]"))
+        image_ecg_ids = np.array([ecg_id_from_path(p) for p in image_paths], dtype=np.int64)
+        aligned, valid = align_labels(image_ecg_ids, label_matrix)
+    train_idx, val_idx = split_indices(valid, args.val_fraction, args.seed, args.max_samples)
+    return (RawImageDataset(image_paths, aligned, train_idx, args.image_size),
+            RawImageDataset(image_paths, aligned, val_idx, args.image_size))
+
+
+def make_loader(dataset, batch_size: int, shuffle: bool, num_workers: int, device: torch.device, sampler=None):
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",
+        persistent_workers=num_workers > 0,
+        prefetch_factor=4 if num_workers > 0 else None,
+        drop_last=False,
+    )
+
+
+def autocast_context(device: torch.device, precision: str):
+    if precision == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def random_hflip(images: torch.Tensor, p: float) -> torch.Tensor:
+    """Batched equivalent of the notebook's RandomHorizontalFlip on a [B, 3, H, W] tensor."""
+    if p <= 0:
+        return images
+    flip = torch.rand(images.shape[0], device=images.device) < p
+    if flip.any():
+        images[flip] = images[flip].flip(-1)
+    return images
+
+
+def train_one_epoch(model, loader, criterion, optimizer, device, args, epoch: int, log=print):
+    """
+    One pass over `loader` with gradient accumulation.
+
+    The running loss stays on the device and is only synchronised every
+    `args.log_every` optimizer steps, so the loop never blocks on the host.
+    Under DDP, gradients are only all-reduced on the micro-batch that steps.
+
+    Returns:
+        tuple: (mean loss, samples/sec) for this process
+    """
+    model.train()
+    total_loss = torch.zeros((), device=device)
+    window_loss = torch.zeros((), device=device)
+    samples = 0
+    steps = 0
+    start = time.perf_counter()
+
+    # DDP (possibly behind torch.compile) exposes no_sync(); skip the gradient all-reduce between optimizer steps
+    no_sync = getattr(model, "no_sync", None)
+
+    optimizer.zero_grad(set_to_none=True)
+    for batch_idx, (images, labels) in enumerate(loader):
+        images = random_hflip(normalize_batch(images, device), args.hflip_prob)
+        labels = labels.to(device, non_blocking=True)
+        stepping = (batch_idx + 1) % args.accum_steps == 0 or batch_idx + 1 == len(loader)
+
+        with no_sync() if no_sync is not None and not stepping else contextlib.nullcontext(), \
+                profiling.stage("train.forward_backward", device):
+            with autocast_context(device, args.precision):
+                logits = model(pixel_values=images).logits
+            loss = criterion(logits.float(), labels)
+            (loss / args.accum_steps).backward()
+
+        total_loss += loss.detach()
+        window_loss += loss.detach()
+        samples += labels.shape[0]
+
+        if stepping:
+            with profiling.stage("train.optimizer_step", device):
+                if args.max_grad_norm:
+                    nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+            steps += 1
+            if args.log_every and steps % args.log_every == 0:
+                log(f"  epoch {epoch} step {steps}: loss {window_loss.item() / (args.log_every * args.accum_steps):.4f}")
+                window_loss.zero_()
+
+    elapsed = time.perf_counter() - start
+    return total_loss.item() / max(len(loader), 1), samples / elapsed if elapsed > 0 else 0.0
+
+
+@torch.no_grad()
+def validate(model, loader, criterion, device, precision: str = "bf16", evaluator: MultiLabelEvaluator = None):
+    """
+    Mean validation loss, averaged over every process when running distributed.
+
+    When an `evaluator` is given, sigmoid scores are streamed into its per-class
+    histograms as well (summed over all ranks), so AUROC and thresholds come for free.
+    """
+    model.eval()
+    totals = torch.zeros(2, device=device)  # loss sum, batches
+    for images, labels in loader:
+        images = normalize_batch(images, device)
+        labels = labels.to(device, non_blocking=True)
+        with autocast_context(device, precision):
+            logits = model(pixel_values=images).logits
+        totals[0] += criterion(logits.float(), labels)
+        totals[1] += 1
+        if evaluator is not None:
+            evaluator.update(torch.sigmoid(logits.float()), labels)
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(totals)
+        if evaluator is not None:
+            evaluator.all_reduce(device)
+    return (totals[0] / totals[1].clamp(min=1)).item()
+
+
+def all_reduce_sum(values, device) -> list:
+    """Sum a list of floats over all processes (no-op when not distributed)."""
+    if not (dist.is_available() and dist.is_initialized()):
+        return list(values)
+    tensor = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+def build_model(num_classes: int, base_model: str = BASE_MODEL):
+    from transformers import ViTForImageClassification
+
+    return ViTForImageClassification.from_pretrained(
+        base_model,
+        num_labels=num_classes,
+        ignore_mismatched_sizes=True,
+        problem_type="multi_label_classification",
+    )
+
+
+def save_checkpoint(model, snomed_cols: list, output_path: Path, config: dict, history: dict):
+    """
+    Save in the {'model_state_dict', 'num_classes', 'snomed_cols'} format load_vit_model() expects.
+
+    The ViT config is stored as well so the checkpoint can be rebuilt without the hub.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    torch.save({
+        'model_state_dict': model.state_dict(),
+        'snomed_cols': snomed_cols,
+        'num_classes': len(snomed_cols),
+        'vit_config': model.config.to_dict(),
+        'config': config,
+        'history': history,
+    }, tmp_path)
+    tmp_path.replace(output_path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the GenECG ViT multi-label classifier.")
+    parser.add_argument("--labels", type=Path, default=DEFAULT_LABELS,
+                        help="SNOMED label parquet, or a packed .npz from src/Data_pipeline/label_matrix.py.")
+    parser.add_argument("--raw-dir", type=Path, default=DEFAULT_RAW_DIR, help="Root directory containing ECG PNGs.")
+    parser.add_argument("--image-cache", type=Path, default=None,
+                        help="Pre-decoded cache from src/Data_pipeline/image_cache.py (used instead of --raw-dir).")
+    parser.add_argument("--index", type=Path, default=None,
+                        help="ecg index from src/Data_pipeline/ecg_index.py; replaces the walk over --raw-dir.")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="Checkpoint path for the best model.")
+    parser.add_argument("--base-model", default=BASE_MODEL, help=f"Pretrained ViT to fine-tune (default: {BASE_MODEL}).")
+    parser.add_argument("--epochs", type=int, default=10, help="Number of training epochs (default: 10).")
+    parser.add_argument("--batch-size", type=int, default=32, help="Per-step batch size (default: 32).")
+    parser.add_argument("--accum-steps", type=int, default=1, help="Gradient accumulation steps (default: 1).")
+    parser.add_argument("--lr", type=float, default=1e-4, help="Learning rate (default: 1e-4).")
+    parser.add_argument("--weight-decay", type=float, default=0.01, help="AdamW weight decay (default: 0.01).")
+    parser.add_argument("--pos-weight", type=float, default=0.0,
+                        help="Weight positives by negatives/positives per class, capped at this value (0 disables).")
+    parser.add_argument("--max-grad-norm", type=float, default=1.0, help="Gradient clipping norm (0 disables).")
+    parser.add_argument("--precision", choices=["bf16", "fp32"], default="bf16", help="Autocast precision (default: bf16).")
+    parser.add_argument("--compile", action="store_true", help="Wrap the model with torch.compile when available.")
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader workers (default: 4).")
+    parser.add_argument("--image-size", type=int, default=224, help="Input size when decoding raw PNGs (default: 224).")
+    parser.add_argument("--hflip-prob", type=float, default=0.3, help="Random horizontal flip probability (default: 0.3).")
+    parser.add_argument("--val-fraction", type=float, default=0.2, help="Validation split (default: 0.2).")
+    parser.add_argument("--max-samples", type=int, default=None, help="Limit matched samples (default: all).")
+    parser.add_argument("--log-every", type=int, default=50, help="Optimizer steps between loss logs (0 disables).")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42).")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch intra-op threads per process (default: cores split across local processes).")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time data loading and training stages; also enabled by GENECG_PROFILE=1.")
+    parser.add_argument("--profile-output", type=Path, default=None,
+                        help="Write the stage histograms to this .json or .prom (Prometheus text) file.")
+
+    ddp = parser.add_argument_group("distributed (DDP)")
+    ddp.add_argument("--nproc", type=int, default=1, help="Training processes to launch on this host (default: 1).")
+    ddp.add_argument("--nnodes", type=int, default=1, help="Number of hosts taking part (default: 1).")
+    ddp.add_argument("--node-rank", type=int, default=0, help="Index of this host, 0 .. nnodes-1 (default: 0).")
+    ddp.add_argument("--master-addr", default="127.0.0.1", help="Address of the rank-0 host (default: 127.0.0.1).")
+    ddp.add_argument("--master-port", type=int, default=DEFAULT_MASTER_PORT,
+                     help=f"Rendezvous port on the rank-0 host (default: {DEFAULT_MASTER_PORT}).")
+    ddp.add_argument("--dist-backend", choices=["gloo", "nccl"], default="gloo",
+                     help="torch.distributed backend (default: gloo, works on CPU-only hosts).")
+    return parser.parse_args(argv)
+
+
+def train(args, rank: int = 0, world_size: int = 1, local_rank: int = 0):
+    """
+    Run the training loop in one process.
+
+    With world_size > 1 the process group must already be initialised: each rank
+    trains on its DistributedSampler shard, gradients are averaged by DDP, and only
+    rank 0 prints epoch summaries and writes the checkpoint.
+    """
+    distributed = world_size > 1
+    log = print if rank == 0 else (lambda *a, **k: None)
+
+    # Same seed for the data split on every rank, different augmentation streams
+    torch.manual_seed(args.seed + rank)
+
+    if torch.cuda.is_available():
+        device = torch.device("cuda", local_rank % torch.cuda.device_count())
+        torch.cuda.set_device(device)
+    else:
+        device = torch.device("cpu")
+    log(f"🖥️  Using device: {device} ({args.precision}) | world size {world_size}")
+
+    label_matrix = load_labels(args.labels)
+    snomed_cols = label_matrix.columns
+    train_ds, val_ds = build_datasets(args, label_matrix)
+    log(f"📊 {len(snomed_cols)} SNOMED classes | train {len(train_ds)} | val {len(val_ds)}")
+
+    train_sampler = val_sampler = None
+    if distributed:
+        train_sampler = DistributedSampler(train_ds, world_size, rank, shuffle=True, seed=args.seed)
+        val_sampler = DistributedSampler(val_ds, world_size, rank, shuffle=False)
+    train_loader = make_loader(train_ds, args.batch_size, True, args.workers, device, train_sampler)
+    val_loader = make_loader(val_ds, args.batch_size, False, args.workers, device, val_sampler)
+
+    if distributed and local_rank != 0:
+        dist.barrier()  # let local rank 0 populate the hub cache first
+    model = build_model(len(snomed_cols), args.base_model).to(device)
+    if distributed and local_rank == 0:
+        dist.barrier()
+
+    forward_model = model
+    if distributed:
+        # Broadcasts rank 0's weights (including the freshly initialised head) to every rank
+        forward_model = DistributedDataParallel(model, device_ids=[device.index] if device.type == "cuda" else None)
+    if args.compile and hasattr(torch, "compile"):
+        forward_model = torch.compile(forward_model)
+
+    pos_weight = None
+    if args.pos_weight:
+        # Clamp so codes with a handful of positives don't dominate the loss
+        pos_weight = torch.from_numpy(label_matrix.pos_weight).clamp_(max=args.pos_weight).to(device)
+    criterion = nn.BCEWithLogitsLoss(pos_weight=pos_weight)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+
+    history = {'train_loss': [], 'val_loss': [], 'val_macro_auroc': [], 'samples_per_sec': []}
+    best_val_loss = float('inf')
+    config = {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()}
+    config['world_size'] = world_size
+
+    log(f"\n🚀 Starting training for {args.epochs} epochs...\n")
+    for epoch in range(1, args.epochs + 1):
+        start_time = time.time()
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+        train_loss, samples_per_sec = train_one_epoch(forward_model, train_loader, criterion, optimizer, device, args,
+                                                      epoch, log)
+        evaluator = MultiLabelEvaluator(len(snomed_cols))
+        val_loss = (validate(forward_model, val_loader, criterion, device, args.precision, evaluator)
+                    if len(val_ds) else float('nan'))
+        val_auroc = evaluator.report(snomed_cols)["macro"]["auroc"]
+
+        if distributed:
+            print(f"  [rank {rank}] epoch {epoch}: {samples_per_sec:.1f} samples/s")
+            loss_sum, samples_per_sec = all_reduce_sum([train_loss, samples_per_sec], device)
+            train_loss = loss_sum / world_size
+
+        history['train_loss'].append(train_loss)
+        history['val_loss'].append(val_loss)
+        history['val_macro_auroc'].append(val_auroc)
+        history['samples_per_sec'].append(samples_per_sec)
+
+        # val_loss is reduced over all ranks, so every rank takes the same branch
+        improved = val_loss < best_val_loss or not len(val_ds)
+        marker = "⭐" if improved else "  "
+        log(f"Epoch {epoch:2d}/{args.epochs} | "
+            f"Train Loss: {train_loss:.4f} | "
+            f"Val Loss: {val_loss:.4f} | "
+            f"Val AUROC: {val_auroc if val_auroc is not None else float('nan'):.4f} | "
+            f"{samples_per_sec:.1f} samples/s | "
+            f"Time: {time.time() - start_time:.1f}s {marker}")
+
+        if improved:
+            best_val_loss = val_loss
+            if rank == 0:
+                save_checkpoint(model, snomed_cols, args.output, config, history)
+                if evaluator.num_samples:
+                    # Thresholds fitted on the same validation pass as the saved weights
+                    save_thresholds(thresholds_path_for(args.output), snomed_cols, evaluator.fit_thresholds(),
+                                    extra={"checkpoint": str(args.output), "epoch": epoch, "split": "val",
+                                           "num_samples": evaluator.num_samples})
+
+    log(f"\n✅ Training complete! Best val loss: {best_val_loss:.4f}")
+    log(f"💾 Checkpoint saved to {args.output}")
+
+
+def _set_threads(args, local_world_size: int):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    elif local_world_size > 1:
+        # Don't oversubscribe: split the cores between the processes on this host
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+
+
+def _spawned_worker(local_rank: int, args):
+    """Entry point of each process started by `--nproc`."""
+    rank = args.node_rank * args.nproc + local_rank
+    world_size = args.nnodes * args.nproc
+    _set_threads(args, args.nproc)
+    dist.init_process_group(
+        args.dist_backend,
+        init_method=f"tcp://{args.master_addr}:{args.master_port}",
+        rank=rank,
+        world_size=world_size,
+    )
+    try:
+        train(args, rank, world_size, local_rank)
+    finally:
+        dist.destroy_process_group()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile or args.profile_output:
+        profiling.enable()
+
+    if args.image_cache is None and not args.raw_dir.exists():
+        raise FileNotFoundError(f"Raw image directory not found: {args.raw_dir}")
+
+    if "WORLD_SIZE" in os.environ and int(os.environ["WORLD_SIZE"]) > 1:
+        # Launched by torchrun: rendezvous details come from the environment
+        _set_threads(args, int(os.environ.get("LOCAL_WORLD_SIZE", 1)))
+        dist.init_process_group(args.dist_backend, init_method="env://")
+        try:
+            train(args, dist.get_rank(), dist.get_world_size(), int(os.environ.get("LOCAL_RANK", 0)))
+        finally:
+            dist.destroy_process_group()
+    elif args.nproc * args.nnodes > 1:
+        if not 0 <= args.node_rank < args.nnodes:
+            raise ValueError(f"--node-rank must be in [0, {args.nnodes}), got {args.node_rank}")
+        mp.spawn(_spawned_worker, args=(args,), nprocs=args.nproc, join=True)
+    else:
+        _set_threads(args, 1)
+        train(args)
+
+    if int(os.environ.get("RANK", 0)) == 0:
+        profiling.finish(args.profile_output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 """Custom YOLOv8 training entrypoint that wires GenECG labels from the processed folder."""
 
 import argparse
+import json
+import os
 import sys
 from pathlib import Path
 
@@ -12,26 +14,151 @@ except ModuleNotFoundError as exc:  # pragma: no cover - checked at runtime
         "Ultralytics is required. Install it with `pip install ultralytics` before running this script."
     ) from exc
 
+try:
+    from src.Data_pipeline.label_store import LabelStore
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[2]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.label_store import LabelStore
+
 DEFAULT_DATA = Path("data_A.yaml")
 DEFAULT_LABEL_ROOT = Path("data/Processed/YOLO_Labels/Dataset_A")
 
 
-def override_label_resolution(labels_root: Path):
-    """Patch YOLO's label discovery so every image maps to a label under labels_root."""
-    original_func = data_utils.img2label_paths
+def label_index_cache_path(labels_root: Path) -> Path:
+    """Cache file for the label index, kept beside (not inside) labels_root so writing it never bumps its mtime."""
+    return labels_root.parent / f".{labels_root.name}.label_index.json"
+
+
+def build_label_index(labels_root: Path, cache_path: Path | None = None) -> set:
+    """
+    Return the set of label stems available under labels_root.
+
+    The directory is listed once with os.scandir. The result is cached on disk
+    keyed by the directory's mtime, which changes whenever a label is added or
+    removed, so repeated launches skip the listing entirely.
+    """
+    cache_path = cache_path or label_index_cache_path(labels_root)
+    mtime_ns = os.stat(labels_root).st_mtime_ns
+
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached["root"] == str(labels_root) and cached["mtime_ns"] == mtime_ns:
+            return set(cached["stems"])
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+
+    with os.scandir(labels_root) as entries:
+        stems = {entry.name[:-4] for entry in entries if entry.name.endswith(".txt") and entry.is_file()}
+
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"root": str(labels_root), "mtime_ns": mtime_ns, "stems": sorted(stems)}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as err:
+        print(f"Could not write label index cache {cache_path}: {err}")
+
+    return stems
+
+
+def _patch_label_functions(**replacements):
+    """
+    Replace Ultralytics label helpers in both modules that reference them.
 
-    def _custom_img2label_paths(img_paths):
-        resolved = []
-        for img in img_paths:
-            img_path = Path(img)
-            label_path = labels_root / (img_path.stem + ".txt")
-            if not label_path.exists():
-                raise FileNotFoundError(f"Missing label for {img_path} at {label_path}")
-            resolved.append(str(label_path))
-        return resolved
+    `ultralytics.data.dataset` imports these functions by name, so patching only
+    `ultralytics.data.utils` would not reach the dataset class. Returns a callable
+    that restores the originals.
+    """
+    from ultralytics.data import dataset as data_dataset
 
-    data_utils.img2label_paths = _custom_img2label_paths
-    return original_func
+    originals = []
+    for name, func in replacements.items():
+        for module in (data_utils, data_dataset):
+            if hasattr(module, name):
+                originals.append((module, name, getattr(module, name)))
+                setattr(module, name, func)
+
+    def restore():
+        for module, name, func in originals:
+            setattr(module, name, func)
+
+    return restore
+
+
+def _missing_labels_error(missing, where) -> FileNotFoundError:
+    return FileNotFoundError(
+        f"{len(missing)} images have no label in {where} "
+        f"(first few: {', '.join(missing[:10])})"
+    )
+
+
+def override_label_resolution(labels_root: Path):
+    """
+    Patch YOLO's label discovery so every image maps to a label under labels_root.
+
+    Existence is checked against an in-memory index (see build_label_index), and
+    all missing labels are reported together. Returns a restore callable.
+    """
+    original_func = data_utils.img2label_paths
+    stems = build_label_index(labels_root)
+    root = str(labels_root)
+
+    def _custom_img2label_paths(img_paths, *args, **kwargs):
+        if args or kwargs.get("label_dir", "labels") != "labels":
+            # Not a detection label lookup (e.g. segmentation masks)
+            return original_func(img_paths, *args, **kwargs)
+        img_stems = [Path(img).stem for img in img_paths]
+        missing = [stem for stem in img_stems if stem not in stems]
+        if missing:
+            raise _missing_labels_error(missing, labels_root)
+        return [os.path.join(root, f"{stem}.txt") for stem in img_stems]
+
+    return _patch_label_functions(img2label_paths=_custom_img2label_paths)
+
+
+def override_label_store(store: LabelStore):
+    """
+    Serve labels from a consolidated LabelStore instead of per-image .txt files.
+
+    Image paths map to virtual label paths (nothing is probed on disk), and the
+    label verification step reads each image's [12, 5] array from the in-memory
+    store. Returns a callable that restores Ultralytics' original functions.
+    """
+    from ultralytics.data import dataset as data_dataset
+
+    original_paths = data_utils.img2label_paths
+    original_verify = data_dataset.verify_image_label
+    # Versioned virtual folder so Ultralytics' labels.cache is invalidated when the store changes
+    virtual_dir = store.store_dir / f"labels-{store.version}"
+
+    def _store_img2label_paths(img_paths, *args, **kwargs):
+        if args or kwargs.get("label_dir", "labels") != "labels":
+            return original_paths(img_paths, *args, **kwargs)
+        stems = [Path(img).stem for img in img_paths]
+        missing = [stem for stem in stems if stem not in store]
+        if missing:
+            raise _missing_labels_error(missing, store.store_dir)
+        return [str(virtual_dir / f"{stem}.txt") for stem in stems]
+
+    def _store_verify_image_label(args):
+        # The virtual label path does not exist, so this only verifies the image
+        result = original_verify(args)
+        if result[0] is None:
+            return result
+        result = list(result)
+        labels = store.get(Path(result[0]).stem)
+        result[1] = labels
+        result[5:8] = [0, 1, 0 if len(labels) else 1]  # missing, found, empty
+        return tuple(result)
+
+    return _patch_label_functions(
+        img2label_paths=_store_img2label_paths,
+        verify_image_label=_store_verify_image_label,
+    )
 
 
 def parse_args():
@@ -43,6 +170,12 @@ def parse_args():
         default=DEFAULT_LABEL_ROOT,
         help="Directory containing YOLO-formatted label .txt files.",
     )
+    parser.add_argument(
+        "--label-store",
+        type=Path,
+        default=None,
+        help="Consolidated label store (labels.npy + stems.txt) to read instead of --labels-root.",
+    )
     parser.add_argument("--weights", default="yolov8n.pt", help="Base model weights to fine-tune (default: yolov8n.pt).")
     parser.add_argument("--epochs", type=int, default=50, help="Number of training epochs (default: 50).")
     parser.add_argument("--batch", type=int, default=16, help="Batch size (default: 16).")
@@ -55,14 +188,22 @@ def main():
     args = parse_args()
 
     data_path = args.data.resolve()
-    labels_root = args.labels_root.resolve()
 
     if not data_path.exists():
         raise FileNotFoundError(f"Dataset YAML not found: {data_path}")
-    if not labels_root.exists():
-        raise FileNotFoundError(f"Labels directory not found: {labels_root}")
 
-    original_resolver = override_label_resolution(labels_root)
+    if args.label_store is not None:
+        store_dir = args.label_store.resolve()
+        if not store_dir.exists():
+            raise FileNotFoundError(f"Label store not found: {store_dir}")
+        store = LabelStore(store_dir)
+        print(f"Loaded {len(store)} labels from {store_dir}")
+        restore = override_label_store(store)
+    else:
+        labels_root = args.labels_root.resolve()
+        if not labels_root.exists():
+            raise FileNotFoundError(f"Labels directory not found: {labels_root}")
+        restore = override_label_resolution(labels_root)
 
     try:
         model = YOLO(args.weights)
@@ -74,7 +215,7 @@ def main():
             device=args.device,
         )
     finally:
-        data_utils.img2label_paths = original_resolver
+        restore()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Bulk Scoring of the Bucketed GenECG Archive
+===========================================
+Rescore every ECG in Dataset A/B after a model update.
+
+Each bucket folder (00000/, 01000/, ...) of every archive root is one shard.
+Shards are scored in a pool of worker processes. Each worker loads the model
+once and runs `inference.run_batch_inference` over a whole bucket. Each shard
+is written as `shards/<root>__<bucket>.parquet` via a temporary file and an
+atomic rename, and is then appended to `completed.jsonl`. A crashed or
+preempted run therefore resumes with the first unfinished shard. A bucket whose
+listing changed since it was scored is scored again.
+
+At the end the shards are streamed into one `predictions.parquet` (image, error,
+shard, ecg_id, one probability column per SNOMED class), and `summary.json`
+records throughput and error statistics.
+
+Usage:
+    python src/bulk_score.py data/Raw/GenECG/Dataset_A_ECGs_without_imperfections \
+        data/Raw/GenECG/Dataset_B_ECGs_with_imperfections \
+        --model runs/vit/vit_multilabel_checkpoint.pt --output-dir runs/vit/bulk_scores --workers 4
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+try:
+    from src.Data_pipeline.ecg_index import parse_ecg_ids, scan_images
+    from src.inference import IMAGE_SUFFIXES, load_vit_model, run_batch_inference
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+    from src.prediction_cache import file_digest
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[1]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.ecg_index import parse_ecg_ids, scan_images
+    from src.inference import IMAGE_SUFFIXES, load_vit_model, run_batch_inference
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+    from src.prediction_cache import file_digest
+
+RUN_FILE = "run.json"
+COMPLETED_FILE = "completed.jsonl"
+SHARDS_DIR = "shards"
+MERGED_FILE = "predictions.parquet"
+SUMMARY_FILE = "summary.json"
+ROOT_SHARD = "_root"
+
+# Set in each pool process by _init_worker
+_WORKER = {}
+
+
+def discover_shards(roots) -> dict:
+    """
+    One shard per bucket folder of each archive root.
+
+    Images directly inside a root form a `_root` shard. A listing digest
+    (relative paths and sizes) is stored per shard, so a resumed run can spot
+    buckets that gained, lost or replaced images.
+
+    Returns:
+        dict: shard name -> {"root", "bucket", "paths" (absolute), "listing"}, sorted by name.
+    """
+    shards = {}
+    for root in roots:
+        root = Path(root)
+        images = scan_images(root, suffixes=tuple(IMAGE_SUFFIXES))
+        images = images.sort_values("path", ignore_index=True)
+        buckets = images["path"].str.rpartition("/")[0].str.split("/").str[0].replace("", ROOT_SHARD)
+        for bucket, group in images.groupby(buckets, sort=True):
+            name = f"{root.name}__{bucket}"
+            if name in shards:
+                raise ValueError(f"Two archive roots are both named {root.name!r}; shard names would collide")
+            listing = hashlib.blake2b(digest_size=16)
+            for path, size in zip(group["path"], group["size"]):
+                listing.update(f"{path}\t{size}\n".encode())
+            shards[name] = {
+                "root": str(root),
+                "bucket": bucket,
+                "paths": [str(root / p) for p in group["path"]],
+                "listing": listing.hexdigest(),
+            }
+    return dict(sorted(shards.items()))
+
+
+def _shard_path(output_dir: Path, name: str) -> Path:
+    return Path(output_dir) / SHARDS_DIR / f"{name}.parquet"
+
+
+def load_completed(output_dir: Path) -> dict:
+    """Completion records by shard name; a torn last line from a crash is ignored."""
+    path = Path(output_dir) / COMPLETED_FILE
+    completed = {}
+    if not path.exists():
+        return completed
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            completed[record["shard"]] = record
+    return completed
+
+
+def _append_completed(output_dir: Path, record: dict):
+    with open(Path(output_dir) / COMPLETED_FILE, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def prepare_output(output_dir: Path, run: dict, restart: bool = False) -> dict:
+    """
+    Create or reopen a run directory and return the completion records to resume from.
+
+    A directory written for a different checkpoint or backend is refused
+    unless `restart` is set, in which case previous progress is discarded.
+    """
+    output_dir = Path(output_dir)
+    run_path = output_dir / RUN_FILE
+    if run_path.exists() and not restart:
+        previous = json.loads(run_path.read_text())
+        if (previous["model_digest"], previous["backend"]) != (run["model_digest"], run["backend"]):
+            raise RuntimeError(f"{output_dir} holds scores from {previous['model']} ({previous['backend']}); "
+                               f"use --restart to discard them or pick another --output-dir")
+        completed = load_completed(output_dir)
+        # Drop a torn last line now, so the next append does not land on the same line
+        tmp_path = output_dir / (COMPLETED_FILE + ".tmp")
+        tmp_path.write_text("".join(json.dumps(record) + "\n" for record in completed.values()))
+        tmp_path.replace(output_dir / COMPLETED_FILE)
+        return completed
+
+    if restart:
+        for name in (RUN_FILE, COMPLETED_FILE, MERGED_FILE, SUMMARY_FILE):
+            (output_dir / name).unlink(missing_ok=True)
+        shutil.rmtree(output_dir / SHARDS_DIR, ignore_errors=True)
+    (output_dir / SHARDS_DIR).mkdir(parents=True, exist_ok=True)
+    tmp_path = run_path.with_name(run_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(run, indent=2))
+    tmp_path.replace(run_path)
+    return {}
+
+
+def pending_shards(shards: dict, completed: dict, output_dir: Path) -> list:
+    """Shards without a completion record, whose output is missing, or whose bucket listing changed."""
+    return [
+        name for name, shard in shards.items()
+        if name not in completed
+        or completed[name]["listing"] != shard["listing"]
+        or not _shard_path(output_dir, name).exists()
+    ]
+
+
+def _init_worker(model_path: str, backend: str, threads: int, batch_size: int, decode_workers: int):
+    """Pool initializer: load the model once per worker process."""
+    torch.set_num_threads(threads)
+    device = backend_device(backend)
+    model, snomed_cols = load_backend(backend, model_path, device, load_fp32=load_vit_model)
+    _WORKER.update(model=model, snomed_cols=snomed_cols, device=device,
+                   batch_size=batch_size, decode_workers=decode_workers)
+
+
+def _score_shard(name: str, image_paths: list, output_path: str) -> dict:
+    """Worker: score one bucket into a temporary Parquet file and rename it into place."""
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    stats = run_batch_inference(
+        _WORKER["model"], image_paths, _WORKER["snomed_cols"], _WORKER["device"],
+        batch_size=_WORKER["batch_size"],
+        num_workers=_WORKER["decode_workers"],
+        output_path=tmp_path,
+        output_format="parquet",
+    )
+    os.replace(tmp_path, output_path)
+    return {"shard": name, **{k: stats[k] for k in ("images", "errors", "seconds")}, "pid": os.getpid()}
+
+
+def run_shards(shards: dict, names: list, output_dir: Path, model_path: str, backend: str,
+               workers: int = 1, threads: int = 1, batch_size: int = 32, decode_workers: int = 0) -> list:
+    """
+    Score `names` across a process pool, recording each shard as soon as it lands.
+
+    A shard whose worker raises is reported and left unrecorded, so the next
+    run retries it.
+
+    Returns:
+        list: (shard name, error message) for failed shards.
+    """
+    failures = []
+    total = sum(len(shards[n]["paths"]) for n in names)
+    # spawn: forked children would inherit the parent's torch thread pools (and CUDA state)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(names))), mp_context=context, initializer=_init_worker,
+                             initargs=(model_path, backend, threads, batch_size, decode_workers)) as pool, \
+            tqdm(total=total, unit="img") as progress:
+        futures = {
+            pool.submit(_score_shard, name, shards[name]["paths"], str(_shard_path(output_dir, name))): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures.append((name, f"{type(e).__name__}: {e}"))
+                progress.set_postfix(failed=len(failures))
+            else:
+                _append_completed(output_dir, {**result, "listing": shards[name]["listing"],
+                                               "finished": time.time()})
+            progress.update(len(shards[name]["paths"]))
+    return failures
+
+
+def merge_shards(output_dir: Path, names: list) -> dict:
+    """
+    Stream finished shards into one Parquet table, one shard in memory at a time.
+
+    Adds `shard` and `ecg_id` columns and counts errors by message.
+
+    Returns:
+        dict: {"rows", "errors", "top_errors"}
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    output_path = Path(output_dir) / MERGED_FILE
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    writer = None
+    rows = 0
+    error_messages = Counter()
+    try:
+        for name in names:
+            table = pq.read_table(_shard_path(output_dir, name))
+            # An all-None error column is stored with a null type; keep the schema identical across shards
+            table = table.set_column(table.schema.get_field_index("error"), "error",
+                                     table.column("error").cast(pa.string()))
+            images = table.column("image").to_pandas()
+            ecg_ids = parse_ecg_ids(images.str.replace("\\", "/", regex=False)).fillna(-1).astype(np.int64)
+            table = table.add_column(2, "shard", pa.array([name] * len(table), pa.string()))
+            table = table.add_column(3, "ecg_id", pa.array(ecg_ids.to_numpy()))
+            error_messages.update(e for e in table.column("error").to_pylist() if e)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+            rows += len(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        tmp_path.replace(output_path)
+    return {"rows": rows, "errors": sum(error_messages.values()), "top_errors": error_messages.most_common(10)}
+
+
+def summarize(shards: dict, completed: dict, failures: list, merge: dict | None, wall_seconds: float,
+              scored_now: list) -> dict:
+    """Throughput and error statistics for this run and for the archive as a whole."""
+    done = [completed[n] for n in shards if n in completed]
+    now = [completed[n] for n in scored_now if n in completed]
+    images_now = sum(r["images"] for r in now)
+    shard_rates = [r["images"] / r["seconds"] for r in done if r["seconds"] > 0]
+    return {
+        "shards": {"total": len(shards), "completed": len(done), "scored_this_run": len(now),
+                   "failed": len(failures)},
+        "images": {"total": sum(len(s["paths"]) for s in shards.values()),
+                   "scored": sum(r["images"] for r in done), "errors": sum(r["errors"] for r in done)},
+        "this_run": {"images": images_now, "wall_seconds": wall_seconds,
+                     "images_per_sec": images_now / wall_seconds if wall_seconds > 0 else 0.0,
+                     "worker_seconds": sum(r["seconds"] for r in now)},
+        "shard_images_per_sec": {"min": float(np.min(shard_rates)), "median": float(np.median(shard_rates)),
+                                 "max": float(np.max(shard_rates))} if shard_rates else None,
+        "failed_shards": [{"shard": name, "error": err} for name, err in failures],
+        "merged": merge,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded, resumable bulk scoring of the GenECG image archive.")
+    parser.add_argument("roots", nargs="+", help="Archive roots holding 00000/, 01000/, ... bucket folders")
+    parser.add_argument("--model", type=str, default="runs/vit/vit_multilabel_checkpoint.pt",
+                        help="Path to ViT checkpoint (or exported .ts/.onnx for those backends)")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32", help="Inference backend (default: fp32)")
+    parser.add_argument("--output-dir", type=Path, default=Path("runs/vit/bulk_scores"),
+                        help="Run directory for shards, completion records and the merged table")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Scoring processes, each with its own model copy (default: cores / --threads)")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads per worker (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per forward pass (default: 32)")
+    parser.add_argument("--decode-workers", type=int, default=0,
+                        help="DataLoader decode workers inside each scoring process (default: 0, decode in-process)")
+    parser.add_argument("--max-shards", type=int, default=None,
+                        help="Score at most this many pending shards, then stop (resume later)")
+    parser.add_argument("--restart", action="store_true", help="Discard previous progress in --output-dir")
+    parser.add_argument("--no-merge", action="store_true", help="Skip building predictions.parquet")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not Path(args.model).exists():
+        print(f"❌ Model not found: {args.model}")
+        sys.exit(1)
+    missing = [root for root in args.roots if not Path(root).is_dir()]
+    if missing:
+        print(f"❌ Archive root not found: {', '.join(missing)}")
+        sys.exit(1)
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads)
+
+    print(f"🗂️  Listing {len(args.roots)} archive root(s)...")
+    shards = discover_shards(args.roots)
+    run = {"model": str(args.model), "model_digest": file_digest(args.model), "backend": args.backend,
+           "roots": [str(r) for r in args.roots]}
+    try:
+        completed = prepare_output(args.output_dir, run, args.restart)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    todo = pending_shards(shards, completed, args.output_dir)
+    total_images = sum(len(s["paths"]) for s in shards.values())
+    print(f"📦 {len(shards)} shards / {total_images} images: {len(shards) - len(todo)} already scored, "
+          f"{len(todo)} pending")
+    if args.max_shards is not None:
+        todo = todo[:args.max_shards]
+    if todo:
+        print(f"🚀 Scoring {len(todo)} shards with {workers} worker(s) x {args.threads} thread(s)")
+
+    start = time.perf_counter()
+    failures = []
+    if todo:
+        failures = run_shards(shards, todo, args.output_dir, args.model, args.backend, workers,
+                              args.threads, args.batch_size, args.decode_workers)
+    wall_seconds = time.perf_counter() - start
+    completed = load_completed(args.output_dir)
+
+    merge = None
+    finished = [n for n in shards if n in completed and completed[n]["listing"] == shards[n]["listing"]]
+    if not args.no_merge and len(finished) == len(shards):
+        print("🔗 Merging shards...")
+        merge = merge_shards(args.output_dir, finished)
+    elif not args.no_merge:
+        print(f"⚠️  {len(shards) - len(finished)} shards still pending; re-run to finish before merging")
+
+    summary = summarize(shards, completed, failures, merge, wall_seconds, todo)
+    summary_path = args.output_dir / SUMMARY_FILE
+    summary_path.write_text(json.dumps(summary, indent=2))
+
+    this_run = summary["this_run"]
+    print(f"\n📊 Scored {this_run['images']} images in {wall_seconds:.1f}s "
+          f"({this_run['images_per_sec']:.1f} images/sec); archive: {summary['images']['scored']}/"
+          f"{summary['images']['total']} scored, {summary['images']['errors']} errors")
+    for name, err in failures[:20]:
+        print(f"❌ Shard {name} failed: {err}")
+    if merge is not None:
+        print(f"💾 {merge['rows']} rows written to {args.output_dir / MERGED_FILE}")
+        for message, count in merge["top_errors"][:5]:
+            print(f"   {count:>6} x {message}")
+    print(f"💾 Summary written to {summary_path}")
+    if failures:
+        sys.exit(1)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""
+ECG Embedding Store and Similar-ECG Retrieval
+=============================================
+Stores the ViT's pooled CLS embedding for every archived ECG and answers
+"which archived sheets look like this one?" queries.
+
+Embeddings come out of the normal prediction forward pass
+(`inference.forward_with_embeddings`). They are L2-normalised and appended to a
+memory-mapped float16 matrix alongside their ecg_ids and paths, so the archive
+is never held in memory. Queries use cosine similarity, either exactly (a
+blocked matmul over the memmap) or through an IVF index: spherical k-means
+lists, of which only the `nprobe` nearest are scanned.
+
+Usage:
+    # Embed the archive (re-running only embeds images that are new)
+    python src/embeddings.py build data/Raw/GenECG/Dataset_A_ECGs_without_imperfections \
+        --model runs/vit/vit_multilabel_checkpoint.pt --store runs/vit/embeddings --ivf
+
+    # Ten most similar archived ECGs to a new sheet
+    python src/embeddings.py query path/to/ecg.png \
+        --model runs/vit/vit_multilabel_checkpoint.pt --store runs/vit/embeddings --k 10
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import torch
+
+try:
+    from src.Data_pipeline.image_cache import ecg_id_from_path
+    from src.prediction_cache import model_fingerprint
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[1]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.image_cache import ecg_id_from_path
+    from src.prediction_cache import model_fingerprint
+
+META_FILE = "meta.json"
+VECTORS_FILE = "vectors.f16"
+IDS_FILE = "ecg_ids.npy"
+PATHS_FILE = "paths.npy"
+IVF_FILE = "ivf.npz"
+SEARCH_BLOCK_ROWS = 16384
+SHORTLIST_OVERSAMPLE = 4
+MIN_CAPACITY = 1024
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _save_npy(path: Path, array: np.ndarray):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    tmp_path.replace(path)
+
+
+class EmbeddingStore:
+    """
+    Append-only float16 embedding matrix on disk with an ecg_id / path index.
+
+    Layout of `root`:
+        vectors.f16   raw [capacity, dim] float16 memmap (grown by doubling)
+        ecg_ids.npy   int64 [count]
+        paths.npy     str [count]
+        meta.json     dim, count, capacity, model fingerprint
+
+    `meta.json` is written last on every append, so an interrupted append
+    leaves the store at its previous consistent size.
+    """
+
+    def __init__(self, root, meta: dict):
+        self.root = Path(root)
+        self.meta = meta
+        self.ecg_ids = np.load(self.root / IDS_FILE) if (self.root / IDS_FILE).exists() else np.empty(0, np.int64)
+        self.paths = np.load(self.root / PATHS_FILE) if (self.root / PATHS_FILE).exists() else np.empty(0, str)
+        self.ecg_ids, self.paths = self.ecg_ids[:self.count], self.paths[:self.count]
+        self._vectors = None
+
+    @classmethod
+    def create(cls, root, dim: int, fingerprint: str = None) -> "EmbeddingStore":
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        for name in (VECTORS_FILE, IDS_FILE, PATHS_FILE, IVF_FILE):
+            (root / name).unlink(missing_ok=True)
+        (root / VECTORS_FILE).touch()
+        meta = {"dim": dim, "count": 0, "capacity": 0, "dtype": "float16", "model_fingerprint": fingerprint}
+        store = cls(root, meta)
+        store._write_meta()
+        return store
+
+    @classmethod
+    def open(cls, root) -> "EmbeddingStore":
+        root = Path(root)
+        with open(root / META_FILE) as f:
+            return cls(root, json.load(f))
+
+    @property
+    def dim(self) -> int:
+        return self.meta["dim"]
+
+    @property
+    def count(self) -> int:
+        return self.meta["count"]
+
+    @property
+    def fingerprint(self):
+        return self.meta.get("model_fingerprint")
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Read-only [count, dim] float16 view of the stored (unit-norm) embeddings."""
+        if self._vectors is None or len(self._vectors) != self.count:
+            if self.count == 0:
+                self._vectors = np.empty((0, self.dim), dtype=np.float16)
+            else:
+                self._vectors = np.memmap(self.root / VECTORS_FILE, dtype=np.float16, mode="r",
+                                          shape=(self.count, self.dim))
+        return self._vectors
+
+    def _write_meta(self):
+        tmp_path = self.root / (META_FILE + ".tmp")
+        tmp_path.write_text(json.dumps(self.meta, indent=2))
+        tmp_path.replace(self.root / META_FILE)
+
+    def _reserve(self, needed: int):
+        capacity = self.meta["capacity"]
+        if needed <= capacity:
+            return
+        new_capacity = max(MIN_CAPACITY, capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+        with open(self.root / VECTORS_FILE, "r+b") as f:
+            f.truncate(new_capacity * self.dim * np.dtype(np.float16).itemsize)
+        self.meta["capacity"] = new_capacity
+
+    def append(self, ecg_ids, paths, embeddings: np.ndarray):
+        """Add embeddings [N, dim]; they are L2-normalised and stored as float16."""
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of shape [N, {self.dim}], got {embeddings.shape}")
+        n = len(embeddings)
+        if n == 0:
+            return
+        start = self.count
+        self._reserve(start + n)
+        out = np.memmap(self.root / VECTORS_FILE, dtype=np.float16, mode="r+",
+                        shape=(self.meta["capacity"], self.dim))
+        out[start:start + n] = l2_normalize(embeddings).astype(np.float16)
+        out.flush()
+        del out
+
+        self.ecg_ids = np.concatenate([self.ecg_ids, np.asarray(ecg_ids, dtype=np.int64)])
+        self.paths = np.concatenate([self.paths.astype(str), np.asarray([str(p) for p in paths])])
+        _save_npy(self.root / IDS_FILE, self.ecg_ids)
+        _save_npy(self.root / PATHS_FILE, self.paths)
+        self.meta["count"] = start + n
+        self._write_meta()
+        self._vectors = None
+
+    def rows_for_ids(self, ecg_ids) -> np.ndarray:
+        """Store rows holding each ecg_id (first occurrence; -1 when absent)."""
+        order = np.argsort(self.ecg_ids, kind="stable")
+        sorted_ids = self.ecg_ids[order]
+        ecg_ids = np.asarray(ecg_ids, dtype=np.int64)
+        pos = np.searchsorted(sorted_ids, ecg_ids)
+        found = pos < len(sorted_ids)
+        found[found] = sorted_ids[pos[found]] == ecg_ids[found]
+        rows = np.full(len(ecg_ids), -1, dtype=np.int64)
+        rows[found] = order[pos[found]]
+        return rows
+
+
+def _merge_topk(best_scores, best_rows, scores, rows, k):
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, keep, axis=1)
+        rows = np.take_along_axis(rows, keep, axis=1)
+    return scores, rows
+
+
+def _half_tensor(block: np.ndarray) -> torch.Tensor:
+    with warnings.catch_warnings():
+        # Read-only memmap blocks are only read by the matmul
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.from_numpy(np.ascontiguousarray(block))
+
+
+def _rescore(vectors: np.ndarray, queries: np.ndarray, rows: np.ndarray, k: int):
+    """Exact float32 cosine scores for candidate rows [Q, S], keeping the best k."""
+    candidates = np.asarray(vectors[rows.ravel()], dtype=np.float32).reshape(*rows.shape, -1)
+    scores = np.einsum("qd,qsd->qs", queries, candidates)
+    keep = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(scores, keep, axis=1), np.take_along_axis(rows, keep, axis=1)
+
+
+def search_exact(vectors: np.ndarray, queries: np.ndarray, k: int = 10, block_rows: int = SEARCH_BLOCK_ROWS):
+    """
+    Exact cosine top-k over all stored vectors.
+
+    The float16 matrix is streamed in `block_rows` blocks and scored with a
+    float16 matmul, which avoids materialising float32 copies of the archive.
+    The best `SHORTLIST_OVERSAMPLE * k + 32` candidates are then re-scored in
+    float32, so the ranking is not limited by float16 resolution.
+
+    Returns:
+        tuple: (scores [Q, k], rows [Q, k]) sorted by decreasing similarity
+    """
+    queries = l2_normalize(np.atleast_2d(queries))
+    k = min(k, len(vectors))
+    shortlist = min(len(vectors), SHORTLIST_OVERSAMPLE * k + 32)
+    queries_half = torch.from_numpy(queries).half()
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start:start + block_rows]
+        scores = (queries_half @ _half_tensor(block).T).float().numpy()
+        rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+        best_scores, best_rows = _merge_topk(best_scores, best_rows, scores, rows, shortlist)
+    return _rescore(vectors, queries, best_rows, k)
+
+
+class IVFIndex:
+    """
+    Inverted-file index over unit vectors: spherical k-means centroids plus the
+    list (centroid) each stored row belongs to.
+
+    New rows are assigned to the existing centroids by `extend`; the centroids
+    are retrained only once the store has grown well past the data they were
+    trained on (see `needs_retrain`).
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray, trained_on: int):
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = assignments.astype(np.int32)
+        self.trained_on = trained_on
+        self._lists = None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        return max(1, min(count, int(4 * math.sqrt(count))))
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, nlist: int = None, iterations: int = 10, sample_size: int = 65536,
+              seed: int = 0) -> "IVFIndex":
+        """Fit centroids on a sample of `vectors`, then assign every row."""
+        rng = np.random.default_rng(seed)
+        count = len(vectors)
+        nlist = min(nlist or cls.default_nlist(count), count)
+        sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            # Re-seed empty lists from random sample points
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = l2_normalize(sums)
+
+        index = cls(centroids, np.empty(0, np.int32), trained_on=count)
+        index.extend(vectors)
+        return index
+
+    def assign(self, vectors: np.ndarray, block_rows: int = SEARCH_BLOCK_ROWS) -> np.ndarray:
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+            out[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return out
+
+    def extend(self, vectors: np.ndarray):
+        """Assign rows added to the store since the last call."""
+        new_rows = vectors[len(self.assignments):]
+        if len(new_rows):
+            self.assignments = np.concatenate([self.assignments, self.assign(new_rows)])
+            self._lists = None
+
+    def needs_retrain(self, count: int, growth: float = 2.0) -> bool:
+        return count > growth * self.trained_on
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assignments, minlength=self.nlist))])
+            self._lists = (order, offsets)
+        return self._lists
+
+    def search(self, vectors: np.ndarray, queries: np.ndarray, k: int = 10, nprobe: int = 16):
+        """Approximate cosine top-k scanning the `nprobe` closest lists per query."""
+        queries = l2_normalize(np.atleast_2d(queries))
+        order, offsets = self._inverted_lists()
+        nprobe = min(nprobe, self.nlist)
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for qi, lists in enumerate(probes):
+            rows = np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in lists]))
+            if not len(rows):
+                continue
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ queries[qi]
+            top = np.argsort(-scores, kind="stable")[:k]
+            all_scores[qi, :len(top)] = scores[top]
+            all_rows[qi, :len(top)] = rows[top]
+        return all_scores, all_rows
+
+    def save(self, path):
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp_path, centroids=self.centroids, assignments=self.assignments, trained_on=self.trained_on)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["assignments"], int(data["trained_on"]))
+
+
+def update_ivf(store: EmbeddingStore, nlist: int = None, force_retrain: bool = False) -> IVFIndex:
+    """Bring the store's IVF index up to date: extend it with new rows, or retrain after large growth."""
+    ivf_path = store.root / IVF_FILE
+    index = IVFIndex.load(ivf_path) if ivf_path.exists() and not force_retrain else None
+    if index is not None and len(index.assignments) > store.count:
+        index = None  # store was rebuilt underneath the index
+    if index is None or index.needs_retrain(store.count) or (nlist and nlist != index.nlist):
+        index = IVFIndex.train(store.vectors, nlist)
+    else:
+        index.extend(store.vectors)
+    index.save(ivf_path)
+    return index
+
+
+def search(store: EmbeddingStore, queries: np.ndarray, k: int = 10, nprobe: int = 16, exact: bool = False):
+    """Top-k neighbours through the IVF index when present (and not `exact`), otherwise exactly."""
+    ivf_path = store.root / IVF_FILE
+    if not exact and ivf_path.exists():
+        index = IVFIndex.load(ivf_path)
+        if len(index.assignments) == store.count:
+            return index.search(store.vectors, queries, k, nprobe)
+        print("⚠️  IVF index is behind the store; run `build` again to extend it. Using exact search.")
+    return search_exact(store.vectors, queries, k)
+
+
+def build_store(model, image_paths, store: EmbeddingStore, device, batch_size: int = 32, num_workers: int = 4,
+                commit_every: int = 4096) -> dict:
+    """
+    Embed every image not yet in `store` (compared by resolved path) and append it.
+
+    Rows are committed every `commit_every` images, so an interrupted run
+    resumes from the last commit.
+    """
+    from torch.utils.data import DataLoader
+
+    from src.inference import ImagePathDataset, predict_batch
+
+    # Paths are stored resolved, so `raw` and `/abs/.../raw` name the same image.
+    # ecg_ids are not unique across datasets (A and B share them), so they cannot be the key.
+    known = {str(Path(p).resolve()) for p in store.paths.tolist()}
+    resolved = list(dict.fromkeys(str(Path(p).resolve()) for p in image_paths))
+    pending = [p for p in resolved if p not in known]
+    stats = {"images": len(resolved), "already_stored": len(resolved) - len(pending), "embedded": 0, "errors": 0}
+    if not pending:
+        return stats
+
+    dataset = ImagePathDataset(pending)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers,
+                        pin_memory=device.type == "cuda")
+    buffer_ids, buffer_paths, buffer_vectors = [], [], []
+
+    def commit():
+        if buffer_vectors:
+            store.append(buffer_ids, buffer_paths, np.concatenate(buffer_vectors))
+            stats["embedded"] += len(buffer_ids)
+            buffer_ids.clear()
+            buffer_paths.clear()
+            buffer_vectors.clear()
+
+    for images, indices, errors in loader:
+        _, embeddings = predict_batch(model, images, device, return_embeddings=True)
+        ok = np.array([not err for err in errors], dtype=bool)
+        for idx, err in zip(indices.tolist(), errors):
+            if err:
+                stats["errors"] += 1
+                print(f"⚠️  Failed to read {dataset.image_paths[idx]}: {err}")
+            else:
+                buffer_ids.append(ecg_id_from_path(dataset.image_paths[idx]))
+                buffer_paths.append(dataset.image_paths[idx])
+        buffer_vectors.append(embeddings[ok])
+        if len(buffer_ids) >= commit_every:
+            commit()
+    commit()
+    return stats
+
+
+def _load_model(model_path, backend: str):
+    from src.inference import load_vit_model
+    from src.Models.backends import backend_device, load_backend
+
+    device = backend_device(backend)
+    print(f"🖥️  Using device: {device} ({backend} backend)")
+    model, snomed_cols = load_backend(backend, model_path, device, load_fp32=load_vit_model)
+    return model, snomed_cols, device
+
+
+def run_build(args):
+    from src.inference import collect_image_paths
+
+    image_paths = collect_image_paths(args.inputs)
+    if not image_paths:
+        print(f"❌ No images found for: {' '.join(args.inputs)}")
+        sys.exit(1)
+
+    model, snomed_cols, device = _load_model(args.model, args.backend)
+    fingerprint = model_fingerprint(args.model, snomed_cols, args.backend)
+    dim = model.config.hidden_size
+
+    store_root = Path(args.store)
+    if (store_root / META_FILE).exists() and not args.rebuild:
+        store = EmbeddingStore.open(store_root)
+        if store.fingerprint != fingerprint or store.dim != dim:
+            print(f"❌ {store_root} holds embeddings from a different model; pass --rebuild to start over")
+            sys.exit(1)
+    else:
+        store = EmbeddingStore.create(store_root, dim, fingerprint)
+
+    print(f"🔍 {len(image_paths)} images, store {store_root} holds {store.count} embeddings")
+    start = time.perf_counter()
+    stats = build_store(model, image_paths, store, device, args.batch_size, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"📊 Embedded {stats['embedded']} new images in {elapsed:.1f}s "
+          f"({stats['embedded'] / max(elapsed, 1e-9):.1f} images/sec, {stats['already_stored']} already embedded, "
+          f"{stats['errors']} errors); "
+          f"store holds {store.count} x {store.dim} float16")
+
+    if store.count == 0:
+        # Nothing to cluster (every image failed to decode); drop any index left from an earlier build
+        if args.ivf or (store.root / IVF_FILE).exists():
+            (store.root / IVF_FILE).unlink(missing_ok=True)
+            print("⚠️  Store is empty; skipping the IVF index")
+    elif args.ivf or (store.root / IVF_FILE).exists():
+        start = time.perf_counter()
+        index = update_ivf(store, args.nlist, force_retrain=args.rebuild)
+        print(f"🗂️  IVF index: {index.nlist} lists over {len(index.assignments)} embeddings "
+              f"({time.perf_counter() - start:.2f}s)")
+    print(f"💾 Store written to {store_root}")
+
+
+def run_query(args):
+    store = EmbeddingStore.open(args.store)
+    if store.count == 0:
+        print(f"❌ {args.store} is empty; run `build` first")
+        sys.exit(1)
+
+    if args.ecg_id is not None:
+        row = store.rows_for_ids([args.ecg_id])[0]
+        if row < 0:
+            print(f"❌ ecg_id {args.ecg_id} is not in {args.store}")
+            sys.exit(1)
+        query = np.asarray(store.vectors[row], dtype=np.float32)
+        label = f"ecg_id {args.ecg_id}"
+    else:
+        from src.inference import predict
+
+        if not Path(args.image).exists():
+            print(f"❌ Image not found: {args.image}")
+            sys.exit(1)
+        model, snomed_cols, device = _load_model(args.model, args.backend)
+        if store.fingerprint and store.fingerprint != model_fingerprint(args.model, snomed_cols, args.backend):
+            print("⚠️  The store was built with a different checkpoint; similarities may be meaningless")
+        _, query = predict(model, args.image, snomed_cols, device, return_embedding=True)
+        label = args.image
+
+    start = time.perf_counter()
+    scores, rows = search(store, query, args.k, args.nprobe, args.exact)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    mode = "exact" if args.exact or not (store.root / IVF_FILE).exists() else f"IVF, nprobe {args.nprobe}"
+    print(f"\n🔍 {args.k} most similar ECGs to {label} ({mode}, {store.count} stored, {elapsed_ms:.1f} ms)")
+    print("=" * 72)
+    print(f"{'Rank':<6} {'ecg_id':>8} {'Similarity':>11}  Path")
+    print("-" * 72)
+    for rank, (score, row) in enumerate(zip(scores[0], rows[0]), start=1):
+        if row < 0:
+            break
+        print(f"{rank:<6} {store.ecg_ids[row]:>8} {score:>11.4f}  {store.paths[row]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GenECG embedding store and similar-ECG retrieval")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Embed images into the store (only new images are embedded)")
+    build.add_argument("inputs", nargs="+", help="Images, directories, globs, .txt lists or an ecg index .parquet")
+    build.add_argument("--rebuild", action="store_true", help="Discard the existing store and embed everything")
+    build.add_argument("--batch-size", type=int, default=32, help="Images per forward pass")
+    build.add_argument("--workers", type=int, default=4, help="Parallel image decoding workers")
+    build.add_argument("--ivf", action="store_true", help="Build/extend the approximate IVF index")
+    build.add_argument("--nlist", type=int, default=None, help="IVF lists (default: 4 * sqrt(N))")
+
+    query = subparsers.add_parser("query", help="Find the most similar stored ECGs")
+    target = query.add_mutually_exclusive_group(required=True)
+    target.add_argument("image", nargs="?", help="ECG image to search with")
+    target.add_argument("--ecg-id", type=int, default=None, help="Search with an already stored ecg_id")
+    query.add_argument("--k", type=int, default=10, help="Number of neighbours")
+    query.add_argument("--nprobe", type=int, default=16, help="IVF lists scanned per query")
+    query.add_argument("--exact", action="store_true", help="Exact search even when an IVF index exists")
+
+    for sub in (build, query):
+        sub.add_argument("--model", type=str, default="runs/vit/vit_multilabel_checkpoint.pt",
+                         help="ViT checkpoint (.pt or .safetensors)")
+        sub.add_argument("--backend", choices=["fp32", "int8"], default="fp32",
+                         help="Eager backend used for the forward pass")
+        sub.add_argument("--store", type=str, default="runs/vit/embeddings", help="Embedding store directory")
+    args = parser.parse_args()
+
+    if args.command == "build" or args.ecg_id is None:
+        if not Path(args.model).exists():
+            print(f"❌ Model not found: {args.model}")
+            sys.exit(1)
+    if args.command == "query" and not (Path(args.store) / META_FILE).exists():
+        print(f"❌ No embedding store at {args.store}")
+        sys.exit(1)
+
+    if args.command == "build":
+        run_build(args)
+    else:
+        run_query(args)
+
+
+if __name__ == "__main__":
+    main()
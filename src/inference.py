@@ -7,57 +7,127 @@ Feed an ECG image, get SNOMED-CT diagnostic predictions.
 Usage:
     python src/inference.py path/to/ecg_image.png
     python src/inference.py data/Raw/GenECG/Dataset_A_ECGs_without_imperfections/00000/00001_hr_1R.png
+
+Batch mode (directory, glob, .txt file list or ecg index .parquet):
+    python src/inference.py data/Raw/GenECG/Dataset_A_ECGs_without_imperfections \
+        --output runs/vit/predictions.parquet --batch-size 64 --workers 8
 """
 
 import argparse
+import contextlib
+import glob
+import io
+import json
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import torch
 from PIL import Image
+from torch.utils.data import DataLoader, Dataset
 from torchvision import transforms
 
+try:
+    from src import profiling
+    from src.Data_pipeline.ecg_index import index_arrays, load_ecg_index
+    from src.Evaluation.metrics import DEFAULT_THRESHOLD, load_thresholds, thresholds_path_for
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+    from src.Models.checkpoint import load_safetensors_model
+    from src.prediction_cache import PredictionCache, image_key, model_fingerprint
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[1]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src import profiling
+    from src.Data_pipeline.ecg_index import index_arrays, load_ecg_index
+    from src.Evaluation.metrics import DEFAULT_THRESHOLD, load_thresholds, thresholds_path_for
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+    from src.Models.checkpoint import load_safetensors_model
+    from src.prediction_cache import PredictionCache, image_key, model_fingerprint
+
+IMAGE_SIZE = 224
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+LIST_SUFFIXES = {".txt", ".lst"}
+
+
+def build_transform(image_size: int = IMAGE_SIZE):
+    """Resize + ImageNet normalisation used by the trained ViT."""
+    return transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+    ])
+
 
 def load_vit_model(checkpoint_path: str, device: torch.device):
-    """Load the trained ViT model."""
-    from transformers import ViTForImageClassification
-    
+    """
+    Load the trained ViT model.
+
+    Self-contained `.safetensors` artifacts (see src/Models/checkpoint.py) and
+    `.pt` checkpoints carrying a 'vit_config' (src/Training/train.py) are built
+    directly from their embedded config; older `.pt` checkpoints are loaded on
+    top of the `google/vit-base-patch16-224` skeleton.
+    """
+    from transformers import ViTConfig, ViTForImageClassification
+
     print(f"📦 Loading ViT model from {checkpoint_path}...")
+    if Path(checkpoint_path).suffix == ".safetensors":
+        model, snomed_cols = load_safetensors_model(checkpoint_path, device)
+        return model, snomed_cols
+
     checkpoint = torch.load(checkpoint_path, map_location=device)
-    
-    model = ViTForImageClassification.from_pretrained(
-        "google/vit-base-patch16-224",
-        num_labels=checkpoint['num_classes'],
-        ignore_mismatched_sizes=True,
-    )
+
+    if 'vit_config' in checkpoint:
+        model = ViTForImageClassification(ViTConfig.from_dict(checkpoint['vit_config']))
+    else:
+        model = ViTForImageClassification.from_pretrained(
+            "google/vit-base-patch16-224",
+            num_labels=checkpoint['num_classes'],
+            ignore_mismatched_sizes=True,
+        )
     model.load_state_dict(checkpoint['model_state_dict'])
     model.to(device)
     model.eval()
-    
+
     return model, checkpoint['snomed_cols']
 
 
-def predict(model, image_path: str, snomed_cols: list, device: torch.device, top_k: int = 10):
-    """Run prediction on a single ECG image."""
-    
-    # Load and transform image
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ])
-    
-    image = Image.open(image_path).convert('RGB')
-    img_tensor = transform(image).unsqueeze(0).to(device)
-    
-    # Inference
-    with torch.no_grad():
-        logits = model(img_tensor).logits
-        probs = torch.sigmoid(logits)[0].cpu().numpy()
-    
-    # Get top predictions
+def resolve_thresholds(model_path, snomed_cols: list, threshold: float = None, thresholds_path=None):
+    """
+    Per-class decision thresholds for a model.
+
+    An explicit global `threshold` wins; otherwise thresholds fitted by
+    src/Evaluation/evaluate.py are read from `thresholds_path` or
+    `<model>.thresholds.json`; otherwise every class uses DEFAULT_THRESHOLD.
+
+    Returns:
+        tuple: (thresholds [C] float32, description of where they came from)
+    """
+    if threshold is not None:
+        return np.full(len(snomed_cols), threshold, dtype=np.float32), f"global {threshold:.0%}"
+    path = Path(thresholds_path) if thresholds_path else thresholds_path_for(model_path)
+    if path.exists():
+        return load_thresholds(path, snomed_cols), f"per-class ({path.name})"
+    if thresholds_path:
+        raise FileNotFoundError(f"Thresholds file not found: {thresholds_path}")
+    return np.full(len(snomed_cols), DEFAULT_THRESHOLD, dtype=np.float32), f"global {DEFAULT_THRESHOLD:.0%}"
+
+
+def positive_codes(probs: np.ndarray, snomed_cols: list, thresholds: np.ndarray) -> list:
+    """SNOMED codes whose probability reaches their class threshold."""
+    return [snomed_cols[i].replace('SNOMED_', '') for i in np.flatnonzero(probs >= thresholds)]
+
+
+def probs_to_results(probs: np.ndarray, snomed_cols: list, top_k: int = 10):
+    """Convert one row of sigmoid probabilities into the top-k prediction records."""
     top_indices = probs.argsort()[::-1][:top_k]
-    
+
     results = []
     for idx in top_indices:
         snomed_code = snomed_cols[idx].replace('SNOMED_', '')
@@ -66,60 +136,407 @@ def predict(model, image_path: str, snomed_cols: list, device: torch.device, top
             'full_name': snomed_cols[idx],
             'probability': float(probs[idx]),
         })
-    
+
     return results
 
 
+def forward_with_embeddings(model, pixel_values: torch.Tensor):
+    """
+    Logits and the pooled CLS embedding from a single forward pass.
+
+    The embedding is the final-layernorm CLS token, i.e. exactly what the
+    classifier head sees, so it costs nothing beyond the normal prediction.
+    Needs the eager ViT (fp32 / int8 backends); exported TorchScript and ONNX
+    graphs only return logits.
+    """
+    if not hasattr(model, "vit"):
+        raise ValueError("Embeddings need the eager ViT (fp32 or int8 backend); "
+                         "exported TorchScript/ONNX models only return logits")
+    cls = model.vit(pixel_values=pixel_values).last_hidden_state[:, 0]
+    return model.classifier(cls), cls
+
+
+def predict(model, image_path: str, snomed_cols: list, device: torch.device, top_k: int = 10,
+            cache: PredictionCache = None, return_embedding: bool = False):
+    """
+    Run prediction on a single ECG image.
+
+    With a `cache` (src/prediction_cache.py), images whose bytes were scored
+    before by the same model skip decoding and the forward pass. With
+    `return_embedding=True` the pooled CLS embedding is returned too, as
+    (results, embedding [D]); the cache is bypassed since it stores no embeddings.
+    """
+    key = None
+    if cache is not None and not return_embedding:
+        with profiling.stage("inference.cache_lookup"):
+            data = Path(image_path).read_bytes()
+            key = image_key(data)
+            probs = cache.get(key)
+        if probs is not None:
+            return probs_to_results(probs, snomed_cols, top_k)
+        image_path = io.BytesIO(data)
+
+    # Load and transform image
+    transform = build_transform()
+
+    with profiling.stage("inference.decode"):
+        image = Image.open(image_path).convert('RGB')
+    with profiling.stage("inference.transform"):
+        img_tensor = transform(image).unsqueeze(0)
+    with profiling.stage("inference.to_device", device):
+        img_tensor = img_tensor.to(device)
+
+    # Inference
+    with torch.no_grad():
+        with profiling.stage("inference.forward", device):
+            if return_embedding:
+                logits, embedding = forward_with_embeddings(model, img_tensor)
+            else:
+                logits = model(img_tensor).logits
+        with profiling.stage("inference.to_host"):
+            probs = torch.sigmoid(logits)[0].cpu().numpy()
+    if key is not None:
+        cache.put(key, probs)
+
+    # Get top predictions
+    with profiling.stage("inference.topk"):
+        results = probs_to_results(probs, snomed_cols, top_k)
+    if return_embedding:
+        return results, embedding[0].float().cpu().numpy()
+    return results
+
+
+def predict_batch(model, img_batch: torch.Tensor, device: torch.device, return_embeddings: bool = False):
+    """
+    Run a single forward pass over a stacked batch and return sigmoid probabilities [B, C].
+
+    With `return_embeddings=True` returns (probabilities [B, C], CLS embeddings [B, D]).
+    """
+    with profiling.stage("inference.to_device", device):
+        img_batch = img_batch.to(device, non_blocking=True)
+    with torch.no_grad():
+        with profiling.stage("inference.forward", device):
+            if return_embeddings:
+                logits, embeddings = forward_with_embeddings(model, img_batch)
+            else:
+                logits = model(img_batch).logits
+        with profiling.stage("inference.to_host"):
+            probs = torch.sigmoid(logits).float().cpu().numpy()
+            if return_embeddings:
+                return probs, embeddings.float().cpu().numpy()
+            return probs
+
+
+def collect_image_paths(inputs) -> list:
+    """
+    Expand CLI inputs into a sorted, de-duplicated list of image paths.
+
+    Each input may be an image file, a directory (searched recursively so the
+    00000/, 01000/ bucket folders are covered), a glob pattern, a .txt/.lst
+    file listing one image path per line, or an ecg index .parquet
+    (src/Data_pipeline/ecg_index.py), which avoids walking the tree.
+    """
+    paths = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_file() and path.suffix.lower() == ".parquet":
+            index = load_ecg_index(path)
+            paths.extend(index_arrays(index, index.attrs.get("raw_dir", path.parent))[0])
+        elif path.is_dir():
+            paths.extend(p for p in path.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+        elif path.is_file() and path.suffix.lower() in LIST_SUFFIXES:
+            with open(path) as f:
+                paths.extend(Path(line.strip()) for line in f if line.strip())
+        elif path.is_file():
+            paths.append(path)
+        else:
+            paths.extend(Path(p) for p in glob.glob(item, recursive=True)
+                         if Path(p).suffix.lower() in IMAGE_SUFFIXES)
+
+    return sorted(set(paths))
+
+
+class ImagePathDataset(Dataset):
+    """Decodes and preprocesses ECG images inside DataLoader workers."""
+
+    def __init__(self, image_paths, image_size: int = IMAGE_SIZE):
+        self.image_paths = [str(p) for p in image_paths]
+        self.image_size = image_size
+        self.transform = build_transform(image_size)
+
+    def __len__(self) -> int:
+        return len(self.image_paths)
+
+    def __getitem__(self, idx: int):
+        try:
+            with profiling.stage("dataset.decode"):
+                image = Image.open(self.image_paths[idx]).convert('RGB')
+            with profiling.stage("dataset.transform"):
+                return self.transform(image), idx, ""
+        except Exception as e:
+            # Keep the batch shape intact; the failure is reported per image
+            return torch.zeros(3, self.image_size, self.image_size), idx, str(e)
+
+
+def _output_format(output_path, output_format=None) -> str:
+    if output_format:
+        return output_format
+    return "parquet" if Path(output_path).suffix.lower() == ".parquet" else "jsonl"
+
+
+def _hash_images(image_paths, num_workers: int = 4) -> list:
+    """Cache keys for each image (None when the file cannot be read); hashing releases the GIL."""
+    def key_of(path):
+        try:
+            return image_key(Path(path).read_bytes())
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+        return list(pool.map(key_of, image_paths))
+
+
+def run_batch_inference(model, image_paths, snomed_cols: list, device: torch.device,
+                        batch_size: int = 32, num_workers: int = 4, top_k: int = 10,
+                        output_path=None, output_format=None, cache: PredictionCache = None,
+                        thresholds: np.ndarray = None):
+    """
+    Score many images with one forward pass per batch.
+
+    Images are decoded and resized in parallel by DataLoader workers. Results
+    are written as JSONL (one record per image with the top-k predictions, in
+    the same shape as `predict()`) or Parquet (one row per image with a
+    probability column per SNOMED class).
+
+    With a `cache`, every image is hashed first and only cache misses are
+    decoded and scored; cached JSONL records are written ahead of the rest.
+    With per-class `thresholds`, JSONL records also list the positive codes.
+
+    Images that cannot be read are not scored; their Parquet rows hold NaN
+    probabilities and the error message.
+
+    Returns:
+        dict: Run statistics (images, errors, cached, seconds, images_per_sec).
+    """
+    image_paths = [str(p) for p in image_paths]
+    start = time.perf_counter()
+
+    keys = [None] * len(image_paths)
+    cached = {}
+    if cache is not None:
+        with profiling.stage("inference.cache_lookup"):
+            keys = _hash_images(image_paths, num_workers)
+            for i, key in enumerate(keys):
+                probs = cache.get(key) if key is not None else None
+                if probs is not None:
+                    cached[i] = probs
+    pending = [i for i in range(len(image_paths)) if i not in cached]
+
+    dataset = ImagePathDataset([image_paths[i] for i in pending])
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",
+        persistent_workers=False,
+    )
+
+    fmt = _output_format(output_path, output_format) if output_path else None
+    if output_path:
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    jsonl_file = open(output_path, "w") if fmt == "jsonl" else None
+    all_probs = np.zeros((len(image_paths), len(snomed_cols)), dtype=np.float32) if fmt == "parquet" else None
+    all_errors = [""] * len(image_paths)
+    error_count = 0
+
+    try:
+        for i, probs in cached.items():
+            if jsonl_file is not None:
+                record = {"image": image_paths[i], "error": None,
+                          "predictions": probs_to_results(probs, snomed_cols, top_k)}
+                if thresholds is not None:
+                    record["positives"] = positive_codes(probs, snomed_cols, thresholds)
+                jsonl_file.write(json.dumps(record) + "\n")
+            if all_probs is not None:
+                all_probs[i] = probs
+
+        for images, indices, errors in loader:
+            # Unreadable images stay out of the forward pass and get NaN probabilities
+            readable = np.array([not err for err in errors], dtype=bool)
+            probs = np.full((len(errors), len(snomed_cols)), np.nan, dtype=np.float32)
+            if readable.any():
+                probs[readable] = predict_batch(model, images[torch.from_numpy(readable)], device)
+            fresh = []
+            for row, idx, err in zip(probs, indices.tolist(), errors):
+                i = pending[idx]
+                image_path = image_paths[i]
+                if err:
+                    error_count += 1
+                    all_errors[i] = err
+                    print(f"⚠️  Failed to read {image_path}: {err}")
+                elif keys[i] is not None:
+                    fresh.append((keys[i], row))
+                if jsonl_file is not None:
+                    with profiling.stage("inference.topk"):
+                        predictions = [] if err else probs_to_results(row, snomed_cols, top_k)
+                    record = {"image": image_path, "error": err or None, "predictions": predictions}
+                    if thresholds is not None:
+                        record["positives"] = [] if err else positive_codes(row, snomed_cols, thresholds)
+                    jsonl_file.write(json.dumps(record) + "\n")
+                if all_probs is not None:
+                    all_probs[i] = row
+            if cache is not None and fresh:
+                cache.put_many(fresh)
+    finally:
+        if jsonl_file is not None:
+            jsonl_file.close()
+    elapsed = time.perf_counter() - start
+
+    if fmt == "parquet":
+        import pandas as pd
+
+        df = pd.DataFrame(all_probs, columns=snomed_cols)
+        df.insert(0, "error", [err or None for err in all_errors])
+        df.insert(0, "image", image_paths)
+        df.to_parquet(output_path, index=False)
+
+    return {
+        "images": len(image_paths),
+        "errors": error_count,
+        "cached": len(cached),
+        "seconds": elapsed,
+        "images_per_sec": len(image_paths) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
 def main():
     parser = argparse.ArgumentParser(description="GenECG Diagnostic Inference")
-    parser.add_argument("image", type=str, help="Path to ECG image")
-    parser.add_argument("--model", type=str, 
+    parser.add_argument("image", type=str, nargs="+",
+                        help="ECG image, directory, glob pattern or .txt file list")
+    parser.add_argument("--model", type=str,
                         default="runs/vit/vit_multilabel_checkpoint.pt",
-                        help="Path to ViT checkpoint")
+                        help="Path to ViT checkpoint (or exported .ts/.onnx for those backends)")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32",
+                        help="Inference backend: eager fp32, dynamic int8, TorchScript or ONNX Runtime")
     parser.add_argument("--top-k", type=int, default=10,
                         help="Number of top predictions to show")
-    parser.add_argument("--threshold", type=float, default=0.3,
-                        help="Probability threshold for positive prediction")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Global probability threshold for positive prediction "
+                             "(default: per-class thresholds from <model>.thresholds.json, else 0.3)")
+    parser.add_argument("--thresholds", type=str, default=None,
+                        help="Per-class thresholds JSON written by src/Evaluation/evaluate.py")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Batch mode: write results to this .jsonl or .parquet file")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default=None,
+                        help="Batch output format (inferred from --output suffix by default)")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Batch mode: images per forward pass")
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1),
+                        help="Batch mode: parallel image decoding workers")
+    parser.add_argument("--cache-db", type=str, default=None,
+                        help="SQLite prediction cache: images scored before by the same checkpoint are not re-run")
+    parser.add_argument("--cache-size-mb", type=float, default=64,
+                        help="In-memory tier of the prediction cache (used with --cache-db)")
+    parser.add_argument("--cache-prune", action="store_true",
+                        help="Delete --cache-db entries written by other checkpoints or backends before scoring")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time each stage (decode, transform, copy, forward, top-k); also enabled by GENECG_PROFILE=1")
+    parser.add_argument("--profile-output", type=str, default=None,
+                        help="Write the stage histograms to this .json or .prom (Prometheus text) file")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Run under torch.profiler and write a Chrome trace to this .json file")
     args = parser.parse_args()
-    
+    if args.profile or args.profile_output or args.trace:
+        profiling.enable()
+
+    with profiling.torch_trace(args.trace) if args.trace else contextlib.nullcontext():
+        result = run_cli(args)
+    profiling.finish(args.profile_output)
+    if args.trace:
+        print(f"💾 Chrome trace written to {args.trace}")
+    return result
+
+
+def run_cli(args):
+    """Body of main() once the arguments are parsed."""
+    single = (len(args.image) == 1 and args.output is None
+              and Path(args.image[0]).suffix.lower() in IMAGE_SUFFIXES)
+
     # Check paths
-    if not Path(args.image).exists():
-        print(f"❌ Image not found: {args.image}")
+    if single and not Path(args.image[0]).exists():
+        print(f"❌ Image not found: {args.image[0]}")
         sys.exit(1)
-    
+
     if not Path(args.model).exists():
         print(f"❌ Model not found: {args.model}")
         sys.exit(1)
-    
+
+    image_paths = [Path(args.image[0])] if single else collect_image_paths(args.image)
+    if not image_paths:
+        print(f"❌ No images found for: {' '.join(args.image)}")
+        sys.exit(1)
+
     # Setup device
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"🖥️  Using device: {device}")
-    
+    device = backend_device(args.backend)
+    print(f"🖥️  Using device: {device} ({args.backend} backend)")
+
     # Load model
-    model, snomed_cols = load_vit_model(args.model, device)
-    print(f"✅ Model loaded with {len(snomed_cols)} SNOMED classes\n")
-    
+    with profiling.stage("inference.load_model"):
+        model, snomed_cols = load_backend(args.backend, args.model, device, load_fp32=load_vit_model)
+    thresholds, threshold_source = resolve_thresholds(args.model, snomed_cols, args.threshold, args.thresholds)
+    print(f"✅ Model loaded with {len(snomed_cols)} SNOMED classes (thresholds: {threshold_source})\n")
+
+    cache = None
+    if args.cache_db:
+        cache = PredictionCache(model_fingerprint(args.model, snomed_cols, args.backend),
+                                max_bytes=int(args.cache_size_mb * (1 << 20)), disk_path=args.cache_db)
+        if args.cache_prune:
+            print(f"🗑️  Pruned {cache.prune_other_models()} cache entries from other models")
+
+    if not single:
+        print(f"🔍 Scoring {len(image_paths)} images (batch size {args.batch_size}, {args.workers} workers)\n")
+        stats = run_batch_inference(
+            model, image_paths, snomed_cols, device,
+            batch_size=args.batch_size,
+            num_workers=args.workers,
+            top_k=args.top_k,
+            output_path=args.output,
+            output_format=args.format,
+            cache=cache,
+            thresholds=thresholds,
+        )
+        print(f"\n📊 Scored {stats['images']} images in {stats['seconds']:.1f}s "
+              f"({stats['images_per_sec']:.1f} images/sec, {stats['errors']} errors, "
+              f"{stats['cached']} from cache)")
+        if args.output:
+            print(f"💾 Results written to {args.output}")
+        return stats
+
     # Run prediction
-    print(f"🔍 Analyzing: {args.image}\n")
-    results = predict(model, args.image, snomed_cols, device, args.top_k)
-    
+    print(f"🔍 Analyzing: {args.image[0]}\n")
+    results = predict(model, args.image[0], snomed_cols, device, args.top_k, cache=cache)
+    if cache is not None and cache.disk_hits:
+        print("⚡ Served from prediction cache\n")
+
     # Display results
     print("=" * 60)
     print("📋 SNOMED-CT DIAGNOSTIC PREDICTIONS")
     print("=" * 60)
     print(f"{'SNOMED Code':<15} {'Probability':>12} {'Status':<10}")
     print("-" * 60)
-    
+
+    class_threshold = dict(zip(snomed_cols, thresholds.tolist()))
     for r in results:
-        status = "🔴 POSITIVE" if r['probability'] >= args.threshold else ""
+        status = "🔴 POSITIVE" if r['probability'] >= class_threshold[r['full_name']] else ""
         print(f"{r['snomed_code']:<15} {r['probability']:>12.1%} {status:<10}")
-    
+
     print("-" * 60)
-    
+
     # Summary
-    positive_count = sum(1 for r in results if r['probability'] >= args.threshold)
-    print(f"\n📊 Summary: {positive_count} diagnoses above {args.threshold:.0%} threshold")
-    
+    positive_count = sum(1 for r in results if r['probability'] >= class_threshold[r['full_name']])
+    print(f"\n📊 Summary: {positive_count} diagnoses above the {threshold_source} threshold")
+
     return results
 
 
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+GenECG Two-Stage Diagnostic Pipeline
+====================================
+Stage 2: YOLOv8 localises the 12 leads on each 3x4 sheet.
+Stage 4: the ViT scores every lead crop; crop probabilities are aggregated
+back to one SNOMED-CT prediction per sheet.
+
+Usage:
+    python src/pipeline.py data/Raw/GenECG/Dataset_A_ECGs_without_imperfections/00000 \
+        --yolo runs/detect/train/weights/best.pt \
+        --model runs/vit/vit_multilabel_checkpoint.pt \
+        --output runs/pipeline/predictions.jsonl
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.ops import roi_align
+
+try:
+    from src.Data_pipeline.yolo_labels import LEAD_ORDER, grid_lead_boxes
+    from src.inference import IMAGENET_MEAN, IMAGENET_STD, IMAGE_SIZE, collect_image_paths, load_vit_model, probs_to_results
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[1]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.Data_pipeline.yolo_labels import LEAD_ORDER, grid_lead_boxes
+    from src.inference import IMAGENET_MEAN, IMAGENET_STD, IMAGE_SIZE, collect_image_paths, load_vit_model, probs_to_results
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+
+NUM_LEADS = len(LEAD_ORDER)
+AGGREGATIONS = ("mean", "max")
+# Pixels kept around each lead box so bilinear samples at its edge see the same neighbours as on the full sheet
+CROP_MARGIN = 2
+
+
+def decode_sheet(image_path) -> np.ndarray:
+    """Decode one ECG sheet to an HxWx3 uint8 RGB array."""
+    with Image.open(image_path) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def _try_decode_sheet(image_path):
+    """(sheet, None) or (None, error message) so one bad file does not abort a batch."""
+    try:
+        return decode_sheet(image_path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def select_lead_boxes(classes: np.ndarray, confidences: np.ndarray, boxes: np.ndarray,
+                      img_width: int, img_height: int) -> np.ndarray:
+    """
+    Pick the most confident detection per lead class.
+
+    Leads the detector missed fall back to the 3x4 grid heuristic box, so every
+    sheet always yields exactly 12 crops in LEAD_ORDER.
+
+    Returns:
+        np.ndarray: [12, 4] pixel boxes (x_min, y_min, x_max, y_max).
+    """
+    lead_boxes = grid_lead_boxes(img_width, img_height).astype(np.float32)
+    classes = classes.astype(np.int64)
+    valid = (classes >= 0) & (classes < NUM_LEADS)
+    if not valid.any():
+        return lead_boxes
+
+    classes, confidences, boxes = classes[valid], confidences[valid], boxes[valid]
+    order = np.lexsort((-confidences, classes))
+    found, first = np.unique(classes[order], return_index=True)
+    lead_boxes[found] = boxes[order[first]]
+    return lead_boxes
+
+
+class TwoStagePipeline:
+    """
+    Runs lead detection and lead-level classification over batches of sheets.
+
+    Args:
+        yolo_weights (str): Trained detector from src/Training/train_yolo.py.
+        classifier_path (str): ViT checkpoint/artifact for `backend`.
+        backend (str): Classifier backend (see src/Models/backends.py).
+        conf (float): Detector confidence threshold.
+        crop_size (int): Side length of the square crops fed to the classifier.
+        aggregate (str): How lead probabilities combine per sheet ("mean" or "max").
+        classifier_batch_size (int): Crops per classifier forward pass.
+        decode_workers (int): Threads decoding PNGs in parallel.
+    """
+
+    def __init__(self, yolo_weights, classifier_path, backend: str = "fp32", conf: float = 0.25,
+                 crop_size: int = IMAGE_SIZE, aggregate: str = "mean",
+                 classifier_batch_size: int = 96, decode_workers: int = 4):
+        try:
+            from ultralytics import YOLO
+        except ModuleNotFoundError as exc:  # pragma: no cover - checked at runtime
+            raise RuntimeError(
+                "Ultralytics is required. Install it with `pip install ultralytics` before running this script."
+            ) from exc
+
+        if aggregate not in AGGREGATIONS:
+            raise ValueError(f"aggregate must be one of {AGGREGATIONS}, got '{aggregate}'")
+
+        self.device = backend_device(backend)
+        self.detector = YOLO(str(yolo_weights))
+        self.classifier, self.snomed_cols = load_backend(backend, classifier_path, self.device, load_fp32=load_vit_model)
+        self.conf = conf
+        self.crop_size = crop_size
+        self.aggregate = aggregate
+        self.classifier_batch_size = classifier_batch_size
+        self.decode_workers = decode_workers
+        self.mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+        self.std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+
+    def detect(self, sheets: list) -> list:
+        """Run YOLO over a batch of RGB sheets and return one [12, 4] box array per sheet."""
+        # Ultralytics treats numpy inputs as BGR
+        results = self.detector.predict([sheet[..., ::-1] for sheet in sheets], conf=self.conf, verbose=False)
+
+        lead_boxes = []
+        for sheet, result in zip(sheets, results):
+            height, width = sheet.shape[:2]
+            det = result.boxes
+            lead_boxes.append(select_lead_boxes(
+                det.cls.cpu().numpy(), det.conf.cpu().numpy(), det.xyxy.cpu().numpy(), width, height,
+            ))
+        return lead_boxes
+
+    def crop_leads(self, sheets: list, lead_boxes: list) -> torch.Tensor:
+        """
+        Crop and resize all lead regions straight from the decoded uint8 sheets.
+
+        Only the pixels under each lead box (plus a bilinear-sampling margin) are
+        converted to float, so a batch of full-resolution sheets is never held
+        as float32, and there is no per-crop PIL round-trip.
+
+        Returns:
+            torch.Tensor: Normalised crops [len(sheets) * 12, 3, crop_size, crop_size],
+                          ordered sheet-major then LEAD_ORDER.
+        """
+        crops = torch.empty(len(sheets) * NUM_LEADS, 3, self.crop_size, self.crop_size)
+        for i, (sheet, boxes) in enumerate(zip(sheets, lead_boxes)):
+            height, width = sheet.shape[:2]
+            for lead, (x_min, y_min, x_max, y_max) in enumerate(boxes):
+                left = min(max(int(np.floor(x_min)) - CROP_MARGIN, 0), width - 1)
+                top = min(max(int(np.floor(y_min)) - CROP_MARGIN, 0), height - 1)
+                right = max(min(int(np.ceil(x_max)) + CROP_MARGIN, width), left + 1)
+                bottom = max(min(int(np.ceil(y_max)) + CROP_MARGIN, height), top + 1)
+                region = torch.from_numpy(np.ascontiguousarray(sheet[top:bottom, left:right]))
+                region = region.permute(2, 0, 1).unsqueeze(0).float().div_(255.0)
+                box = torch.tensor([[x_min - left, y_min - top, x_max - left, y_max - top]], dtype=torch.float32)
+                crops[i * NUM_LEADS + lead] = roi_align(region, [box], output_size=(self.crop_size, self.crop_size),
+                                                        spatial_scale=1.0, sampling_ratio=2, aligned=True)[0]
+
+        return crops.sub_(self.mean).div_(self.std)
+
+    def classify(self, crops: torch.Tensor) -> torch.Tensor:
+        """Score crops in large batches and return sigmoid probabilities [num_crops, C]."""
+        probs = []
+        with torch.no_grad():
+            for chunk in crops.split(self.classifier_batch_size):
+                logits = self.classifier(chunk.to(self.device, non_blocking=True)).logits
+                probs.append(torch.sigmoid(logits.float()).cpu())
+        return torch.cat(probs) if probs else torch.empty(0, len(self.snomed_cols))
+
+    def run_sheets(self, sheets: list):
+        """
+        Full pipeline on already-decoded sheets.
+
+        Returns:
+            tuple: (sheet probabilities [N, C], lead probabilities [N, 12, C], lead boxes list)
+        """
+        lead_boxes = self.detect(sheets)
+        lead_probs = self.classify(self.crop_leads(sheets, lead_boxes)).view(len(sheets), NUM_LEADS, -1)
+        if self.aggregate == "max":
+            sheet_probs = lead_probs.max(dim=1).values
+        else:
+            sheet_probs = lead_probs.mean(dim=1)
+        return sheet_probs.numpy(), lead_probs.numpy(), lead_boxes
+
+    def run(self, image_paths, sheet_batch_size: int = 16):
+        """
+        Decode sheets in parallel and yield (path, sheet probs, lead boxes, error) per image.
+
+        A sheet that cannot be decoded yields (path, None, None, error message)
+        instead of aborting the run.
+        """
+        image_paths = [str(p) for p in image_paths]
+        with ThreadPoolExecutor(max_workers=self.decode_workers) as pool:
+            for start in range(0, len(image_paths), sheet_batch_size):
+                paths = image_paths[start:start + sheet_batch_size]
+                decoded = list(pool.map(_try_decode_sheet, paths))
+                ok = [i for i, (sheet, _) in enumerate(decoded) if sheet is not None]
+                results = {}
+                if ok:
+                    sheet_probs, _, lead_boxes = self.run_sheets([decoded[i][0] for i in ok])
+                    results = {i: (probs, boxes) for i, probs, boxes in zip(ok, sheet_probs, lead_boxes)}
+                for i, path in enumerate(paths):
+                    if i in results:
+                        yield path, *results[i], None
+                    else:
+                        yield path, None, None, decoded[i][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GenECG two-stage (YOLO + ViT) diagnosis")
+    parser.add_argument("image", type=str, nargs="+",
+                        help="ECG image, directory, glob pattern or .txt file list")
+    parser.add_argument("--yolo", type=str, default="runs/detect/train/weights/best.pt",
+                        help="Trained YOLO lead detector")
+    parser.add_argument("--model", type=str, default="runs/vit/vit_multilabel_checkpoint.pt",
+                        help="Path to ViT checkpoint (or exported .ts/.onnx for those backends)")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32", help="Classifier backend")
+    parser.add_argument("--aggregate", choices=AGGREGATIONS, default="mean",
+                        help="How the 12 lead predictions combine into one sheet prediction")
+    parser.add_argument("--conf", type=float, default=0.25, help="Detector confidence threshold")
+    parser.add_argument("--sheet-batch-size", type=int, default=16, help="Sheets per detector batch")
+    parser.add_argument("--crop-batch-size", type=int, default=96, help="Lead crops per classifier batch")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel PNG decoding threads")
+    parser.add_argument("--top-k", type=int, default=10, help="Number of top predictions per sheet")
+    parser.add_argument("--output", type=str, default=None, help="Write one JSON record per sheet to this file")
+    args = parser.parse_args()
+
+    for path, label in ((args.yolo, "Detector"), (args.model, "Model")):
+        if not Path(path).exists():
+            print(f"❌ {label} not found: {path}")
+            sys.exit(1)
+
+    image_paths = collect_image_paths(args.image)
+    if not image_paths:
+        print(f"❌ No images found for: {' '.join(args.image)}")
+        sys.exit(1)
+
+    pipeline = TwoStagePipeline(
+        args.yolo, args.model, backend=args.backend, conf=args.conf, aggregate=args.aggregate,
+        classifier_batch_size=args.crop_batch_size, decode_workers=args.workers,
+    )
+    print(f"✅ Pipeline ready on {pipeline.device} with {len(pipeline.snomed_cols)} SNOMED classes")
+    print(f"🔍 Processing {len(image_paths)} sheets...\n")
+
+    out_file = open(args.output, "w") if args.output else None
+    start = time.perf_counter()
+    errors = 0
+    try:
+        for path, probs, boxes, error in pipeline.run(image_paths, args.sheet_batch_size):
+            if error:
+                errors += 1
+                print(f"⚠️  Failed to read {path}: {error}")
+                if out_file is not None:
+                    out_file.write(json.dumps({"image": path, "error": error, "predictions": []}) + "\n")
+                continue
+            results = probs_to_results(probs, pipeline.snomed_cols, args.top_k)
+            if out_file is not None:
+                record = {
+                    "image": path,
+                    "error": None,
+                    "predictions": results,
+                    "lead_boxes": {lead: box.round(1).tolist() for lead, box in zip(LEAD_ORDER, boxes)},
+                }
+                out_file.write(json.dumps(record) + "\n")
+            else:
+                top = ", ".join(f"{r['snomed_code']} ({r['probability']:.1%})" for r in results[:3])
+                print(f"{Path(path).name}: {top}")
+    finally:
+        if out_file is not None:
+            out_file.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n📊 Processed {len(image_paths)} sheets in {elapsed:.1f}s ({len(image_paths) / elapsed:.1f} sheets/sec, {errors} errors)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Content-addressed cache of ViT predictions.
+
+Resubmitted ECG sheets (re-reads, second opinions, batch reruns) are looked up
+by a hash of their raw bytes instead of being decoded and run through the ViT
+again. Entries store the full sigmoid probability row, so callers can still
+choose any top-k or threshold on a hit.
+
+Keys are scoped by a model fingerprint (checkpoint hash + SNOMED columns +
+backend): loading a different checkpoint starts from an empty cache. Several
+models can share one database file; rows from other models are only removed by
+an explicit `prune_other_models()`.
+
+Usage:
+    from src.prediction_cache import PredictionCache, image_key, model_fingerprint
+
+    cache = PredictionCache(model_fingerprint(model_path, snomed_cols),
+                            max_bytes=64 << 20, disk_path="runs/vit/predictions.sqlite")
+    probs = cache.get(image_key(data))
+    if probs is None:
+        probs = ...  # run the model
+        cache.put(image_key(data), probs)
+"""
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+KEY_DIGEST_SIZE = 16
+HASH_CHUNK_SIZE = 1 << 20
+# Rough per-entry cost of the OrderedDict slot, key string and ndarray header
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def image_key(data: bytes) -> str:
+    """Hex digest of the raw image bytes (BLAKE2b, 128-bit)."""
+    return hashlib.blake2b(data, digest_size=KEY_DIGEST_SIZE).hexdigest()
+
+
+def file_digest(path) -> str:
+    """BLAKE2b digest of a file, read in chunks so large checkpoints stay out of memory."""
+    digest = hashlib.blake2b(digest_size=KEY_DIGEST_SIZE)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_fingerprint(model_path, snomed_cols: list, backend: str = "fp32") -> str:
+    """
+    Identify the model that produced a prediction.
+
+    Combines the checkpoint's content hash with the SNOMED column order and the
+    inference backend (int8 / ONNX outputs differ slightly from fp32), so a
+    retrained or re-exported model never reads another model's entries.
+    """
+    digest = hashlib.blake2b(digest_size=KEY_DIGEST_SIZE)
+    digest.update(file_digest(model_path).encode())
+    digest.update(backend.encode())
+    digest.update("\x1f".join(snomed_cols).encode())
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier prediction cache: an in-memory LRU bounded by bytes, optionally
+    backed by a SQLite file that survives restarts.
+
+    Thread-safe; `get` promotes disk hits into the memory tier. Returned arrays
+    are read-only views shared between callers.
+    """
+
+    def __init__(self, fingerprint: str, max_bytes: int = 64 << 20, disk_path=None):
+        self.fingerprint = fingerprint
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_path = Path(disk_path) if disk_path else None
+        self._db = self._open_db(self.disk_path) if self.disk_path else None
+
+    def _open_db(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            " fingerprint TEXT NOT NULL, key TEXT NOT NULL, probs BLOB NOT NULL,"
+            " PRIMARY KEY (fingerprint, key))"
+        )
+        return db
+
+    def _insert(self, key: str, probs: np.ndarray):
+        # Caller holds the lock
+        size = probs.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes + ENTRY_OVERHEAD_BYTES
+        self._entries[key] = probs
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes + ENTRY_OVERHEAD_BYTES
+            self.evictions += 1
+
+    def get(self, key: str):
+        """Cached probability row for `key`, or None on a miss."""
+        with self._lock:
+            probs = self._entries.get(key)
+            if probs is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return probs
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT probs FROM predictions WHERE fingerprint = ? AND key = ?",
+                    (self.fingerprint, key),
+                ).fetchone()
+                if row is not None:
+                    probs = np.frombuffer(row[0], dtype=np.float32)
+                    self._insert(key, probs)
+                    self.disk_hits += 1
+                    return probs
+            self.misses += 1
+            return None
+
+    def put(self, key: str, probs: np.ndarray):
+        """Store one probability row (copied to a read-only float32 array)."""
+        probs = np.array(probs, dtype=np.float32, copy=True).reshape(-1)
+        probs.setflags(write=False)
+        with self._lock:
+            self._insert(key, probs)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions (fingerprint, key, probs) VALUES (?, ?, ?)",
+                    (self.fingerprint, key, probs.tobytes()),
+                )
+
+    def put_many(self, items):
+        """Store several (key, probs) pairs in one disk transaction."""
+        rows = []
+        with self._lock:
+            for key, probs in items:
+                probs = np.array(probs, dtype=np.float32, copy=True).reshape(-1)
+                probs.setflags(write=False)
+                self._insert(key, probs)
+                rows.append((self.fingerprint, key, probs.tobytes()))
+            if self._db is not None and rows:
+                with self._db:
+                    self._db.execute("BEGIN")
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO predictions (fingerprint, key, probs) VALUES (?, ?, ?)", rows
+                    )
+
+    def clear(self):
+        """Drop every entry for this fingerprint from both tiers."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions WHERE fingerprint = ?", (self.fingerprint,))
+
+    def prune_other_models(self) -> int:
+        """
+        Delete on-disk rows written under any other fingerprint and compact the file.
+
+        Not done on open: processes with different checkpoints or backends may
+        share one database. Returns the number of rows removed.
+        """
+        if self._db is None:
+            return 0
+        with self._lock:
+            stale = self._db.execute("DELETE FROM predictions WHERE fingerprint != ?", (self.fingerprint,)).rowcount
+            if stale:
+                self._db.execute("VACUUM")
+        return stale
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute(
+                    "SELECT COUNT(*) FROM predictions WHERE fingerprint = ?", (self.fingerprint,)
+                ).fetchone()[0]
+        return stats
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,356 @@
+"""
+Opt-in stage timing for the GenECG pipeline.
+
+Timers are off unless GENECG_PROFILE=1 is set or `enable()` is called (the
+CLIs expose this as --profile). When off, `stage()` returns a shared no-op
+context manager, so instrumented code pays almost nothing.
+
+Usage:
+    from src import profiling
+
+    with profiling.stage("inference.decode"):
+        image = Image.open(path).convert("RGB")
+
+    profiling.finish("runs/profile.prom")   # summary table + JSON/Prometheus export
+
+Stages recorded in DataLoader workers or process pools are written to a spool
+directory when those processes exit and merged into the parent's report.
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from multiprocessing import util as mp_util
+from pathlib import Path
+
+ENV_VAR = "GENECG_PROFILE"
+SPOOL_ENV_VAR = "GENECG_PROFILE_SPOOL"
+MAIN_PID_ENV_VAR = "GENECG_PROFILE_MAIN_PID"
+
+# Histogram bucket upper bounds in seconds (Prometheus `le` labels)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+_lock = threading.Lock()
+_registry = {}
+_enabled = os.environ.get(ENV_VAR, "").lower() in ("1", "true", "yes", "on")
+_trace_active = False
+_spool_registered = False
+_owned_spool = {}  # spool directory -> pid of the process that created it
+_NULL = contextlib.nullcontext()
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with count, sum, min and max."""
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Bucket-resolution estimate: upper bound of the bucket holding the q-th sample (capped at max)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "min_ms": 1000 * self.min if self.count else 0.0,
+            "max_ms": 1000 * self.max,
+            "p50_ms": 1000 * self.quantile(0.50),
+            "p95_ms": 1000 * self.quantile(0.95),
+            "p99_ms": 1000 * self.quantile(0.99),
+            "buckets": self.counts,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        hist = cls()
+        hist.counts = list(data["buckets"])
+        hist.count = data["count"]
+        hist.total = data["total_s"]
+        hist.min = data["min_ms"] / 1000 if hist.count else math.inf
+        hist.max = data["max_ms"] / 1000
+        return hist
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable(flag: bool = True):
+    """
+    Turn timers on or off for this process and any worker processes it starts.
+
+    The setting is mirrored into the environment so spawned (not only forked)
+    workers pick it up, together with the spool directory they report to.
+    """
+    global _enabled
+    _enabled = flag
+    if flag:
+        os.environ[ENV_VAR] = "1"
+        os.environ.setdefault(MAIN_PID_ENV_VAR, str(os.getpid()))
+        if SPOOL_ENV_VAR not in os.environ:
+            spool = tempfile.mkdtemp(prefix="genecg_profile_")
+            os.environ[SPOOL_ENV_VAR] = spool
+            _owned_spool[spool] = os.getpid()
+            atexit.register(_remove_spool, spool)
+    else:
+        os.environ.pop(ENV_VAR, None)
+
+
+def _remove_spool(spool: str):
+    """Delete a spool directory, but only from the process that created it."""
+    if _owned_spool.get(spool) != os.getpid():
+        return
+    del _owned_spool[spool]
+    shutil.rmtree(spool, ignore_errors=True)
+    if os.environ.get(SPOOL_ENV_VAR) == spool:
+        os.environ.pop(SPOOL_ENV_VAR, None)
+
+
+def _is_worker() -> bool:
+    return os.environ.get(MAIN_PID_ENV_VAR, str(os.getpid())) != str(os.getpid())
+
+
+def _dump_to_spool():
+    spool = os.environ.get(SPOOL_ENV_VAR)
+    if not spool or not _registry:
+        return
+    with _lock:
+        data = {name: hist.to_dict() for name, hist in _registry.items()}
+    tmp_path = Path(spool) / f".{os.getpid()}.json.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, Path(spool) / f"{os.getpid()}.json")
+
+
+def _reset_after_fork():
+    global _spool_registered
+    _registry.clear()
+    _spool_registered = False
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+if _enabled:
+    enable()  # GENECG_PROFILE=1 in the environment: set up the worker spool as well
+
+
+def record(name: str, seconds: float):
+    """Add one observation to the `name` histogram."""
+    global _spool_registered
+    with _lock:
+        hist = _registry.get(name)
+        if hist is None:
+            hist = _registry[name] = Histogram()
+        hist.observe(seconds)
+    if not _spool_registered and _is_worker():
+        # Worker processes skip atexit, but multiprocessing runs its finalizers on exit
+        mp_util.Finalize(None, _dump_to_spool, exitpriority=10)
+        _spool_registered = True
+
+
+def _sync(device):
+    if device is not None and getattr(device, "type", device) == "cuda":
+        import torch
+
+        torch.cuda.synchronize()
+
+
+class _Stage:
+    __slots__ = ("name", "device", "start", "scope")
+
+    def __init__(self, name: str, device=None):
+        self.name = name
+        self.device = device
+        self.scope = None
+
+    def __enter__(self):
+        if _trace_active:
+            import torch
+
+            self.scope = torch.profiler.record_function(self.name)
+            self.scope.__enter__()
+        _sync(self.device)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _sync(self.device)
+        record(self.name, time.perf_counter() - self.start)
+        if self.scope is not None:
+            self.scope.__exit__(*exc)
+        return False
+
+
+def stage(name: str, device=None):
+    """
+    Time a block as stage `name` (no-op unless profiling is enabled).
+
+    Pass the torch `device` for GPU work so the timer waits for queued kernels.
+    """
+    return _Stage(name, device) if _enabled else _NULL
+
+
+def timed(name: str):
+    """Decorator form of `stage`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def torch_trace(trace_path: Path):
+    """
+    Run the block under torch.profiler and write a Chrome trace (open in chrome://tracing or Perfetto).
+
+    Stage timers inside the block also show up as named ranges in the trace.
+    """
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    global _trace_active
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+
+    _trace_active = True
+    try:
+        with profile(activities=activities) as prof:
+            yield prof
+    finally:
+        _trace_active = False
+    trace_path = Path(trace_path)
+    trace_path.parent.mkdir(parents=True, exist_ok=True)
+    prof.export_chrome_trace(str(trace_path))
+
+
+def snapshot(include_workers: bool = True) -> dict:
+    """Merged histograms {stage: Histogram} from this process and finished worker processes."""
+    with _lock:
+        merged = {}
+        for name, hist in _registry.items():
+            merged[name] = Histogram()
+            merged[name].merge(hist)
+
+    spool = os.environ.get(SPOOL_ENV_VAR)
+    if include_workers and spool and Path(spool).is_dir():
+        for path in Path(spool).glob("*.json"):
+            with open(path) as f:
+                for name, data in json.load(f).items():
+                    merged.setdefault(name, Histogram()).merge(Histogram.from_dict(data))
+    return merged
+
+
+def reset():
+    """Clear this process's histograms and any spooled worker reports."""
+    with _lock:
+        _registry.clear()
+    spool = os.environ.get(SPOOL_ENV_VAR)
+    if spool and Path(spool).is_dir():
+        for path in Path(spool).glob("*.json"):
+            path.unlink(missing_ok=True)
+
+
+def to_json(stats: dict | None = None) -> str:
+    stats = snapshot() if stats is None else stats
+    return json.dumps({
+        "bucket_bounds_s": [b if math.isfinite(b) else "+Inf" for b in BUCKETS],
+        "stages": {name: hist.to_dict() for name, hist in sorted(stats.items())},
+    }, indent=2)
+
+
+def to_prometheus(stats: dict | None = None, metric: str = "genecg_stage_seconds") -> str:
+    """Prometheus text exposition format (one histogram labelled by stage)."""
+    stats = snapshot() if stats is None else stats
+    lines = [
+        f"# HELP {metric} Time spent in each GenECG pipeline stage.",
+        f"# TYPE {metric} histogram",
+    ]
+    for name, hist in sorted(stats.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS, hist.counts):
+            cumulative += n
+            le = "+Inf" if math.isinf(bound) else repr(bound)
+            lines.append(f'{metric}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{stage="{name}"}} {hist.total}')
+        lines.append(f'{metric}_count{{stage="{name}"}} {hist.count}')
+    return "\n".join(lines) + "\n"
+
+
+def format_summary(stats: dict | None = None) -> str:
+    stats = snapshot() if stats is None else stats
+    if not stats:
+        return "No stages recorded."
+    total = sum(h.total for h in stats.values()) or 1.0
+    rows = [f"{'Stage':<28} {'Count':>8} {'Total s':>9} {'Share':>6} {'Mean ms':>9} {'p95 ms':>9} {'Max ms':>9}"]
+    for name, hist in sorted(stats.items(), key=lambda item: -item[1].total):
+        d = hist.to_dict()
+        rows.append(f"{name:<28} {d['count']:>8} {d['total_s']:>9.3f} {hist.total / total:>6.1%} "
+                    f"{d['mean_ms']:>9.2f} {d['p95_ms']:>9.2f} {d['max_ms']:>9.2f}")
+    return "\n".join(rows)
+
+
+def write_report(output_path: Path, stats: dict | None = None):
+    """Write stats as Prometheus text (.prom/.txt) or JSON (anything else)."""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    text = to_prometheus(stats) if output_path.suffix in (".prom", ".txt") else to_json(stats)
+    output_path.write_text(text)
+    return output_path
+
+
+def finish(output_path: Path | None = None):
+    """CLI helper: print the stage summary and optionally export it. No-op when profiling is off."""
+    if not _enabled:
+        return
+    stats = snapshot()
+    print("\n📊 Stage profile")
+    print(format_summary(stats))
+    if output_path is not None:
+        write_report(output_path, stats)
+        print(f"💾 Profile written to {output_path}")
+    # Worker reports are merged into `stats` now; the spool is no longer needed
+    if os.environ.get(SPOOL_ENV_VAR):
+        _remove_spool(os.environ[SPOOL_ENV_VAR])
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+GenECG Diagnostic Inference Server
+==================================
+Keeps the ViT loaded in memory and serves predictions over local HTTP.
+Concurrent requests are grouped into dynamic micro-batches so one forward
+pass scores several uploads, and resubmitted images are answered from a
+content-addressed prediction cache without touching the model.
+
+Usage:
+    python src/serve.py --model runs/vit/vit_multilabel_checkpoint.pt --port 8080
+
+    curl --data-binary @path/to/ecg.png -H "Content-Type: image/png" \
+        "http://127.0.0.1:8080/predict?top_k=5"
+    curl http://127.0.0.1:8080/metrics
+"""
+
+import argparse
+import io
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+    from src.inference import build_transform, load_vit_model, predict_batch, probs_to_results
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+    from src.prediction_cache import PredictionCache, image_key, model_fingerprint
+except ModuleNotFoundError:
+    # Allow running this script directly by making src importable
+    project_root = Path(__file__).resolve().parents[1]
+    if str(project_root) not in sys.path:
+        sys.path.append(str(project_root))
+    from src.inference import build_transform, load_vit_model, predict_batch, probs_to_results
+    from src.Models.backends import BACKENDS, backend_device, load_backend
+    from src.prediction_cache import PredictionCache, image_key, model_fingerprint
+
+
+class MicroBatcher:
+    """
+    Collects single-image requests from many threads into batched forward passes.
+
+    A batch is dispatched as soon as it holds `max_batch_size` images or the
+    oldest queued request has waited `max_wait_ms`, whichever comes first.
+    """
+
+    def __init__(self, model, device: torch.device, max_batch_size: int = 16,
+                 max_wait_ms: float = 10.0, latency_window: int = 1000):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._latencies = deque(maxlen=latency_window)
+        self._batch_sizes = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.requests = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, img_tensor: torch.Tensor) -> Future:
+        """Queue one preprocessed [3, H, W] tensor; the future resolves to its probability row."""
+        future = Future()
+        self._queue.put((img_tensor, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        items = [first]
+        # Requests that queued up while the model was busy go straight into this batch
+        while len(items) < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stop.set()
+                return items
+            items.append(item)
+
+        # Then wait for stragglers until the oldest request has waited max_wait; a backlog
+        # that is already past that point dispatches at once
+        deadline = first[2] + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stop.set()
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while not self._stop.is_set():
+            items = self._collect()
+            if not items:
+                break
+            tensors, futures, enqueued = zip(*items)
+            try:
+                probs = predict_batch(self.model, torch.stack(tensors), self.device)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            with self._lock:
+                self.requests += len(items)
+                self.batches += 1
+                self._batch_sizes.append(len(items))
+                self._latencies.extend(now - t for t in enqueued)
+            for future, row in zip(futures, probs):
+                future.set_result(row)
+
+    def stop(self):
+        self._stop.set()
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000.0
+            batch_sizes = np.array(self._batch_sizes)
+            stats = {
+                "queue_depth": self._queue.qsize(),
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": float(batch_sizes.mean()) if batch_sizes.size else 0.0,
+            }
+        if latencies.size:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats["latency_ms"] = {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        else:
+            stats["latency_ms"] = {"p50": None, "p95": None, "p99": None}
+        return stats
+
+
+def make_handler(batcher: MicroBatcher, snomed_cols: list, default_top_k: int = 10,
+                 cache: PredictionCache = None):
+    """Build a request handler class bound to a running batcher (and optional prediction cache)."""
+    transform = build_transform()
+
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self._send_json(200, {"status": "ok", "num_classes": len(snomed_cols)})
+            elif path == "/metrics":
+                metrics = batcher.metrics()
+                if cache is not None:
+                    metrics["cache"] = cache.stats()
+                self._send_json(200, metrics)
+            else:
+                self._send_json(404, {"error": f"Unknown endpoint: {path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/predict":
+                self._send_json(404, {"error": f"Unknown endpoint: {url.path}"})
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            if length <= 0:
+                self._send_json(400, {"error": "Request body must contain the image bytes"})
+                return
+
+            try:
+                top_k = int(parse_qs(url.query).get("top_k", [default_top_k])[0])
+            except ValueError as e:
+                self._send_json(400, {"error": f"Invalid top_k: {e}"})
+                return
+
+            data = self.rfile.read(length)
+            key = None
+            if cache is not None:
+                key = image_key(data)
+                probs = cache.get(key)
+                if probs is not None:
+                    self._send_json(200, {"predictions": probs_to_results(probs, snomed_cols, top_k)},
+                                    headers={"X-Cache": "hit"})
+                    return
+
+            try:
+                image = Image.open(io.BytesIO(data)).convert("RGB")
+                img_tensor = transform(image)
+            except Exception as e:
+                self._send_json(400, {"error": f"Could not decode image: {e}"})
+                return
+
+            try:
+                probs = batcher.submit(img_tensor).result()
+            except Exception as e:
+                self._send_json(500, {"error": f"Inference failed: {e}"})
+                return
+
+            if key is not None:
+                cache.put(key, probs)
+            self._send_json(200, {"predictions": probs_to_results(probs, snomed_cols, top_k)},
+                            headers={"X-Cache": "miss"} if cache is not None else None)
+
+        def log_message(self, format, *args):
+            # Request logging on every call would dominate the console under load
+            pass
+
+    return InferenceHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GenECG Diagnostic Inference Server")
+    parser.add_argument("--model", type=str,
+                        default="runs/vit/vit_multilabel_checkpoint.pt",
+                        help="Path to ViT checkpoint (or exported .ts/.onnx for those backends)")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32",
+                        help="Inference backend: eager fp32, dynamic int8, TorchScript or ONNX Runtime")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Bind address")
+    parser.add_argument("--port", type=int, default=8080, help="Bind port")
+    parser.add_argument("--max-batch-size", type=int, default=16,
+                        help="Maximum images per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0,
+                        help="Maximum time a request waits for a batch to fill")
+    parser.add_argument("--top-k", type=int, default=10,
+                        help="Default number of predictions returned per image")
+    parser.add_argument("--cache-size-mb", type=float, default=64,
+                        help="In-memory prediction cache size (0 disables the cache)")
+    parser.add_argument("--cache-db", type=str, default=None,
+                        help="SQLite file backing the prediction cache across restarts")
+    args = parser.parse_args()
+
+    if not Path(args.model).exists():
+        print(f"❌ Model not found: {args.model}")
+        sys.exit(1)
+
+    device = backend_device(args.backend)
+    print(f"🖥️  Using device: {device} ({args.backend} backend)")
+
+    model, snomed_cols = load_backend(args.backend, args.model, device, load_fp32=load_vit_model)
+    print(f"✅ Model loaded with {len(snomed_cols)} SNOMED classes")
+
+    cache = None
+    if args.cache_size_mb > 0:
+        cache = PredictionCache(model_fingerprint(args.model, snomed_cols, args.backend),
+                                max_bytes=int(args.cache_size_mb * (1 << 20)), disk_path=args.cache_db)
+        print(f"⚡ Prediction cache: {args.cache_size_mb:.0f} MB in memory"
+              + (f", persisted to {args.cache_db}" if args.cache_db else ""))
+
+    batcher = MicroBatcher(model, device, args.max_batch_size, args.max_wait_ms)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher, snomed_cols, args.top_k, cache))
+    print(f"🚀 Serving on http://{args.host}:{args.port} "
+          f"(max batch {args.max_batch_size}, max wait {args.max_wait_ms:.0f} ms)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Shutting down...")
+    finally:
+        server.server_close()
+        batcher.stop()
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()